@@ -8,15 +8,17 @@ import datetime
 import logging
 import warnings
 
+from flask import Response, stream_with_context
 from sqlalchemy.types import ARRAY as Array
 from sqlalchemy import Column, DateTime, String, Integer, Float, ForeignKey
 from sqlalchemy.types import JSON
 from sqlalchemy.orm import relationship, backref
-from sqlalchemy import event
+from sqlalchemy import event, func
 from sqlalchemy import DDL
 
 from manager.setup import db, Base
 from manager.question import Question
+from manager.answer_summary import generate_summary
 
 logger = logging.getLogger(__name__)
 
@@ -88,22 +90,57 @@ class Answerset(db.Model):
         response_code
         result_list
         '''
-        keys = self.__mapper__._props.keys()+[k for k in self.__dict__.keys() if not k.startswith('_')]
-        struct = {key:getattr(self, key) for key in keys}
-        if 'timestamp' in struct:
-            struct['timestamp'] = struct['timestamp'].isoformat()
+        output = self.standard_header()
+        output['result_list'] = [a.toStandard() for a in self.iter_answers()] if data else None
+        return output
 
-        natural_question = struct['misc_info']['natural_question'] if 'mics_info' in struct else None
-        output = {
+    def num_answers(self):
+        '''Number of answers, counted in the database unless they are loaded already.'''
+        if 'answers' in self.__dict__ or self.id is None:
+            return len(self.answers)
+        return db.session.query(func.count(Answer.id)).filter(Answer.answerset_id == self.id).scalar()
+
+    def iter_answers(self, batch_size=100):
+        '''Answers by descending score, read from the database batch_size at a time.'''
+        if 'answers' in self.__dict__ or self.id is None:
+            return iter(self.answers)
+        return Answer.query.filter(Answer.answerset_id == self.id)\
+            .order_by(Answer.score.desc())\
+            .yield_per(batch_size)
+
+    def standard_header(self):
+        '''toStandard without result_list; does no per-answer work.'''
+        num_answers = self.num_answers()
+        # set from the uploaded JSON only; answersets loaded from the database have none
+        misc_info = getattr(self, 'misc_info', None) or {}
+        return {
             'context': 'context',
-            'datetime': struct['timestamp'],
-            'id': struct['id'],
-            'message': f"{len(self.answers)} potential answers found.",
-            'original_question_text': natural_question,\
-            'response_code': 'OK' if self.answers else 'EMPTY',
-            'result_list': [a.toStandard() for a in self.answers] if data else None
+            'datetime': self.timestamp.isoformat() if self.timestamp else None,
+            'id': self.id,
+            'message': f"{num_answers} potential answers found.",
+            'original_question_text': misc_info.get('natural_question'),
+            'response_code': 'OK' if num_answers else 'EMPTY',
         }
-        return output
+
+    def iter_standard(self, data=True):
+        '''
+        toStandard as chunks of JSON text, one answer at a time, so only one
+        answer is held in memory.
+        '''
+        header = self.standard_header()
+        if not data:
+            header['result_list'] = None
+            yield json.dumps(header)
+            return
+        # the header without its closing brace, then the answers
+        yield json.dumps(header)[:-1] + ', "result_list": ['
+        for i, answer in enumerate(self.iter_answers()):
+            yield (', ' if i else '') + json.dumps(answer.toStandard())
+        yield ']}'
+
+    def standard_response(self, data=True):
+        '''Chunked application/json response of toStandard.'''
+        return Response(stream_with_context(self.iter_standard(data)), mimetype='application/json')
 
     def __getitem__(self, key):
         return self.answers[key]
@@ -227,34 +264,6 @@ class Answer(db.Model):
         }
         return output
 
-def generate_summary(nodes, edges):
-    # assume that the first node is at one end
-    logger.debug(nodes)
-    logger.debug(edges)
-    summary = nodes[0]['name']
-    latest_node_id = nodes[0]['id']
-    node_ids = [n['id'] for n in nodes]
-    edges = [e for e in edges if not e['type'] == 'literature_co-occurrence']
-    edge_starts = [e['source_id'] for e in edges]
-    edge_ends = [e['target_id'] for e in edges]
-    edge_predicates = [e['type'] for e in edges]
-    while True:
-        if latest_node_id in edge_starts:
-            idx = edge_starts.index(latest_node_id)
-            edge_starts.pop(idx)
-            latest_node_id = edge_ends.pop(idx)
-            latest_node = nodes[node_ids.index(latest_node_id)]
-            summary += f" -{edge_predicates.pop(idx)}-> {latest_node['name']}"
-        elif latest_node_id in edge_ends:
-            idx = edge_ends.index(latest_node_id)
-            edge_ends.pop(idx)
-            latest_node_id = edge_starts.pop(idx)
-            latest_node = nodes[node_ids.index(latest_node_id)]
-            summary += f" <-{edge_predicates.pop(idx)}- {latest_node['name']}"
-        else:
-            break
-    return summary
-
 def standardize_edge(edge):
     '''
     confidence
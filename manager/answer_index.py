@@ -0,0 +1,388 @@
+'''
+Inverted index from knowledge graph ids to the answers that bind them
+
+The index is built once, while a message is stored, from the same ijson
+event walk that validates the upload. It is written next to the message
+as a directory of .npy arrays that are memory-mapped when read:
+
+    VERSION             INDEX_VERSION of the code that wrote the index
+    qnode_ids           question node ids, in question graph order
+    answer_scores       float64 score of every answer
+    answer_order        answer indices by descending score (stable)
+    node_ids            KG node ids (utf-8), sorted
+    node_kg_index       position in knowledge_graph.nodes of each sorted id
+    node_offsets        postings of KG node k are [node_offsets[k], node_offsets[k+1])
+    node_answers        answer index of every node posting
+    node_qnodes         qnode index of every node posting
+    edge_ids            KG edge ids (utf-8), sorted
+    edge_kg_index       position in knowledge_graph.edges of each sorted id
+    edge_offsets        postings of KG edge k, as for nodes
+    edge_answers        answer index of every edge posting
+    edge_source         KG node position of the source of every KG edge (-1 if absent)
+    edge_target         KG node position of the target of every KG edge (-1 if absent)
+    node_degree         number of KG edge ends at every KG node
+    node_type_qnode     qnode whose type every KG node takes, -1 if it keeps its own
+
+Node and edge offsets are in knowledge graph order, so looking up an id is a
+binary search in the sorted ids followed by one slice of the postings.
+
+node_type_qnode is the viewer's type annotation, worked out once: KG nodes
+whose type is a list, or that have labels but no type, take the type of
+the qnode that binds them in the most answers (ties to the first qnode,
+unbound nodes to qnode 0). The walk only sees that a type is a container
+or null, so a null type is annotated like a list.
+'''
+
+import os
+import logging
+from array import array
+from functools import cached_property
+
+import ijson
+import numpy as np
+
+from manager.array_store import write_dir_atomically, save_arrays, utf8_array
+from manager.compression import open_decoded
+from manager.message_schema import ITEM, ANY, validate_events
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever the arrays change; older indexes are rebuilt on first use.
+INDEX_VERSION = 4
+
+# what IndexBuilder sees of the type of a KG node
+_TYPED = 1
+_UNTYPED = 2
+_LABELED = 4
+
+
+class IndexBuilder():
+    '''
+    Collects what the index needs while a message is walked.
+
+    view_store.validate_events calls observe() for every value on a path of
+    its schema. Ids are interned as they arrive and resolved against the
+    question and knowledge graphs at the end, so the order of the top level
+    keys in the message does not matter.
+    '''
+
+    def __init__(self):
+        self.qnode_ids = []
+        self.kg_node_ids = []
+        self.kg_edge_ids = []
+        self.kg_edge_ends = ([], [])
+        # _TYPED | _UNTYPED | _LABELED flags of every KG node
+        self.kg_node_flags = array('b')
+        self.scores = array('d')
+        self.keys = {}
+        self.ids = {}
+        # flat binding lists: answer index, interned key, interned id
+        self.node_bindings = (array('q'), array('q'), array('q'))
+        self.edge_bindings = (array('q'), array('q'))
+        self._handlers = {
+            ('answers', ITEM): self._answer,
+            ('answers', ITEM, 'score'): self._score,
+            ('answers', ITEM, 'node_bindings', ANY): self._node_binding,
+            ('answers', ITEM, 'node_bindings', ANY, ITEM): self._node_binding,
+            ('answers', ITEM, 'edge_bindings', ANY): self._edge_binding,
+            ('answers', ITEM, 'edge_bindings', ANY, ITEM): self._edge_binding,
+            ('knowledge_graph', 'nodes', ITEM): self._kg_node_start,
+            ('knowledge_graph', 'nodes', ITEM, 'id'): self._kg_node,
+            ('knowledge_graph', 'nodes', ITEM, 'type'): self._kg_node_type,
+            ('knowledge_graph', 'nodes', ITEM, 'labels'): self._kg_node_labels,
+            ('knowledge_graph', 'edges', ITEM, 'id'): self._kg_edge,
+            ('knowledge_graph', 'edges', ITEM, 'source_id'): self._kg_edge_source,
+            ('knowledge_graph', 'edges', ITEM, 'target_id'): self._kg_edge_target,
+            ('question_graph', 'nodes', ITEM, 'id'): self._qnode,
+        }
+
+    def _intern(self, table, value):
+        index = table.get(value)
+        if index is None:
+            index = table[value] = len(table)
+        return index
+
+    def observe(self, schema_key, path, value):
+        '''Record value (None for containers) found at path, which matches schema_key.'''
+        handler = self._handlers.get(schema_key)
+        if handler is not None:
+            handler(path, value)
+
+    def _qnode(self, path, value):
+        self.qnode_ids.append(value)
+
+    def _kg_node_start(self, path, value):
+        self.kg_node_flags.append(0)
+
+    def _kg_node(self, path, value):
+        self.kg_node_ids.append(value)
+
+    def _kg_node_type(self, path, value):
+        # lists (and maps and nulls, which arrive as None too) need a type
+        self.kg_node_flags[-1] |= _UNTYPED if value is None else _TYPED
+
+    def _kg_node_labels(self, path, value):
+        self.kg_node_flags[-1] |= _LABELED
+
+    def _kg_edge(self, path, value):
+        self.kg_edge_ids.append(value)
+
+    def _kg_edge_source(self, path, value):
+        self.kg_edge_ends[0].append(value)
+
+    def _kg_edge_target(self, path, value):
+        self.kg_edge_ends[1].append(value)
+
+    def _answer(self, path, value):
+        self.scores.append(0.0)
+
+    def _score(self, path, value):
+        if value is not None:
+            self.scores[-1] = float(value)
+
+    def _node_binding(self, path, value):
+        # the binding list itself arrives as None before its elements
+        if value is None:
+            return
+        answers, keys, ids = self.node_bindings
+        answers.append(len(self.scores) - 1)
+        keys.append(self._intern(self.keys, path[3]))
+        ids.append(self._intern(self.ids, value))
+
+    def _edge_binding(self, path, value):
+        if value is None:
+            return
+        answers, ids = self.edge_bindings
+        answers.append(len(self.scores) - 1)
+        ids.append(self._intern(self.ids, value))
+
+    def _kg_lookup(self, kg_ids):
+        '''Map interned ids to KG positions (-1 if absent); the last duplicate id wins.'''
+        lookup = np.full(len(self.ids), -1, dtype=np.int64)
+        for k, kg_id in enumerate(kg_ids):
+            interned = self.ids.get(kg_id)
+            if interned is not None:
+                lookup[interned] = k
+        return lookup
+
+    def write(self, directory):
+        '''Write the index arrays into directory, which appears atomically once complete.'''
+        num_answers = len(self.scores)
+        qnode_index = {qnode_id: q for q, qnode_id in enumerate(self.qnode_ids)}
+        key_to_qnode = np.full(len(self.keys), -1, dtype=np.int64)
+        for key, interned in self.keys.items():
+            key_to_qnode[interned] = qnode_index.get(key, -1)
+
+        answers, keys, ids = (np.frombuffer(a, dtype=np.int64) for a in self.node_bindings)
+        kg = self._kg_lookup(self.kg_node_ids)[ids]
+        qnodes = key_to_qnode[keys]
+        keep = (kg >= 0) & (qnodes >= 0)
+        node_postings = _unique_postings(len(self.kg_node_ids), kg[keep], answers[keep], qnodes[keep])
+
+        answers, ids = (np.frombuffer(a, dtype=np.int64) for a in self.edge_bindings)
+        kg = self._kg_lookup(self.kg_edge_ids)[ids]
+        keep = kg >= 0
+        edge_postings = _unique_postings(len(self.kg_edge_ids), kg[keep], answers[keep])
+
+        scores = np.frombuffer(self.scores, dtype=np.float64)
+        arrays = {
+            'qnode_ids': utf8_array(self.qnode_ids),
+            'answer_scores': scores,
+            'answer_order': np.argsort(-scores, kind='stable').astype(_index_dtype(num_answers)),
+            'node_offsets': node_postings[0],
+            'node_answers': node_postings[1].astype(_index_dtype(num_answers)),
+            'node_qnodes': node_postings[2].astype(np.int16),
+            'edge_offsets': edge_postings[0],
+            'edge_answers': edge_postings[1].astype(_index_dtype(num_answers)),
+        }
+        kg_node_index = {kg_id: k for k, kg_id in enumerate(self.kg_node_ids)}
+        for name, ends in zip(('edge_source', 'edge_target'), self.kg_edge_ends):
+            arrays[name] = np.array([kg_node_index.get(i, -1) for i in ends], dtype=np.int64)
+        ends = np.concatenate([arrays['edge_source'], arrays['edge_target']])
+        arrays['node_degree'] = np.bincount(ends[ends >= 0], minlength=len(self.kg_node_ids))
+        arrays['node_type_qnode'] = self._type_qnodes(node_postings, kg_node_index)
+        arrays['node_ids'], arrays['node_kg_index'] = _sorted_ids(self.kg_node_ids)
+        arrays['edge_ids'], arrays['edge_kg_index'] = _sorted_ids(self.kg_edge_ids)
+
+        write_dir_atomically(directory, lambda tmp: save_arrays(tmp, arrays, INDEX_VERSION))
+        logger.info(f'Indexed {num_answers} answers: {len(node_postings[1])} node and {len(edge_postings[1])} edge postings')
+
+
+    def _type_qnodes(self, node_postings, kg_node_index):
+        '''node_type_qnode, from the node postings in one pass.'''
+        num_kg_nodes = len(self.kg_node_ids)
+        num_qnodes = len(self.qnode_ids)
+        if not num_qnodes:
+            return np.full(num_kg_nodes, -1, dtype=np.int16)
+        offsets, _, qnodes = node_postings
+        kg_inds = np.repeat(np.arange(num_kg_nodes, dtype=np.int64), np.diff(offsets))
+        counts = np.bincount(kg_inds * num_qnodes + qnodes, minlength=num_kg_nodes * num_qnodes)
+        majority = np.argmax(counts.reshape(num_kg_nodes, num_qnodes), axis=1)
+        # duplicate ids share the postings of the last one
+        majority = majority[[kg_node_index[kg_id] for kg_id in self.kg_node_ids]]
+
+        flags = np.frombuffer(self.kg_node_flags, dtype=np.int8)
+        untyped = (flags & _UNTYPED).astype(bool) | ((flags & (_TYPED | _LABELED)) == _LABELED)
+        return np.where(untyped, majority, -1).astype(np.int16)
+
+
+def build_index(message_file, directory):
+    '''
+    Validate a message file, in any content coding, and write its index
+    into directory. Returns the AnswerIndex. Uploads are indexed by
+    view_store while they are received; this is for messages already on disk.
+    '''
+    builder = IndexBuilder()
+    with open_decoded(message_file) as f:
+        validate_events(ijson.basic_parse(f), builder.observe)
+    builder.write(directory)
+    return AnswerIndex(directory)
+
+
+def _index_dtype(count):
+    return np.int32 if count < 2**31 else np.int64
+
+
+def _sorted_ids(kg_ids):
+    '''Sorted distinct ids and, for each, its (last) position in kg_ids.'''
+    encoded = utf8_array(kg_ids)
+    # the stable sort of the reversed list puts the last duplicate first
+    order = len(encoded) - 1 - np.argsort(encoded[::-1], kind='stable')
+    encoded = encoded[order]
+    first = np.ones(len(encoded), dtype=bool)
+    first[1:] = encoded[1:] != encoded[:-1]
+    return encoded[first], order[first].astype(np.int64)
+
+
+def _unique_postings(num_keys, keys, *columns):
+    '''CSR offsets plus the distinct (key, *columns) rows sorted by key then columns.'''
+    rows = np.unique(np.stack([keys, *columns], axis=1), axis=0) if len(keys) else np.zeros((0, 1 + len(columns)), dtype=np.int64)
+    offsets = np.zeros(num_keys + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows[:, 0], minlength=num_keys), out=offsets[1:])
+    return (offsets, *(rows[:, i + 1] for i in range(len(columns))))
+
+
+class AnswerIndex():
+    '''Read-only, memory-mapped view of an index directory.'''
+
+    def __init__(self, directory):
+        def load(name):
+            return np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r')
+
+        self.qnode_ids = [q.decode('utf-8') for q in load('qnode_ids')]
+        self.answer_scores = load('answer_scores')
+        self.answer_order = load('answer_order')
+        self.node_ids = load('node_ids')
+        self.node_kg_index = load('node_kg_index')
+        self.node_offsets = load('node_offsets')
+        self.node_answers = load('node_answers')
+        self.node_qnodes = load('node_qnodes')
+        self.edge_ids = load('edge_ids')
+        self.edge_kg_index = load('edge_kg_index')
+        self.edge_offsets = load('edge_offsets')
+        self.edge_answers = load('edge_answers')
+        self.edge_source = load('edge_source')
+        self.edge_target = load('edge_target')
+        self.node_degree = load('node_degree')
+        self.node_type_qnode = load('node_type_qnode')
+
+    @property
+    def num_answers(self):
+        return len(self.answer_scores)
+
+    @property
+    def num_kg_nodes(self):
+        return len(self.node_offsets) - 1
+
+    @property
+    def num_kg_edges(self):
+        return len(self.edge_offsets) - 1
+
+    @staticmethod
+    def _find(sorted_ids, kg_index, kg_id):
+        key = np.bytes_(kg_id.encode('utf-8'))
+        i = int(np.searchsorted(sorted_ids, key))
+        if i < len(sorted_ids) and sorted_ids[i] == key:
+            return int(kg_index[i])
+        return None
+
+    def kg_node_index(self, node_id):
+        '''Position of node_id in knowledge_graph.nodes, or None.'''
+        return self._find(self.node_ids, self.node_kg_index, node_id)
+
+    def kg_edge_index(self, edge_id):
+        '''Position of edge_id in knowledge_graph.edges, or None.'''
+        return self._find(self.edge_ids, self.edge_kg_index, edge_id)
+
+    def node_postings(self, node_id):
+        '''(answer indices, qnode indices) binding node_id. Raises KeyError for unknown ids.'''
+        k = self.kg_node_index(node_id)
+        if k is None:
+            raise KeyError(node_id)
+        start, end = self.node_offsets[k], self.node_offsets[k + 1]
+        return self.node_answers[start:end], self.node_qnodes[start:end]
+
+    def edge_postings(self, edge_id):
+        '''Answer indices binding edge_id. Raises KeyError for unknown ids.'''
+        k = self.kg_edge_index(edge_id)
+        if k is None:
+            raise KeyError(edge_id)
+        return self.edge_answers[self.edge_offsets[k]:self.edge_offsets[k + 1]]
+
+    def annotated_nodes(self, nodes, positions, qnodes):
+        '''
+        The KG nodes at positions, as nodes, with the types the index
+        assigns them (see node_type_qnode). Nodes that keep their own type
+        are returned as they are, the others as typed copies.
+        '''
+        if not qnodes:
+            return list(nodes)
+        type_qnodes = self.node_type_qnode[np.asarray(positions, dtype=np.int64)].tolist() if len(positions) else []
+        return [
+            node if q < 0 or node is None else dict(node, type=qnodes[q]['type'])
+            for node, q in zip(nodes, type_qnodes)]
+
+    def node_types(self, qnodes):
+        '''
+        {KG node id: type} of the nodes annotated_nodes retypes, for
+        clients that already have the knowledge graph.
+        '''
+        if not qnodes:
+            return {}
+        type_qnodes = np.asarray(self.node_type_qnode)[np.asarray(self.node_kg_index)]
+        retyped = np.flatnonzero(type_qnodes >= 0)
+        return {
+            self.node_ids[k].decode('utf-8'): qnodes[q]['type']
+            for k, q in zip(retyped.tolist(), type_qnodes[retyped].tolist())}
+
+    @cached_property
+    def _answer_major(self):
+        # node postings as (answer, qnode, KG node) arrays ordered by answer,
+        # and where each answer's postings start
+        answers, qnodes, kg_inds = self.binding_postings()
+        order = np.argsort(answers, kind='stable')
+        offsets = np.zeros(self.num_answers + 1, dtype=np.int64)
+        np.cumsum(np.bincount(answers, minlength=self.num_answers), out=offsets[1:])
+        return (answers[order], qnodes[order], kg_inds[order]), offsets
+
+    def answer_postings(self, answers):
+        '''
+        The node postings of the given answer indices as (answer, qnode,
+        KG node) index arrays, read without touching the other answers.
+        The answer-major copy of the postings is built on first use.
+        '''
+        postings, offsets = self._answer_major
+        answers = np.asarray(answers, dtype=np.int64)
+        starts = offsets[answers]
+        lengths = offsets[answers + 1] - starts
+        ends = np.cumsum(lengths)
+        selected = np.repeat(starts - ends + lengths, lengths) + np.arange(ends[-1] if len(ends) else 0)
+        return tuple(column[selected] for column in postings)
+
+    def binding_postings(self):
+        '''All node postings as (answer, qnode, KG node) index arrays.'''
+        kg_inds = np.repeat(np.arange(self.num_kg_nodes, dtype=np.int64), np.diff(self.node_offsets))
+        return (
+            np.asarray(self.node_answers, dtype=np.int64),
+            np.asarray(self.node_qnodes, dtype=np.int64),
+            kg_inds)
@@ -0,0 +1,216 @@
+'''
+One-line text summary of an answer graph, e.g.
+
+    ebola -causes-> fever <-treats- aspirin
+
+generate_summary walks the answer from its first node. At every node it
+takes the first unused edge leaving the node, or failing that the first
+unused edge entering it, in answer order. Edges are looked up in
+adjacency lists that are consumed as the walk goes, so a walk is linear in
+the size of the answer.
+
+Answers that are not a simple path are summarized too:
+
+  * Set nodes. When the edge taken has siblings (unused edges from the
+    same node, in the same direction, with the same predicate, to nodes
+    of the same type), their nodes are listed together, as in
+    "drug -treats-> {fever, cough}". The matching edges of the other
+    members are folded into the next step.
+  * Branches. Edges left over when the walk ends are walked again from
+    the earliest visited node that still has some, and appended after
+    "; ".
+
+Literature co-occurrence edges are left out.
+
+Answers of up to PATH_EDGES edges, the usual case, are first walked over
+plain lists, which costs less than building adjacency lists for so few
+edges. That walk gives up on anything but a simple path.
+'''
+
+# the most edges walked over plain lists before building adjacency lists
+PATH_EDGES = 16
+
+
+class _Graph():
+    '''
+    The edges of an answer with, for every node, its unused edges leaving
+    and entering it. Each list is in reverse answer order, so the next
+    edge to take is popped off the end.
+    '''
+    __slots__ = ('nodes', 'edges', 'used', 'num_unused', 'leaving', 'entering')
+
+    def __init__(self, nodes, edges):
+        self.nodes = by_id = {}
+        for node in nodes:
+            if node['id'] not in by_id:
+                by_id[node['id']] = node
+        self.edges = edges = [e for e in edges if not e['type'] == 'literature_co-occurrence']
+        self.used = [False] * len(edges)
+        self.num_unused = len(edges)
+        self.leaving = leaving = {}
+        self.entering = entering = {}
+        for i in range(len(edges) - 1, -1, -1):
+            edge = edges[i]
+            source = edge['source_id']
+            target = edge['target_id']
+            if source in leaving:
+                leaving[source].append(i)
+            else:
+                leaving[source] = [i]
+            if target in entering:
+                entering[target].append(i)
+            else:
+                entering[target] = [i]
+
+    def name(self, node_id):
+        return self.nodes[node_id]['name'] if node_id in self.nodes else node_id
+
+    def node_type(self, node_id):
+        return self.nodes[node_id].get('type') if node_id in self.nodes else None
+
+    def has_edges(self, edge_list):
+        used = self.used
+        while edge_list and used[edge_list[-1]]:
+            edge_list.pop()
+        return bool(edge_list)
+
+    def take_matching(self, edge_list, far_key, predicate, member_type, member_set):
+        '''
+        Use up the edges in edge_list with predicate whose far end has
+        member_type, or is in member_set. Returns their far ends.
+        '''
+        ends = []
+        for i in reversed(edge_list):
+            edge = self.edges[i]
+            if self.used[i] or edge['type'] != predicate:
+                continue
+            end = edge[far_key]
+            if (end in member_set) if member_set is not None else (self.node_type(end) == member_type):
+                self.used[i] = True
+                self.num_unused -= 1
+                ends.append(end)
+        return ends
+
+    def walk(self, start, visited):
+        '''Summary of the walk from start, using up the edges it takes.'''
+        edges = self.edges
+        used = self.used
+        leaving = self.leaving
+        entering = self.entering
+        text = self.name(start)
+        node_id = start
+        current = None  # the members, while at a set node
+        while True:
+            far_key = 'target_id'
+            edge_list = leaving.get(node_id)
+            while edge_list and used[edge_list[-1]]:
+                edge_list.pop()
+            if not edge_list:
+                far_key = 'source_id'
+                edge_list = entering.get(node_id)
+                while edge_list and used[edge_list[-1]]:
+                    edge_list.pop()
+                if not edge_list:
+                    return text
+            i = edge_list.pop()
+            edge = edges[i]
+            predicate = edge['type']
+            used[i] = True
+            self.num_unused -= 1
+            node_id = edge[far_key]
+            members = None
+            if edge_list:
+                siblings = self.take_matching(edge_list, far_key, predicate, self.node_type(node_id), None)
+                if siblings:
+                    members = list(dict.fromkeys([node_id] + siblings))
+            if current is not None:
+                adjacency = leaving if far_key == 'target_id' else entering
+                member_set = set(members) if members is not None else {node_id}
+                for other in current[1:]:
+                    self.take_matching(adjacency.get(other, ()), far_key, predicate, None, member_set)
+            current = members
+
+            if members is None:
+                visited.append(node_id)
+                names = self.name(node_id)
+            else:
+                visited.extend(members)
+                names = '{' + ', '.join(self.name(m) for m in members) + '}'
+            if far_key == 'target_id':
+                text += f" -{predicate}-> {names}"
+            else:
+                text += f" <-{predicate}- {names}"
+
+
+def _path_summary(nodes, edges):
+    '''
+    Summary of a small answer that is a simple path from its first node,
+    or None if the walk meets a set node, a branch or an unknown node.
+    '''
+    node_ids = [n['id'] for n in nodes]
+    edges = [e for e in edges if not e['type'] == 'literature_co-occurrence']
+    edge_starts = [e['source_id'] for e in edges]
+    edge_ends = [e['target_id'] for e in edges]
+    edge_predicates = [e['type'] for e in edges]
+    node_id = node_ids[0]
+    summary = nodes[0]['name']
+    while True:
+        if node_id in edge_starts:
+            near, far, arrow = edge_starts, edge_ends, '->'
+        elif node_id in edge_ends:
+            near, far, arrow = edge_ends, edge_starts, '<-'
+        else:
+            break
+        idx = near.index(node_id)
+        near.pop(idx)
+        predicate = edge_predicates.pop(idx)
+        # another edge from here with the same predicate may make a set node
+        if node_id in near and predicate in edge_predicates:
+            i = idx
+            while node_id in near[i:]:
+                i = near.index(node_id, i)
+                if edge_predicates[i] == predicate:
+                    return None
+                i += 1
+        node_id = far.pop(idx)
+        try:
+            name = nodes[node_ids.index(node_id)]['name']
+        except ValueError:
+            return None
+        if arrow == '->':
+            summary += f" -{predicate}-> {name}"
+        else:
+            summary += f" <-{predicate}- {name}"
+    return None if edge_starts else summary
+
+
+def _walk_summary(nodes, edges):
+    '''Summary of any answer, walked over adjacency lists.'''
+    graph = _Graph(nodes, edges)
+    # assume that the first node is at one end
+    visited = [nodes[0]['id']]
+    summary = graph.walk(nodes[0]['id'], visited)
+
+    # branches, from the earliest visited node that has edges left
+    v = 0
+    while graph.num_unused:
+        while v < len(visited) and not graph.has_edges(graph.leaving.get(visited[v])) \
+                and not graph.has_edges(graph.entering.get(visited[v])):
+            v += 1
+        if v < len(visited):
+            start = visited[v]
+        else:
+            # not connected to anything visited
+            start = graph.edges[graph.used.index(False)]['source_id']
+            visited.append(start)
+        summary += '; ' + graph.walk(start, visited)
+    return summary
+
+
+def generate_summary(nodes, edges):
+    '''Text summary of an answer given as lists of nodes and edges.'''
+    if len(edges) <= PATH_EDGES:
+        summary = _path_summary(nodes, edges)
+        if summary is not None:
+            return summary
+    return _walk_summary(nodes, edges)
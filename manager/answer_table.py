@@ -0,0 +1,136 @@
+'''
+Server-rendered pages of the answer table
+
+Builds the same rows as messageAnswersetStore.answerSetTableData, but only
+for one page of answers taken from the index's precomputed score order.
+'''
+
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def entity_name_display(name):
+    '''Port of util/entityNameDisplay.js: "genetic_condition" -> "Genetic Condition".'''
+    name = name.replace('_', ' ')
+    return re.sub(r'(?!or\b)\b\w+', lambda m: m.group(0)[0].upper() + m.group(0)[1:].lower(), name)
+
+
+def header_info(question_graph):
+    '''Column descriptions for the question nodes.'''
+    return [
+        {
+            'Header': f"{n['id']}: {entity_name_display(n.get('type', ''))}",
+            'id': n['id'],
+            'isSet': bool(n.get('set')),
+            'type': n.get('type'),
+        }
+        for n in question_graph['nodes']
+    ]
+
+
+def page_order(index, offset, limit, descending=True):
+    '''Answer indices of one page, by score.'''
+    order = index.answer_order if descending else index.answer_order[::-1]
+    return [int(i) for i in order[offset:offset + limit]]
+
+
+def _as_list(ids):
+    return ids if isinstance(ids, list) else [ids]
+
+
+def table_page(message, index, offset, limit, descending=True):
+    '''
+    One page of answer table rows with their header info.
+
+    message is a stored message (see view_store.open_message) and index its
+    AnswerIndex. Only the KG nodes and edges bound by the page are touched.
+    '''
+    qnodes = message.question_graph['nodes']
+    qedges = message.question_graph['edges']
+    answer_inds = page_order(index, offset, limit, descending)
+    answers = message.answers(answer_inds)
+
+    node_ids = {i for a in answers for ids in a['node_bindings'].values() for i in _as_list(ids)}
+    edge_ids = {i for a in answers for ids in a['edge_bindings'].values() for i in _as_list(ids)}
+    node_ids = sorted(node_ids)
+    edge_ids = sorted(edge_ids)
+    kg_nodes = message.kg_nodes(node_ids)
+    # unknown ids have neither a node nor a position
+    positions = [index.kg_node_index(i) if n is not None else 0 for i, n in zip(node_ids, kg_nodes)]
+    nodes = dict(zip(node_ids, index.annotated_nodes(kg_nodes, positions, qnodes)))
+    edges = dict(zip(edge_ids, message.kg_edges(edge_ids)))
+
+    rows = []
+    for answer_ind, answer in zip(answer_inds, answers):
+        row = {
+            'score': answer.get('score'),
+            'nodes': {},
+            'edges': {},
+            'id': answer.get('id', answer_ind),
+        }
+        for qnode in qnodes:
+            row['nodes'][qnode['id']] = _node_cell(qnode, answer['node_bindings'].get(qnode['id']), nodes)
+        for qedge in qedges:
+            bound = answer['edge_bindings'].get(qedge.get('id'), [])
+            row['edges'][qedge.get('id')] = [edges.get(i) for i in _as_list(bound)]
+        rows.append(row)
+
+    return {
+        'headerInfo': header_info(message.question_graph),
+        'answers': rows,
+        'offset': offset,
+        'total': message.num_answers,
+    }
+
+
+def _node_cell(qnode, bound, nodes):
+    qnode_type = qnode.get('type')
+    is_set_qnode = bool(qnode.get('set'))
+    if bound is None:
+        return {'type': qnode_type, 'isSet': False}
+    if not isinstance(bound, list) and not is_set_qnode:
+        return {'type': qnode_type, 'isSet': False, **(nodes.get(bound) or {})}
+    if isinstance(bound, list) and len(bound) == 1 and 'set' in qnode and not is_set_qnode:
+        # not a set, but sent as a one element list
+        return {'type': qnode_type, 'isSet': False, **(nodes.get(bound[0]) or {})}
+    return {
+        'type': qnode_type,
+        'name': f'Set: {entity_name_display(qnode_type or "")}',
+        'isSet': True,
+        'setNodes': [nodes.get(i) for i in _as_list(bound)],
+    }
+
+
+def answer_graph(message, answer_index):
+    '''
+    The subgraph of one answer, as messageAnswersetStore.activeAnswerGraph
+    builds it: every bound KG node, typed by its question node and marked
+    with its binding and whether it is a set, and every bound KG edge,
+    support edges included, marked with its binding.
+    '''
+    qnode_types = {n['id']: n.get('type') for n in message.question_graph['nodes']}
+    answer = message.answers([answer_index])[0]
+    node_bindings = [(key, _as_list(ids), isinstance(ids, list)) for key, ids in answer['node_bindings'].items()]
+    edge_bindings = [(key, _as_list(ids)) for key, ids in answer['edge_bindings'].items()]
+    node_ids = [i for _, ids, _ in node_bindings for i in ids]
+    edge_ids = [i for _, ids in edge_bindings for i in ids]
+    nodes = iter(message.kg_nodes(node_ids))
+    edges = iter(message.kg_edges(edge_ids))
+
+    node_list = []
+    for key, ids, is_set in node_bindings:
+        for node in (next(nodes) for _ in ids):
+            if node is None:
+                continue
+            node = dict(node, isSet=is_set, binding=key)
+            if key in qnode_types:
+                node['type'] = qnode_types[key]
+            node_list.append(node)
+    edge_list = []
+    for key, ids in edge_bindings:
+        for edge in (next(edges) for _ in ids):
+            if edge is not None:
+                edge_list.append(dict(edge, binding=key))
+    return {'node_list': node_list, 'edge_list': edge_list}
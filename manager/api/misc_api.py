@@ -13,6 +13,10 @@ from flask_restful import Resource, abort
 
 from manager.setup import app, api
 from manager.logging_config import logger
+from manager import cache, upstream, pubmed, omnicorp
+from manager.view_store import open_message
+from manager.fanout import fan_out, DeadlineExceeded
+from manager.term_index import TermIndexStore
 
 
 concept_map = {}
@@ -25,6 +29,24 @@ except Exception as e:
         'misc_api.py:: Could not '
         f'find/read concept_map.json - {e}')
 
+# Builder metadata only changes when Predicates.post refreshes it
+builder_cache = cache.TTLCache(
+    'builder',
+    maxsize=int(os.environ.get('BUILDER_CACHE_SIZE', 64)),
+    ttl=float(os.environ.get('BUILDER_CACHE_TTL', 300)),
+    stale=float(os.environ.get('BUILDER_CACHE_STALE', 3600)))
+
+def builder_get(path):
+    """GET /api/<path> from the builder, through builder_cache."""
+    def fetch():
+        try:
+            r = upstream.client('builder').get(f'/api/{path}')
+            r.raise_for_status()
+        except requests.RequestException as err:
+            abort(502, message=f'Builder request failed: {err}')
+        return r.json()
+    return builder_cache.get(path, fetch)
+
 class Concepts(Resource):
     def get(self):
         """
@@ -41,8 +63,7 @@ class Concepts(Resource):
                             items:
                                 type: string
         """
-        r = requests.get(f"http://{os.environ['BUILDER_HOST']}:{os.environ['BUILDER_PORT']}/api/concepts")
-        concepts = r.json()
+        concepts = builder_get('concepts')
         bad_concepts =['NAME.DISEASE', 'NAME.PHENOTYPE', 'NAME.DRUG']
         concepts = [c for c in concepts if not c in bad_concepts]
         concepts.sort()
@@ -84,8 +105,10 @@ class Omnicorp(Resource):
                                 type: string
         """
 
-        r = requests.get(f"http://{os.environ['RANKER_HOST']}:{os.environ['RANKER_PORT']}/api/omnicorp/{id1}/{id2}")
-        return r.json()
+        try:
+            return omnicorp.pair_publications(id1, id2)
+        except requests.RequestException as err:
+            abort(502, message=f'Ranker request failed: {err}')
 
 api.add_resource(Omnicorp, '/omnicorp/<id1>/<id2>')
 
@@ -115,12 +138,97 @@ class Omnicorp1(Resource):
                                 type: string
         """
 
-        r = requests.get(f"http://{os.environ['RANKER_HOST']}:{os.environ['RANKER_PORT']}/api/omnicorp/{id1}")
+        try:
+            r = upstream.client('ranker').get(f'/api/omnicorp/{id1}')
+        except requests.RequestException as err:
+            abort(502, message=f'Ranker request failed: {err}')
         return r.json()
 
 api.add_resource(Omnicorp1, '/omnicorp/<id1>')
 
 
+class OmnicorpPairs(Resource):
+    def post(self):
+        """
+        Get publications for every pair of a list of identifiers
+        ---
+        tags: [util]
+        requestBody:
+            description: >
+                Either the curies themselves or an answer of an uploaded
+                answerset, whose bound KG nodes are used. With counts set,
+                only the number of publications of each pair is returned.
+            content:
+                application/json:
+                    schema:
+                        type: object
+                        properties:
+                            curies:
+                                type: array
+                                items:
+                                    type: string
+                            uid:
+                                type: string
+                            answer:
+                                type: integer
+                            counts:
+                                type: boolean
+                    example:
+                        curies: ["MONDO:0005737", "HGNC:7897", "CHEBI:28748"]
+                        counts: true
+            required: true
+        responses:
+            200:
+                description: >
+                    {"pairs": [{"source", "target", "publications" or "count"}],
+                    "failed": [{"source", "target", "error"}]}; the
+                    X-Partial-Results header is set when some pairs failed
+                content:
+                    application/json:
+                        schema:
+                            type: object
+            400:
+                description: Invalid request
+            404:
+                description: No such answerset or answer
+        """
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            return 'Expected a JSON object', 400
+        max_curies = int(os.environ.get('OMNICORP_PAIRS_MAX_CURIES', 50))
+        if 'uid' in body:
+            if not isinstance(body.get('answer'), int):
+                return 'answer should be the index of an answer', 400
+            try:
+                message = open_message(body['uid'])
+                if not 0 <= body['answer'] < message.num_answers:
+                    raise KeyError(body['answer'])
+                curies = omnicorp.answer_curies(message, body['answer'])
+            except KeyError:
+                return 'No such answerset or answer', 404
+        else:
+            curies = body.get('curies')
+            if not isinstance(curies, list) or not all(isinstance(c, str) for c in curies):
+                return 'curies should be a list of curies', 400
+        if len(curies) > max_curies:
+            return f'At most {max_curies} curies per request', 400
+
+        results, errors = omnicorp.all_pairs(curies, float(os.environ.get('OMNICORP_PAIRS_TIMEOUT', 30)))
+        pairs = []
+        for (source, target), publications in results.items():
+            if body.get('counts'):
+                pairs.append({'source': source, 'target': target, 'count': len(publications)})
+            else:
+                pairs.append({'source': source, 'target': target, 'publications': publications})
+        failed = [{'source': source, 'target': target, 'error': str(err)} for (source, target), err in errors.items()]
+        if failed:
+            logger.warning(f'{len(failed)} of {len(results) + len(failed)} omnicorp pairs failed')
+            return {'pairs': pairs, 'failed': failed}, 200, {'X-Partial-Results': 'true'}
+        return {'pairs': pairs, 'failed': failed}, 200
+
+api.add_resource(OmnicorpPairs, '/omnicorp/pairs')
+
+
 class Connections(Resource):
     def get(self):
         """
@@ -137,8 +245,7 @@ class Connections(Resource):
                             items:
                                 type: string
         """
-        r = requests.get(f"http://{os.environ['BUILDER_HOST']}:{os.environ['BUILDER_PORT']}/api/connections")
-        connections = r.json()
+        connections = builder_get('connections')
 
         return connections
 
@@ -160,8 +267,7 @@ class Operations(Resource):
                             items:
                                 type: string
         """
-        r = requests.get(f"http://{os.environ['BUILDER_HOST']}:{os.environ['BUILDER_PORT']}/api/operations")
-        operations = r.json()
+        operations = builder_get('operations')
 
         return operations
 
@@ -181,9 +287,7 @@ class Predicates(Resource):
                         schema:
                             type: object
         """
-        get_url = f"http://{os.environ['BUILDER_HOST']}:{os.environ['BUILDER_PORT']}/api/predicates"
-        r = requests.get(get_url)
-        operations = r.json()
+        operations = builder_get('predicates')
 
         return operations
 
@@ -206,9 +310,16 @@ class Predicates(Resource):
                         schema:
                             type: string
         """
-        post_url = f"http://{os.environ['BUILDER_HOST']}:{os.environ['BUILDER_PORT']}/api/predicates"
-        logger.debug(f'Predicates:post:: Trying to post to: {post_url}')
-        response = requests.post(post_url)
+        logger.debug('Predicates:post:: Asking the builder to refresh predicates')
+        try:
+            # rebuilding the list from neo4j can take minutes
+            response = upstream.client('builder').post(
+                '/api/predicates',
+                timeout=float(os.environ.get('PREDICATES_REFRESH_TIMEOUT', 600)))
+        except requests.RequestException as err:
+            return f'Builder request failed: {err}', 502
+        if response.ok:
+            builder_cache.invalidate()
         return Response(response.content, response.status_code)
 
 api.add_resource(Predicates, '/predicates/')
@@ -225,13 +336,66 @@ class Properties(Resource):
                 content:
                     application/json:
         """
-        r = requests.get(f"http://{os.environ['BUILDER_HOST']}:{os.environ['BUILDER_PORT']}/api/properties")
-        props = r.json()
+        props = builder_get('properties')
 
         return props
 
 api.add_resource(Properties, '/properties/')
 
+class CacheStats(Resource):
+    def get(self):
+        """
+        Get hit/miss counters of the upstream response caches
+        ---
+        tags: [util]
+        responses:
+            200:
+                description: counters of each cache, by name
+                content:
+                    application/json:
+                        schema:
+                            type: object
+        """
+        return cache.stats()
+
+api.add_resource(CacheStats, '/cache/stats/')
+
+class UpstreamStats(Resource):
+    def get(self):
+        """
+        Get circuit breaker state, error counts and latency histograms of upstream services
+        ---
+        tags: [util]
+        responses:
+            200:
+                description: stats of each upstream, by name
+                content:
+                    application/json:
+                        schema:
+                            type: object
+        """
+        return upstream.stats()
+
+api.add_resource(UpstreamStats, '/upstream/stats/')
+
+def parse_args_wait(req_args):
+    """Seconds to long-poll for, capped by PUBMED_MAX_WAIT."""
+    try:
+        wait = float(req_args.get('wait', 0))
+    except ValueError:
+        raise RuntimeError('wait should be a number of seconds')
+    return min(max(wait, 0), float(os.environ.get('PUBMED_MAX_WAIT', 20)))
+
+def pubmed_job_response(pmid, state, info, error):
+    if state == 'done':
+        return info, 200
+    if state == 'failed':
+        return {'status': 'failed', 'pmid': pmid, 'error': error}, 500
+    if state == 'missing':
+        return 'No such pubmed job', 404
+    status_url = f'{request.script_root}/api/pubmed/{pmid}/status'
+    return {'status': 'pending', 'pmid': pmid, 'job': info, 'poll': status_url}, 202, {'Location': status_url}
+
 class Pubmed(Resource):
     def get(self, pmid):
         """
@@ -246,49 +410,211 @@ class Pubmed(Resource):
                 type: string
             required: true
             default: "10924274"
+          - in: query
+            name: wait
+            description: "seconds to wait for a publication that is not cached yet (long poll)"
+            schema:
+                type: number
+            default: 0
         responses:
             200:
                 description: pubmed publication
                 content:
                     application/json:
+            202:
+                description: >
+                    Not cached yet; it is being fetched. Poll the status URL in
+                    the Location header.
+            500:
+                description: Fetching the publication failed
         """
-        
-        # logger.debug(f'Fetching pubmed info for pmid {pmid}')
-
-        pubmed_redis_client = redis.Redis(
-            host=os.environ['PUBMED_CACHE_HOST'],
-            port=os.environ['PUBMED_CACHE_PORT'],
-            db=os.environ['PUBMED_CACHE_DB'],
-            password=os.environ['PUBMED_CACHE_PASSWORD'])
-
-        pubmed_cache_key = f'robokop_pubmed_cache_{pmid}'
-        pm_string = pubmed_redis_client.get(pubmed_cache_key)
-        if pm_string is None:
-            # logger.debug(f'Pubmed info for {pmid} not found in cache. Fetching from pubmed')
-
-            result = fetch_pubmed_info.apply_async(
-                args=[pmid, pubmed_cache_key]
-            )
-            
-            try:
-                task_status = result.get() # Blocking call to wait for task completion
-            except (redis.exceptions.InvalidResponse, redis.exceptions.ConnectionError) as err:
-                return "Celery results is bad: " + str(err), 500
-
-            if task_status != 'cached':
-                return task_status, 500
-            
-            pm_string = pubmed_redis_client.get(pubmed_cache_key)
-            if pm_string is None:
-                return 'Pubmed info could not be found', 500
-        
-        pubmed_info = json.loads(pm_string)
-        # logger.debug(f'Pubmed info for {pmid} found in cache.')
-        
-        return pubmed_info, 200
+        try:
+            wait = parse_args_wait(request.args)
+        except RuntimeError as err:
+            return str(err), 400
+        pmid = pubmed.normalize_pmid(pmid)
+        try:
+            pubmed_info = pubmed.cached(pmid)
+            if pubmed_info is not None:
+                return pubmed_info, 200
+            pubmed.start_fetch(pmid)
+            return pubmed_job_response(pmid, *pubmed.job_status(pmid, wait))
+        except pubmed.PubmedError as err:
+            return str(err), 500
 
 api.add_resource(Pubmed, '/pubmed/<pmid>')
 
+class PubmedStatus(Resource):
+    def get(self, pmid):
+        """
+        Poll a pubmed fetch started by /api/pubmed/<pmid>
+        ---
+        tags: [util]
+        parameters:
+          - in: path
+            name: pmid
+            description: ID of pubmed publication
+            schema:
+                type: string
+            required: true
+          - in: query
+            name: wait
+            description: "seconds to wait for the fetch to finish (long poll)"
+            schema:
+                type: number
+            default: 0
+        responses:
+            200:
+                description: pubmed publication
+                content:
+                    application/json:
+            202:
+                description: Still being fetched
+            404:
+                description: Not cached and not being fetched
+            500:
+                description: Fetching the publication failed
+        """
+        try:
+            wait = parse_args_wait(request.args)
+        except RuntimeError as err:
+            return str(err), 400
+        pmid = pubmed.normalize_pmid(pmid)
+        try:
+            state, info, error = pubmed.job_status(pmid, wait)
+        except pubmed.PubmedError as err:
+            return str(err), 500
+        return pubmed_job_response(pmid, state, info, error)
+
+api.add_resource(PubmedStatus, '/pubmed/<pmid>/status')
+
+class PubmedBatch(Resource):
+    def post(self):
+        """
+        Get many pubmed publications in one request
+        ---
+        tags: [util]
+        requestBody:
+            description: PMIDs to look up (plain or as PMID:<id> curies)
+            content:
+                application/json:
+                    schema:
+                        type: object
+                        properties:
+                            pmids:
+                                type: array
+                                items:
+                                    type: string
+                    example:
+                        pmids: ["10924274", "PMID:29076384"]
+            required: true
+        responses:
+            200:
+                description: >
+                    One JSON object per line, {"pmid", "info"} or {"pmid", "error"},
+                    cached publications first and the rest as they are fetched
+                content:
+                    application/x-ndjson:
+                        schema:
+                            type: string
+            400:
+                description: Invalid list of PMIDs
+        """
+        body = request.get_json(silent=True) or {}
+        pmids = body.get('pmids') if isinstance(body, dict) else None
+        max_pmids = int(os.environ.get('PUBMED_BATCH_MAX', 500))
+        if not isinstance(pmids, list) or not all(isinstance(p, (str, int)) for p in pmids):
+            return 'pmids should be a list of PMIDs', 400
+        if len(pmids) > max_pmids:
+            return f'At most {max_pmids} PMIDs per request', 400
+
+        by_pmid = {}
+        for requested in pmids:
+            by_pmid.setdefault(pubmed.normalize_pmid(requested), []).append(requested)
+        timeout = float(os.environ.get('PUBMED_BATCH_TIMEOUT', 30))
+
+        def lines():
+            try:
+                for pmid, info, error in pubmed.lookup_batch(list(by_pmid), timeout):
+                    for requested in by_pmid[pmid]:
+                        line = {'pmid': requested, 'info': info} if error is None else {'pmid': requested, 'error': error}
+                        yield json.dumps(line) + '\n'
+            except Exception as err:
+                # the status is already sent; report the failure in-band
+                logger.exception('Pubmed batch lookup failed')
+                yield json.dumps({'error': f'Pubmed batch lookup failed: {err}'}) + '\n'
+
+        return Response(lines(), mimetype='application/x-ndjson')
+
+api.add_resource(PubmedBatch, '/pubmed/batch')
+
+search_cache = cache.TTLCache(
+    'search',
+    maxsize=int(os.environ.get('SEARCH_CACHE_SIZE', 4096)),
+    ttl=float(os.environ.get('SEARCH_CACHE_TTL', 3600)),
+    stale=float(os.environ.get('SEARCH_CACHE_STALE', 86400)))
+
+# Prefix index of past and bulk-loaded names; off unless SEARCH_INDEX_DIR is set
+_search_index = TermIndexStore(os.environ['SEARCH_INDEX_DIR']) if os.environ.get('SEARCH_INDEX_DIR') else None
+
+def search_index():
+    """The current search TermIndex, or None."""
+    return _search_index.current() if _search_index is not None else None
+
+class PartialSearch(Exception):
+    """Raised by search_bionames, so incomplete results are not cached."""
+    def __init__(self, results, failed):
+        super().__init__(f"Bionames lookups failed: {', '.join(failed)}")
+        self.results = results
+        self.failed = failed
+
+def search_bionames(term, bionames):
+    """Look term up under every biolink name concurrently and merge the results."""
+    def lookup(bioname):
+        return lambda: upstream.client('bionames').get(f'/lookup/{term}/{bioname}/')
+    responses, errors = fan_out(
+        {bioname: lookup(bioname) for bioname in bionames},
+        float(os.environ.get('SEARCH_DEADLINE', 10)))
+
+    results = []
+    failed = []
+    error_status = {'isError': False}
+    for bioname in bionames:
+        if bioname in errors:
+            failed.append(bioname)
+            error_status['isError'] = True
+            error_status['code'] = 504 if isinstance(errors[bioname], DeadlineExceeded) else 502
+            continue
+        r = responses[bioname]
+        if r.ok:
+            all_results = r.json()
+            found = []
+            for r in all_results:
+                if not 'id' in r:
+                    continue
+                if 'label' in r:
+                    r['label'] = r['label'] or r['id']
+                elif 'desc' in r:
+                    r['label'] = r['desc'] or r['id']
+                    r.pop('desc')
+                else:
+                    continue
+                found.append(r)
+            if _search_index is not None and found:
+                _search_index.journal(bioname, found)
+            results.extend(found)
+        else:
+            failed.append(bioname)
+            error_status['isError'] = True
+            error_status['code'] = r.status_code
+
+    results = list({r['id']:r for r in results}.values())
+    if not results and error_status['isError'] :
+        abort(error_status['code'], message=f"Bionames lookup endpoint returned {error_status['code']} error code")
+    if failed:
+        raise PartialSearch(results, failed)
+    return results
+
 class Search(Resource):
     def get(self, term, category):
         """
@@ -327,33 +653,17 @@ class Search(Resource):
         if not bionames: # No matching biolink name for this category
             return []
         
-        results = []
-        error_status = {'isError': False}
-        for bioname in bionames:
-            url = f"https://bionames.renci.org/lookup/{term}/{bioname}/"
-            r = requests.get(url)
-            if r.ok:
-                all_results = r.json()
-                for r in all_results:
-                    if not 'id' in r:
-                        continue
-                    if 'label' in r:
-                        r['label'] = r['label'] or r['id']
-                    elif 'desc' in r:
-                        r['label'] = r['desc'] or r['id']
-                        r.pop('desc')
-                    else:
-                        continue
-                    results.append(r)
-            else:
-                error_status['isError'] = True
-                error_status['code'] = r.status_code
-
-        results = list({r['id']:r for r in results}.values())
-        if not results and error_status['isError'] :
-            abort(error_status['code'], message=f"Bionames lookup endpoint returned {error_status['code']} error code")
-        else:
-            return results
+        index = search_index()
+        if index is not None:
+            hits = index.lookup(term, bionames, limit=int(os.environ.get('SEARCH_INDEX_LIMIT', 50)))
+            if len(hits) >= int(os.environ.get('SEARCH_INDEX_MIN_RESULTS', 1)):
+                return hits
+
+        try:
+            return search_cache.get((term, category), lambda: search_bionames(term, bionames))
+        except PartialSearch as partial:
+            # some lookups failed or timed out; say so, but return what we have
+            return partial.results, 200, {'X-Partial-Results': ', '.join(partial.failed)}
 
 api.add_resource(Search, '/search/<term>/<category>/')
 
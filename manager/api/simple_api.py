@@ -7,22 +7,25 @@ import sys
 import json
 import time
 import re
-from uuid import uuid4
 import logging
 from datetime import datetime
 import requests
-from flask import jsonify, request
+import numpy as np
+from flask import jsonify, request, send_file, Response, stream_with_context
 from flask_security import auth_required
 from flask_restful import Resource
+from werkzeug.exceptions import BadRequest
 
 from manager.setup import api
+from manager.view_store import view_file, open_message, load_index, load_facets, load_ranking, store_message
+from manager.message_schema import MessageFormatError
+from manager.pruning import prune_stored_message
+from manager.compression import encoding_of, decoded_chunks
+from manager.answer_table import table_page, answer_graph
+from manager.exporters import export, FORMATS
 
 logger = logging.getLogger(__name__)
 
-view_storage_dir = f"{os.environ['ROBOKOP_HOME']}/uploads/"
-if not os.path.exists(view_storage_dir):
-    os.mkdir(view_storage_dir)
-
 output_formats = ['DENSE', 'MESSAGE', 'CSV', 'ANSWERS']
 
 def parse_args_output_format(req_args):
@@ -35,6 +38,12 @@ def parse_args_output_format(req_args):
 def parse_args_max_results(req_args):
     max_results = req_args.get('max_results', default=None)
     max_results = max_results if max_results is not None else 250
+    try:
+        max_results = int(max_results)
+    except ValueError:
+        raise RuntimeError(f'max_results should be an integer')
+    if max_results < 0:
+        max_results = None
     return max_results
 
 def parse_args_max_connectivity(req_args):
@@ -55,6 +64,57 @@ def parse_args_max_connectivity(req_args):
 
     return max_connectivity
 
+def parse_args_max_nodes(req_args):
+    max_nodes = req_args.get('max_nodes', default='35')
+
+    if max_nodes.lower() == 'none':
+        return None
+    try:
+        max_nodes = int(max_nodes)
+    except ValueError:
+        raise RuntimeError(f'max_nodes should be an integer')
+    if max_nodes < 1:
+        raise RuntimeError(f'max_nodes should be at least 1')
+
+    return max_nodes
+
+def parse_json_filters(req):
+    if not req.get_data(cache=True):
+        return {}
+    try:
+        body = req.get_json(force=True)
+    except BadRequest:
+        raise RuntimeError('request body should be JSON')
+    filters = body.get('filters', {}) if isinstance(body, dict) else body
+    if filters is None:
+        return {}
+    if not isinstance(filters, dict) or not all(
+            isinstance(facets, dict) and all(isinstance(values, list) for values in facets.values())
+            for facets in filters.values()):
+        raise RuntimeError('filters should be {qnode id: {facet: [values]}}')
+    return filters
+
+def parse_args_page(req_args, max_limit=1000):
+    try:
+        offset = int(req_args.get('offset', default='0'))
+        limit = int(req_args.get('limit', default='20'))
+    except ValueError:
+        raise RuntimeError(f'offset and limit should be integers')
+    if offset < 0 or not 0 < limit <= max_limit:
+        raise RuntimeError(f'offset should be at least 0 and limit between 1 and {max_limit}')
+
+    return offset, limit
+
+def parse_args_sort(req_args):
+    sort = req_args.get('sort', default='score')
+    if sort.lower() != 'score':
+        raise RuntimeError(f'sort must be "score"')
+    order = req_args.get('order', default='desc')
+    if not (order.lower() in ['asc', 'desc']):
+        raise RuntimeError(f'order must be "asc" or "desc"')
+
+    return order.lower() == 'desc'
+
 def parse_args_rebuild(req_args):
     rebuild = request.args.get('rebuild', default='false')
     
@@ -64,6 +124,7 @@ def parse_args_rebuild(req_args):
     return rebuild.lower()
 
 
+
 class View(Resource):
     def post(self):
         """
@@ -81,29 +142,613 @@ class View(Resource):
         responses:
             200:
                 description: A URL for further viewing
+            400:
+                description: The upload is not a valid message
         """
         
         logger.info('Recieving Answerset for storage and later viewing')
-        message = request.json
-        
-        # Save the message to archive folder
-        for _ in range(25):
-            try:
-                uid = str(uuid4())
-                this_file = os.path.join(view_storage_dir, f'{uid}.json')
-                with open(this_file, 'x') as answerset_file:
-                    logger.info('Saving Message')
-                    json.dump(message, answerset_file)
-                break
-            except:
-                logger.info('Error encountered writting file. Retrying')
-                pass
-        else:
-            logger.info('Error encountered writting file')
+        try:
+            uid = store_message(request.stream)
+        except MessageFormatError as err:
+            return f'Invalid message: {err}', 400
+        except:
+            logger.exception('Error encountered writting file')
             return "Failed to save resource. Internal server error", 500
-        
+
         return uid, 200
 
 api.add_resource(View, '/simple/view/')
 
 
+class ViewData(Resource):
+    def get(self, uid):
+        """
+        Get a previously uploaded answerset
+        ---
+        tags: [simple]
+        parameters:
+          - in: path
+            name: uid
+            description: "id returned when the answerset was uploaded"
+            schema:
+                type: string
+            required: true
+        responses:
+            200:
+                description: >
+                    The stored message, in its stored content coding
+                    (see Content-Encoding) if Accept-Encoding allows it
+                content:
+                    application/json:
+                        schema:
+                            $ref: '#/components/schemas/Message'
+            206:
+                description: The requested byte range of the stored message
+            304:
+                description: The stored message has not changed since the cached copy
+            404:
+                description: No answerset with that id
+            416:
+                description: >
+                    Byte ranges are only served in the stored content coding,
+                    and Accept-Encoding does not allow it
+        """
+        this_file = view_file(uid)
+        if this_file is None:
+            return 'No such answerset', 404
+
+        encoding = encoding_of(this_file)
+        if encoding == 'identity' or request.accept_encodings[encoding]:
+            # send_file hands the open file to the WSGI server's file_wrapper
+            # (sendfile under gunicorn, or X-Sendfile if USE_X_SENDFILE is set)
+            # and answers If-None-Match/If-Modified-Since and Range itself,
+            # so the message is never read into the worker.
+            response = send_file(
+                this_file,
+                mimetype='application/json',
+                conditional=True,
+                etag=True,
+                max_age=0)
+            if encoding != 'identity':
+                response.headers['Content-Encoding'] = encoding
+        else:
+            # the client cannot take the stored coding; decode as we send.
+            # The decoded length is not known up front, so a Range request
+            # gets 416 rather than a range, or the whole message if it
+            # changed since If-Range (an etag; dates are not strong).
+            stat = os.stat(this_file)
+            etag = f'{stat.st_mtime}-{stat.st_size}-identity'
+            response = Response(stream_with_context(decoded_chunks(this_file)), mimetype='application/json')
+            response.set_etag(etag)
+            response.last_modified = stat.st_mtime
+            response.cache_control.max_age = 0
+            response = response.make_conditional(request)
+            if response.status_code == 200 and request.range is not None \
+                    and request.if_range.date is None and request.if_range.etag in (None, etag):
+                response = Response(f'Byte ranges are only served with Accept-Encoding: {encoding}', 416)
+            response.headers['Accept-Ranges'] = 'none'
+        response.vary.add('Accept-Encoding')
+        return response
+
+api.add_resource(ViewData, '/simple/view/<uid>')
+
+
+class ViewPruned(Resource):
+    def get(self, uid):
+        """
+        Get the pruned knowledge graph of an uploaded answerset
+        ---
+        tags: [simple]
+        parameters:
+          - in: path
+            name: uid
+            description: "id returned when the answerset was uploaded"
+            schema:
+                type: string
+            required: true
+          - in: query
+            name: max_nodes
+            description: "approximate number of nodes to keep, or none for all scored nodes"
+            schema:
+                type: string
+            default: "35"
+        responses:
+            200:
+                description: Knowledge graph with the best scoring nodes for each question node
+                content:
+                    application/json:
+                        schema:
+                            $ref: '#/definitions/Graph'
+            400:
+                description: Invalid max_nodes
+            404:
+                description: No answerset with that id
+        """
+        try:
+            max_nodes = parse_args_max_nodes(request.args)
+        except RuntimeError as err:
+            return str(err), 400
+        return self.pruned(uid, max_nodes, None)
+
+    def post(self, uid):
+        """
+        Get the pruned knowledge graph of an uploaded answerset, scored over the answers matching a filter
+        ---
+        tags: [simple]
+        parameters:
+          - in: path
+            name: uid
+            description: "id returned when the answerset was uploaded"
+            schema:
+                type: string
+            required: true
+          - in: query
+            name: max_nodes
+            description: "approximate number of nodes to keep, or none for all scored nodes"
+            schema:
+                type: string
+            default: "35"
+        requestBody:
+            description: "Answer filter, as for /simple/view/{uid}/filter"
+            content:
+                application/json:
+                    schema:
+                        type: object
+                        properties:
+                            filters:
+                                type: object
+                                example: {"n1": {"type": ["gene"]}}
+        responses:
+            200:
+                description: Knowledge graph with the best scoring nodes for each question node, over the matching answers
+                content:
+                    application/json:
+                        schema:
+                            $ref: '#/definitions/Graph'
+            400:
+                description: Invalid max_nodes or filters, or a body that is not JSON
+            404:
+                description: No answerset with that id
+        """
+        try:
+            max_nodes = parse_args_max_nodes(request.args)
+            filters = parse_json_filters(request)
+        except RuntimeError as err:
+            return str(err), 400
+        return self.pruned(uid, max_nodes, filters)
+
+    @staticmethod
+    def pruned(uid, max_nodes, filters):
+        try:
+            message = open_message(uid)
+            index = load_index(uid)
+            ranking = load_ranking(uid, filters)
+        except KeyError:
+            return 'No such answerset', 404
+        except ValueError as err:
+            return str(err), 400
+
+        return prune_stored_message(message, index, max_nodes, ranking), 200
+
+api.add_resource(ViewPruned, '/simple/view/<uid>/pruned')
+
+
+# KG nodes or edges serialized per chunk of the knowledge graph response
+GRAPH_CHUNK = 1000
+
+
+def knowledge_graph_chunks(message, index):
+    qnodes = message.question_graph['nodes']
+    yield '{"nodes": ['
+    for start in range(0, index.num_kg_nodes, GRAPH_CHUNK):
+        positions = range(start, min(start + GRAPH_CHUNK, index.num_kg_nodes))
+        nodes = index.annotated_nodes(message.kg_nodes_at(positions), positions, qnodes)
+        yield (', ' if start else '') + ', '.join(json.dumps(n) for n in nodes)
+    yield '], "edges": ['
+    for start in range(0, index.num_kg_edges, GRAPH_CHUNK):
+        edges = message.kg_edges_at(range(start, min(start + GRAPH_CHUNK, index.num_kg_edges)))
+        yield (', ' if start else '') + ', '.join(json.dumps(e) for e in edges)
+    yield ']}'
+
+
+class ViewKnowledgeGraph(Resource):
+    def get(self, uid):
+        """
+        Get the knowledge graph of an uploaded answerset with its nodes type-annotated
+        ---
+        tags: [simple]
+        parameters:
+          - in: path
+            name: uid
+            description: "id returned when the answerset was uploaded"
+            schema:
+                type: string
+            required: true
+        responses:
+            200:
+                description: >
+                    Every KG node and edge. Nodes whose type is a list, or that
+                    have labels but no type, carry the type of the question node
+                    that binds them in the most answers.
+                content:
+                    application/json:
+                        schema:
+                            $ref: '#/definitions/Graph'
+            404:
+                description: No answerset with that id
+        """
+        try:
+            message = open_message(uid)
+            index = load_index(uid)
+        except KeyError:
+            return 'No such answerset', 404
+
+        return Response(stream_with_context(knowledge_graph_chunks(message, index)), mimetype='application/json')
+
+api.add_resource(ViewKnowledgeGraph, '/simple/view/<uid>/knowledge_graph')
+
+
+class ViewNodeTypes(Resource):
+    def get(self, uid):
+        """
+        Get the types the knowledge graph of an uploaded answerset is annotated with
+        ---
+        tags: [simple]
+        parameters:
+          - in: path
+            name: uid
+            description: "id returned when the answerset was uploaded"
+            schema:
+                type: string
+            required: true
+        responses:
+            200:
+                description: >
+                    The type of every KG node whose type is a list, or that has
+                    labels but no type, by node id: that of the question node
+                    that binds it in the most answers. Other nodes keep their own.
+                content:
+                    application/json:
+                        schema:
+                            type: object
+                            additionalProperties:
+                                type: string
+            404:
+                description: No answerset with that id
+        """
+        try:
+            message = open_message(uid)
+            index = load_index(uid)
+        except KeyError:
+            return 'No such answerset', 404
+
+        return index.node_types(message.question_graph['nodes']), 200
+
+api.add_resource(ViewNodeTypes, '/simple/view/<uid>/node_types')
+
+
+class ViewNodeAnswers(Resource):
+    def get(self, uid, node_id):
+        """
+        Get the answers of an uploaded answerset that bind a knowledge graph node
+        ---
+        tags: [simple]
+        parameters:
+          - in: path
+            name: uid
+            description: "id returned when the answerset was uploaded"
+            schema:
+                type: string
+            required: true
+          - in: path
+            name: node_id
+            description: "knowledge graph node id"
+            schema:
+                type: string
+            required: true
+            example: "HGNC:7897"
+        responses:
+            200:
+                description: Answer indices with the question node each one binds the node to
+                content:
+                    application/json:
+                        schema:
+                            type: array
+                            items:
+                                type: object
+                                properties:
+                                    answer:
+                                        type: integer
+                                    qnode_id:
+                                        type: string
+            404:
+                description: No answerset with that id, or no such node in it
+        """
+        try:
+            index = load_index(uid)
+            answers, qnodes = index.node_postings(node_id)
+        except KeyError:
+            return 'No such answerset or node', 404
+
+        return [
+            {'answer': a, 'qnode_id': index.qnode_ids[q]}
+            for a, q in zip(answers.tolist(), qnodes.tolist())
+        ], 200
+
+api.add_resource(ViewNodeAnswers, '/simple/view/<uid>/nodes/<path:node_id>/answers')
+
+
+class ViewEdgeAnswers(Resource):
+    def get(self, uid, edge_id):
+        """
+        Get the answers of an uploaded answerset that bind a knowledge graph edge
+        ---
+        tags: [simple]
+        parameters:
+          - in: path
+            name: uid
+            description: "id returned when the answerset was uploaded"
+            schema:
+                type: string
+            required: true
+          - in: path
+            name: edge_id
+            description: "knowledge graph edge id"
+            schema:
+                type: string
+            required: true
+        responses:
+            200:
+                description: Answer indices
+                content:
+                    application/json:
+                        schema:
+                            type: array
+                            items:
+                                type: integer
+            404:
+                description: No answerset with that id, or no such edge in it
+        """
+        try:
+            answers = load_index(uid).edge_postings(edge_id)
+        except KeyError:
+            return 'No such answerset or edge', 404
+
+        return answers.tolist(), 200
+
+api.add_resource(ViewEdgeAnswers, '/simple/view/<uid>/edges/<path:edge_id>/answers')
+
+
+class ViewAnswers(Resource):
+    def get(self, uid):
+        """
+        Get one page of the answer table of an uploaded answerset
+        ---
+        tags: [simple]
+        parameters:
+          - in: path
+            name: uid
+            description: "id returned when the answerset was uploaded"
+            schema:
+                type: string
+            required: true
+          - in: query
+            name: offset
+            schema:
+                type: integer
+            default: 0
+          - in: query
+            name: limit
+            schema:
+                type: integer
+            default: 20
+          - in: query
+            name: sort
+            schema:
+                type: string
+                enum: [score]
+            default: score
+          - in: query
+            name: order
+            schema:
+                type: string
+                enum: [asc, desc]
+            default: desc
+        responses:
+            200:
+                description: "Table rows with the KG nodes and edges of each answer joined in, plus headerInfo and the total number of answers"
+                content:
+                    application/json:
+                        schema:
+                            type: object
+            400:
+                description: Invalid paging or sort parameters
+            404:
+                description: No answerset with that id
+        """
+        try:
+            offset, limit = parse_args_page(request.args)
+            descending = parse_args_sort(request.args)
+        except RuntimeError as err:
+            return str(err), 400
+        try:
+            message = open_message(uid)
+            index = load_index(uid)
+        except KeyError:
+            return 'No such answerset', 404
+
+        return table_page(message, index, offset, limit, descending), 200
+
+api.add_resource(ViewAnswers, '/simple/view/<uid>/answers')
+
+
+class ViewAnswerGraph(Resource):
+    def get(self, uid, answer):
+        """
+        Get the nodes and edges bound by one answer of an uploaded answerset
+        ---
+        tags: [simple]
+        parameters:
+          - in: path
+            name: uid
+            description: "id returned when the answerset was uploaded"
+            schema:
+                type: string
+            required: true
+          - in: path
+            name: answer
+            description: "index of the answer in the answerset"
+            schema:
+                type: integer
+            required: true
+        responses:
+            200:
+                description: "node_list and edge_list of the answer, with the binding of each, support edges included"
+                content:
+                    application/json:
+                        schema:
+                            type: object
+            404:
+                description: No answerset with that id, or no such answer in it
+        """
+        try:
+            message = open_message(uid)
+        except KeyError:
+            return 'No such answerset or answer', 404
+        if answer >= message.num_answers:
+            return 'No such answerset or answer', 404
+
+        return answer_graph(message, answer), 200
+
+api.add_resource(ViewAnswerGraph, '/simple/view/<uid>/answers/<int:answer>/graph')
+
+
+class ViewFilter(Resource):
+    def post(self, uid):
+        """
+        Filter the answers of an uploaded answerset by the ids, names or types of the nodes they bind
+        ---
+        tags: [simple]
+        parameters:
+          - in: path
+            name: uid
+            description: "id returned when the answerset was uploaded"
+            schema:
+                type: string
+            required: true
+          - in: query
+            name: offset
+            schema:
+                type: integer
+            default: 0
+          - in: query
+            name: limit
+            schema:
+                type: integer
+            default: 20
+        requestBody:
+            description: "Values to keep per question node and facet (id, name or type). An answer is kept if, for every facet given, it binds a node with one of the values."
+            content:
+                application/json:
+                    schema:
+                        type: object
+                        properties:
+                            filters:
+                                type: object
+                                example: {"n1": {"type": ["gene"]}}
+        responses:
+            200:
+                description: "total matching answers, one page of their indices by descending score, and the value counts of every facet over the matching answers"
+                content:
+                    application/json:
+                        schema:
+                            type: object
+            400:
+                description: Invalid filters or paging parameters, or a body that is not JSON
+            404:
+                description: No answerset with that id
+        """
+        try:
+            offset, limit = parse_args_page(request.args)
+            filters = parse_json_filters(request)
+        except RuntimeError as err:
+            return str(err), 400
+        try:
+            index = load_index(uid)
+            facets = load_facets(uid)
+        except KeyError:
+            return 'No such answerset', 404
+        try:
+            mask = facets.match(filters)
+        except ValueError as err:
+            return str(err), 400
+
+        order = np.asarray(index.answer_order)
+        matching = order[mask[order]]
+        return {
+            'total': len(matching),
+            'answers': matching[offset:offset + limit].tolist(),
+            'facets': facets.counts(mask),
+        }, 200
+
+api.add_resource(ViewFilter, '/simple/view/<uid>/filter')
+
+
+class ViewExport(Resource):
+    def get(self, uid):
+        """
+        Download an uploaded answerset in one of the output formats
+        ---
+        tags: [simple]
+        parameters:
+          - in: path
+            name: uid
+            description: "id returned when the answerset was uploaded"
+            schema:
+                type: string
+            required: true
+          - in: query
+            name: output_format
+            description: "DENSE (answers with bound nodes and edges inlined), MESSAGE, CSV or ANSWERS"
+            schema:
+                type: string
+                enum: [DENSE, MESSAGE, CSV, ANSWERS]
+            default: MESSAGE
+          - in: query
+            name: max_results
+            description: "number of best scoring answers to include; negative for all"
+            schema:
+                type: integer
+            default: 250
+          - in: query
+            name: max_connectivity
+            description: "drop KG nodes with more edges than this, and the answers that bind them; nodes bound to qnodes with a curie are kept"
+            schema:
+                type: integer
+        responses:
+            200:
+                description: The answerset, streamed
+            400:
+                description: Invalid parameters
+            404:
+                description: No answerset with that id
+        """
+        try:
+            output_format = parse_args_output_format(request.args).upper()
+            max_results = parse_args_max_results(request.args)
+            max_connectivity = parse_args_max_connectivity(request.args)
+        except RuntimeError as err:
+            return str(err), 400
+        try:
+            message = open_message(uid)
+            index = load_index(uid)
+        except KeyError:
+            return 'No such answerset', 404
+
+        mimetype, extension = FORMATS[output_format]
+        return Response(
+            stream_with_context(export(output_format, message, index, max_results, max_connectivity)),
+            mimetype=mimetype,
+            headers={'Content-Disposition': f'attachment; filename={uid}.{extension}'})
+
+api.add_resource(ViewExport, '/simple/view/<uid>/export')
@@ -0,0 +1,60 @@
+'''
+Directories of memory-mapped .npy arrays kept next to stored data
+
+A directory is filled under a .part name beside it and renamed into place,
+so readers see either the old directory or the new one, never half of one.
+Answer indexes, columnar copies, facet tables and the term index are all
+written this way.
+'''
+
+import os
+import shutil
+import tempfile
+from uuid import uuid4
+
+import numpy as np
+
+
+def write_dir_atomically(directory, fill):
+    '''
+    Call fill(tmp) on a new, empty sibling of directory, then replace
+    directory with it. Returns what fill returns; on any error the sibling
+    is removed and directory is left as it was.
+    '''
+    parent = os.path.dirname(os.path.normpath(directory))
+    tmp = tempfile.mkdtemp(dir=parent, suffix='.part')
+    try:
+        result = fill(tmp)
+        if os.path.isdir(directory):
+            # readers keep their mmaps of the replaced files
+            stale = f'{directory}.{uuid4().hex}.stale'
+            os.rename(directory, stale)
+            shutil.rmtree(stale, ignore_errors=True)
+        os.rename(tmp, directory)
+    except:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return result
+
+
+def save_arrays(directory, arrays, version=None):
+    '''np.save each of {name: array} into directory, and version into its VERSION file.'''
+    for name, values in arrays.items():
+        np.save(os.path.join(directory, f'{name}.npy'), values)
+    if version is not None:
+        with open(os.path.join(directory, 'VERSION'), 'w') as f:
+            f.write(str(version))
+
+
+def read_version(directory):
+    '''The version directory was written with, or None if there is none.'''
+    try:
+        with open(os.path.join(directory, 'VERSION')) as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def utf8_array(strings):
+    '''A sequence of str as an array of their utf-8 encodings.'''
+    return np.array([s.encode('utf-8') for s in strings], dtype=np.bytes_) if strings else np.zeros(0, dtype='S1')
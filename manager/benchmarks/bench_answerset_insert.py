@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+'''
+Rows/s of tables_accessors.add_answerset, per answer objects against bulk.
+
+Runs against a fresh SQLite file, with the "public" and "private" schemas
+attached, per measurement, or against DATABASE_URL when it is set.
+Answers are the answers of answerset.json, repeated.
+
+    python -m manager.benchmarks.bench_answerset_insert 1000 100000 1000000
+'''
+
+import os
+import sys
+import time
+import tempfile
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from manager.benchmarks import synthetic
+from manager import tables_accessors
+from manager.tables import QGraph, Answerset, Answer
+
+# the per-object path is slow; skip it above this many answers
+MAX_ORM_ANSWERS = 100000
+
+
+def sqlite_engine(directory):
+    engine = create_engine(f"sqlite:///{os.path.join(directory, 'main.db')}")
+
+    @event.listens_for(engine, 'connect')
+    def attach(connection, _):
+        for schema in ['public', 'private']:
+            connection.execute(f"ATTACH DATABASE '{os.path.join(directory, schema)}.db' AS {schema}")
+    return engine
+
+
+def use_engine(engine):
+    '''Point tables_accessors at engine.'''
+    QGraph.__table__.create(engine, checkfirst=True)
+    Answerset.__table__.create(engine, checkfirst=True)
+    Answer.__table__.create(engine, checkfirst=True)
+    Session = sessionmaker(bind=engine)
+
+    @contextmanager
+    def session_scope():
+        session = Session()
+        try:
+            yield session
+            session.commit()
+        except:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+    tables_accessors.session_scope = session_scope
+
+
+def run_one(bulk, answers):
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(os.environ['DATABASE_URL']) if os.environ.get('DATABASE_URL') else sqlite_engine(directory)
+        use_engine(engine)
+        start = time.perf_counter()
+        tables_accessors.add_answerset(answers, bulk=bulk, qgraph_id=1)
+        elapsed = time.perf_counter() - start
+        engine.dispose()
+    return len(answers) / elapsed
+
+
+def main(sizes):
+    template = synthetic.load_template()['answers']
+    print(f'{"answers":>10} {"objects rows/s":>16} {"bulk rows/s":>14}')
+    for size in sizes:
+        answers = [template[i % len(template)] for i in range(size)]
+        orm = f'{run_one(False, answers):16.0f}' if size <= MAX_ORM_ANSWERS else f'{"-":>16}'
+        print(f'{size:>10} {orm} {run_one(True, answers):14.0f}')
+
+
+if __name__ == '__main__':
+    main([int(s) for s in sys.argv[1:]] or [1000, 100000, 1000000])
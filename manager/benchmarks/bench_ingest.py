@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+'''
+Throughput and peak RSS of view uploads.
+
+Compares the streaming ingestion in manager.view_store against the old
+request.json + json.dump path. Every measurement runs in a fresh
+subprocess so the reported peak RSS belongs to that run alone.
+
+    python -m manager.benchmarks.bench_ingest 10 100 1000
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import resource
+import tempfile
+import subprocess
+
+from manager.benchmarks import synthetic
+
+MB = 1024 * 1024
+
+
+def run_one(mode, path, home):
+    os.environ['ROBOKOP_HOME'] = home
+    from manager import view_store
+
+    size = os.path.getsize(path)
+    start = time.perf_counter()
+    with open(path, 'rb') as stream:
+        if mode == 'streaming':
+            view_store.store_message(stream)
+        else:
+            message = json.load(stream)
+            with open(os.path.join(view_store.view_storage_dir, 'baseline.json'), 'w') as out:
+                json.dump(message, out)
+    elapsed = time.perf_counter() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    print(json.dumps({'seconds': elapsed, 'mb_per_s': size / MB / elapsed, 'peak_rss_mb': peak_rss / MB}))
+
+
+def main(sizes_mb, baseline_limit_mb=200):
+    with tempfile.TemporaryDirectory() as home:
+        print(f"{'size':>8} {'mode':>10} {'MB/s':>8} {'peak RSS':>10}")
+        for size_mb in sizes_mb:
+            path = os.path.join(home, f'message_{size_mb}.json')
+            synthetic.write_message(path, target_bytes=size_mb * MB)
+            modes = ['streaming'] + (['baseline'] if size_mb <= baseline_limit_mb else [])
+            for mode in modes:
+                out = subprocess.run(
+                    [sys.executable, '-m', 'manager.benchmarks.bench_ingest', '--one', mode, path, home],
+                    check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+                result = json.loads(out.strip().splitlines()[-1])
+                actual_mb = os.path.getsize(path) / MB
+                print(f"{actual_mb:7.0f}M {mode:>10} {result['mb_per_s']:8.1f} {result['peak_rss_mb']:9.0f}M")
+            os.unlink(path)
+            shutil.rmtree(os.path.join(home, 'uploads'))
+            os.mkdir(os.path.join(home, 'uploads'))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--one']:
+        run_one(*sys.argv[2:5])
+    else:
+        main([int(s) for s in sys.argv[1:]] or [10, 100, 1000])
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+'''
+Time of pruned graph node selection, rescoring on every change against
+cached rankings.
+
+Indexes a synthetic message of the given number of answers, then moves
+max_nodes the way the viewer's slider does and filters to answer subsets
+of a few sizes.
+
+    python -m manager.benchmarks.bench_pruning 100000
+'''
+
+import os
+import sys
+import time
+import tempfile
+
+import numpy as np
+
+from manager.benchmarks import synthetic
+from manager.answer_index import build_index
+from manager.pruning import rank_stored_nodes, score_matrix, select_nodes
+
+SLIDER = [5, 10, 20, 35, 50, 75, 100, 150, 200, 300]
+
+
+def timed(function, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def main(num_answers):
+    with tempfile.TemporaryDirectory() as directory:
+        message_file = os.path.join(directory, 'message.json')
+        synthetic.write_message(message_file, num_answers=num_answers)
+        index = build_index(message_file, os.path.join(directory, 'index'))
+        answer_scores = np.asarray(index.answer_scores)
+        num_qnodes = len(index.qnode_ids)
+
+        def rescore(answers=None):
+            postings = index.binding_postings()
+            weights = answer_scores
+            if answers is not None:
+                weights = np.zeros_like(answer_scores)
+                weights[answers] = answer_scores[answers]
+            return score_matrix(postings, weights, index.num_kg_nodes, num_qnodes)
+
+        print(f'{index.num_answers} answers, {index.num_kg_nodes} KG nodes')
+        print(f'{"case":>28} {"old (ms)":>10} {"new (ms)":>10}')
+        old, _ = timed(lambda: [select_nodes(rescore(), n) for n in SLIDER])
+        ranking_time, ranking = timed(lambda: rank_stored_nodes(index))
+        new, _ = timed(lambda: [ranking.select(n) for n in SLIDER])
+        print(f'{"rank all answers":>28} {"":>10} {ranking_time * 1000:10.2f}')
+        print(f'{"max_nodes change":>28} {old / len(SLIDER) * 1000:10.2f} {new / len(SLIDER) * 1000:10.3f}')
+
+        # the answer-major postings are built once per view
+        build, _ = timed(lambda: index._answer_major)
+        print(f'{"answer-major postings":>28} {"":>10} {build * 1000:10.2f}')
+        rng = np.random.default_rng(0)
+        for fraction in [0.001, 0.01, 0.1, 0.5]:
+            answers = np.sort(rng.choice(index.num_answers, max(int(index.num_answers * fraction), 1), replace=False))
+            old, _ = timed(lambda: select_nodes(rescore(answers), 35), 3)
+            new, _ = timed(lambda: rank_stored_nodes(index, answers).select(35), 3)
+            print(f'{f"filter to {fraction:.1%}":>28} {old * 1000:10.2f} {new * 1000:10.2f}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
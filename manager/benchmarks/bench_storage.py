@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+'''
+Disk size and first-page latency of the JSON and columnar view stores.
+
+Stores answerset.json and synthetic messages of the given sizes, then, in a
+fresh subprocess per measurement, opens each one and renders the first page
+of the answer table the way /simple/view/<uid>/answers does.
+
+    python -m manager.benchmarks.bench_storage 10 100
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import resource
+import tempfile
+import subprocess
+
+from manager.benchmarks import synthetic
+
+MB = 1024 * 1024
+
+
+def _du(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+
+
+class JsonMessage():
+    '''The message parsed whole, as views were read before the columnar layout.'''
+
+    def __init__(self, path):
+        from manager import compression
+
+        with compression.open_decoded(path) as f:
+            self.message = json.load(f)
+        self.question_graph = self.message['question_graph']
+        self.num_answers = len(self.message['answers'])
+        self._kg_nodes = {n['id']: n for n in self.message['knowledge_graph']['nodes']}
+        self._kg_edges = {e['id']: e for e in self.message['knowledge_graph']['edges']}
+
+    def answers(self, indices):
+        return [self.message['answers'][i] for i in indices]
+
+    def kg_nodes(self, ids):
+        return [self._kg_nodes.get(i) for i in ids]
+
+    def kg_edges(self, ids):
+        return [self._kg_edges.get(i) for i in ids]
+
+
+def store(home, path):
+    os.environ['ROBOKOP_HOME'] = home
+    from manager import view_store
+
+    with open(path, 'rb') as stream:
+        print(view_store.store_message(stream))
+
+
+def run_one(mode, home, uid):
+    os.environ['ROBOKOP_HOME'] = home
+    from manager import view_store
+    from manager.answer_table import table_page
+    from manager.columnar import ColumnarMessage
+
+    start = time.perf_counter()
+    if mode == 'json':
+        message = JsonMessage(view_store.view_file(uid))
+    else:
+        message = ColumnarMessage(view_store.columnar_dir(uid))
+    opened = time.perf_counter()
+    table_page(message, view_store.load_index(uid), 0, 20)
+    done = time.perf_counter()
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    print(json.dumps({'open': opened - start, 'page': done - opened, 'peak_rss_mb': peak_rss / MB}))
+
+
+def _run(*args):
+    out = subprocess.run(
+        [sys.executable, '-m', 'manager.benchmarks.bench_storage', *args],
+        check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return out.strip().splitlines()[-1]
+
+
+def main(sizes_mb):
+    with tempfile.TemporaryDirectory() as home:
+        os.environ['ROBOKOP_HOME'] = home
+        from manager import view_store
+
+        print(f"{'message':>12} {'mode':>9} {'disk':>9} {'open ms':>9} {'page ms':>9} {'peak RSS':>9}")
+        sources = [('answerset', synthetic.template_file)]
+        for size_mb in sizes_mb:
+            path = os.path.join(home, f'message_{size_mb}.json')
+            synthetic.write_message(path, target_bytes=size_mb * MB)
+            sources.append((f'{size_mb}M', path))
+
+        for name, path in sources:
+            # stored from a subprocess too, so the measurements do not inherit its peak RSS
+            uid = _run('--store', home, path)
+            disk = {'json': _du(view_store.view_file(uid)), 'columnar': _du(view_store.columnar_dir(uid))}
+            for mode in ('json', 'columnar'):
+                result = json.loads(_run('--one', mode, home, uid))
+                print(f"{name:>12} {mode:>9} {disk[mode] / MB:8.1f}M {result['open'] * 1000:9.1f} "
+                      f"{result['page'] * 1000:9.1f} {result['peak_rss_mb']:8.0f}M")
+            if path != synthetic.template_file:
+                os.unlink(path)
+            shutil.rmtree(view_store.view_storage_dir)
+            os.mkdir(view_store.view_storage_dir)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--store']:
+        store(*sys.argv[2:4])
+    elif sys.argv[1:2] == ['--one']:
+        run_one(*sys.argv[2:5])
+    else:
+        main([int(s) for s in sys.argv[1:]] or [10, 100])
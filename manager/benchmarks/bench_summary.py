@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+'''
+Time of answer summaries, walked over plain lists against adjacency lists.
+
+Summarizes the answers of answerset.json, repeated up to the given number
+of answers, and single path answers of growing length. generate_summary
+walks answers of up to PATH_EDGES edges over lists.
+
+    python -m manager.benchmarks.bench_summary 100000
+'''
+
+import sys
+import time
+import random
+
+from manager.benchmarks import synthetic
+from manager.answer_summary import PATH_EDGES, generate_summary, _path_summary, _walk_summary
+
+
+def template_answers():
+    '''(nodes, edges) of every answer of answerset.json, as Answer rows store them.'''
+    message = synthetic.load_template()
+    kg_nodes = {n['id']: n for n in message['knowledge_graph']['nodes']}
+    kg_edges = {e['id']: e for e in message['knowledge_graph']['edges']}
+    answers = []
+    for answer in message['answers']:
+        node_ids = [i for ids in answer['node_bindings'].values() for i in (ids if isinstance(ids, list) else [ids])]
+        edge_ids = [i for ids in answer['edge_bindings'].values() for i in (ids if isinstance(ids, list) else [ids])]
+        answers.append(([kg_nodes[i] for i in node_ids], [kg_edges[i] for i in edge_ids if i in kg_edges]))
+    return answers
+
+
+def path_answer(length, seed=0):
+    '''A path of length edges with random directions, edges in random order.'''
+    rng = random.Random(seed)
+    nodes = [{'id': f'N:{i}', 'name': f'node {i}', 'type': ['named_thing']} for i in range(length + 1)]
+    edges = []
+    for i in range(length):
+        source, target = (i, i + 1) if rng.random() < 0.5 else (i + 1, i)
+        edges.append({'source_id': f'N:{source}', 'target_id': f'N:{target}', 'type': 'related_to'})
+    rng.shuffle(edges)
+    return nodes, edges
+
+
+def timed(summarize, answers):
+    start = time.perf_counter()
+    for nodes, edges in answers:
+        summarize(nodes, edges)
+    return time.perf_counter() - start
+
+
+def main(num_answers):
+    template = template_answers()
+    answers = [template[i % len(template)] for i in range(num_answers)]
+    print(f'{"case":>22} {"lists (s)":>10} {"adjacency":>10} {"generate":>10}')
+    print(f'{f"{num_answers} answers":>22} {timed(_path_summary, answers):10.3f} '
+          f'{timed(_walk_summary, answers):10.3f} {timed(generate_summary, answers):10.3f}')
+    for length in sorted({2, 4, 10, PATH_EDGES, 100, 1000, 10000}):
+        answer = path_answer(length)
+        repeat = max(num_answers // length // 10, 1)
+        print(f'{f"path of {length} x{repeat}":>22} {timed(_path_summary, [answer] * repeat):10.4f} '
+              f'{timed(_walk_summary, [answer] * repeat):10.4f} {timed(generate_summary, [answer] * repeat):10.4f}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,78 @@
+'''
+Synthetic messages shaped like answerset.json, for benchmarks
+'''
+
+import os
+import json
+import random
+
+template_file = os.path.join(os.path.dirname(__file__), '..', '..', 'answerset.json')
+
+
+def load_template():
+    with open(template_file) as f:
+        return json.load(f)
+
+
+def iter_message_chunks(num_answers, seed=0):
+    '''
+    Yield a message with num_answers answers as JSON text chunks.
+
+    KG nodes and edges from answerset.json are cloned under fresh ids so the
+    knowledge graph grows with the number of answers.
+    '''
+    rng = random.Random(seed)
+    template = load_template()
+    kg_nodes = template['knowledge_graph']['nodes']
+    kg_edges = template['knowledge_graph']['edges']
+    answers = template['answers']
+    copies = max(1, num_answers // len(answers))
+
+    yield '{"question_graph": ' + json.dumps(template['question_graph'], indent=2)
+    yield ', "knowledge_graph": {"nodes": ['
+    for c in range(copies):
+        for i, node in enumerate(kg_nodes):
+            node = dict(node, id=f"{node['id']}.{c}")
+            yield (', ' if c or i else '') + json.dumps(node, indent=2)
+    yield '], "edges": ['
+    for c in range(copies):
+        for i, edge in enumerate(kg_edges):
+            edge = dict(
+                edge,
+                id=f"{edge['id']}.{c}",
+                source_id=f"{edge['source_id']}.{c}",
+                target_id=f"{edge['target_id']}.{c}")
+            yield (', ' if c or i else '') + json.dumps(edge, indent=2)
+    yield ']}, "answers": ['
+    for i in range(num_answers):
+        c = i // len(answers) % copies
+        answer = answers[i % len(answers)]
+        answer = {
+            'node_bindings': {k: _suffix(v, c) for k, v in answer['node_bindings'].items()},
+            'edge_bindings': {k: _suffix(v, c) for k, v in answer['edge_bindings'].items()},
+            'score': rng.random(),
+        }
+        yield (', ' if i else '') + json.dumps(answer, indent=2)
+    yield ']}'
+
+
+def _suffix(ids, c):
+    if isinstance(ids, list):
+        return [f'{i}.{c}' for i in ids]
+    return f'{ids}.{c}'
+
+
+def bytes_per_answer():
+    '''Rough size of the synthetic message per answer, including its share of the KG.'''
+    size = sum(len(chunk) for chunk in iter_message_chunks(len(load_template()['answers'])))
+    return size / len(load_template()['answers'])
+
+
+def write_message(path, num_answers=None, target_bytes=None, seed=0):
+    '''Write a synthetic message with num_answers answers (or about target_bytes bytes) to path.'''
+    if num_answers is None:
+        num_answers = max(1, int(target_bytes / bytes_per_answer()))
+    with open(path, 'w') as f:
+        for chunk in iter_message_chunks(num_answers, seed):
+            f.write(chunk)
+    return num_answers
@@ -0,0 +1,144 @@
+'''
+In-process response cache for upstream services
+
+TTLCache keeps the most recently used values for ttl seconds. After that,
+and for up to stale seconds more, the old value is still served while one
+background fetch refreshes it. Concurrent misses for the same key share a
+single fetch, so a burst of page loads reaches the upstream service once.
+'''
+
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# every cache by name, for stats()
+caches = {}
+
+
+def _in_thread(refresh):
+    threading.Thread(target=refresh, daemon=True).start()
+
+
+class TTLCache():
+    '''
+    Size-bounded LRU cache with a time to live and stale-while-revalidate.
+
+    Cached values are shared between requests; treat them as read-only.
+    '''
+
+    def __init__(self, name, maxsize=64, ttl=300, stale=3600, clock=time.monotonic, background=_in_thread):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale = stale
+        self.clock = clock
+        self.background = background
+        self.entries = OrderedDict()  # key -> (value, fetched at)
+        self.lock = threading.Lock()
+        self.key_locks = {}
+        self.refreshing = set()
+        self.counts = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'refreshes': 0, 'errors': 0, 'evictions': 0}
+        caches[name] = self
+
+    def _count(self, name):
+        self.counts[name] += 1
+
+    def _lookup(self, key):
+        '''(value, age) of key or None; marks key as recently used.'''
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        self.entries.move_to_end(key)
+        return entry[0], self.clock() - entry[1]
+
+    def _store(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, self.clock())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self._count('evictions')
+
+    def get(self, key, fetch):
+        '''Cached value of key, calling fetch() to (re)load it when needed.'''
+        with self.lock:
+            found = self._lookup(key)
+            if found is not None and found[1] < self.ttl:
+                self._count('hits')
+                return found[0]
+            if found is not None and found[1] < self.ttl + self.stale:
+                self._count('stale_hits')
+                if key not in self.refreshing:
+                    self.refreshing.add(key)
+                    self.background(lambda: self._refresh(key, fetch))
+                return found[0]
+            # [lock, number of callers using it]; dropped by the last one
+            key_lock = self.key_locks.setdefault(key, [threading.Lock(), 0])
+            key_lock[1] += 1
+
+        try:
+            with key_lock[0]:
+                # whoever held the lock before us may have fetched it already
+                with self.lock:
+                    found = self._lookup(key)
+                    if found is not None and found[1] < self.ttl:
+                        self._count('hits')
+                        return found[0]
+                    self._count('misses')
+                try:
+                    value = fetch()
+                except Exception:
+                    with self.lock:
+                        self._count('errors')
+                    raise
+                self._store(key, value)
+                return value
+        finally:
+            with self.lock:
+                key_lock[1] -= 1
+                if not key_lock[1]:
+                    del self.key_locks[key]
+
+    def peek(self, key):
+        '''Fresh cached value of key, or None; never fetches.'''
+        with self.lock:
+            found = self._lookup(key)
+            if found is not None and found[1] < self.ttl:
+                self._count('hits')
+                return found[0]
+            return None
+
+    def _refresh(self, key, fetch):
+        try:
+            value = fetch()
+        except Exception as err:
+            logger.warning(f'{self.name} cache: refreshing {key} failed, serving stale value: {err}')
+            with self.lock:
+                self._count('errors')
+        else:
+            self._store(key, value)
+            with self.lock:
+                self._count('refreshes')
+        finally:
+            with self.lock:
+                self.refreshing.discard(key)
+
+    def invalidate(self, key=None):
+        '''Drop key, or everything if key is None.'''
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts, size=len(self.entries), maxsize=self.maxsize, ttl=self.ttl, stale=self.stale)
+
+
+def stats():
+    '''Counters of every cache, by name.'''
+    return {name: cache.stats() for name, cache in caches.items()}
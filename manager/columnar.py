@@ -0,0 +1,299 @@
+'''
+Columnar binary layout for stored messages
+
+A message is converted once, after upload, into a directory of flat arrays
+that are memory-mapped when read. The question graph, single answers and
+single KG nodes or edges can then be loaded without parsing anything else.
+
+    VERSION                 COLUMNAR_VERSION of the code that wrote it
+    question_graph.json     the question graph
+    strings.npy             every id and binding key (utf-8), sorted
+    string_kg_node.npy      position in knowledge_graph.nodes of each string (-1 if not a node id)
+    string_kg_edge.npy      position in knowledge_graph.edges of each string (-1 if not an edge id)
+    kg_nodes.bin            compact JSON of every KG node, back to back
+    kg_node_offsets.npy     node k is kg_nodes.bin[offsets[k]:offsets[k+1]]
+    kg_edges.bin            as for nodes
+    kg_edge_offsets.npy
+    answer_score.npy        float64 score of every answer (NaN if not a number)
+    answer_extra.bin        compact JSON of any other answer properties
+    answer_extra_offsets.npy
+    {node,edge}_answer_offsets.npy  binding groups of answer a are [offsets[a], offsets[a+1])
+    {node,edge}_group_key.npy       string of the binding key of every group
+    {node,edge}_group_is_list.npy   whether the binding was a list
+    {node,edge}_group_offsets.npy   values of group g are [offsets[g], offsets[g+1])
+    {node,edge}_values.npy          string of every bound id
+
+Bindings refer to strings.npy by index, so ids are stored once however
+many answers bind them.
+'''
+
+import os
+import math
+import json
+import logging
+from array import array
+
+import numpy as np
+import ijson
+
+from manager.array_store import write_dir_atomically, save_arrays, utf8_array
+from manager.compression import open_decoded
+from manager.message_schema import WRAPPER, MESSAGE_KEYS
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever the layout changes; older conversions are ignored.
+COLUMNAR_VERSION = 1
+
+BINDINGS = ('node', 'edge')
+
+
+def _dumps(obj):
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+class _Blob():
+    '''Append-only file of byte records with an offsets array.'''
+
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+        self.offsets = array('q', [0])
+
+    def append(self, data):
+        self.file.write(data)
+        self.offsets.append(self.offsets[-1] + len(data))
+
+    def close(self):
+        self.file.close()
+        return np.frombuffer(self.offsets, dtype=np.int64)
+
+
+class _Bindings():
+    '''Integer-coded bindings of one kind (node or edge).'''
+
+    def __init__(self):
+        self.answer_offsets = array('q', [0])
+        self.group_key = array('q')
+        self.group_is_list = array('b')
+        self.group_offsets = array('q', [0])
+        self.values = array('q')
+
+    def add(self, bindings, intern):
+        for key, ids in bindings.items():
+            is_list = isinstance(ids, list)
+            self.group_key.append(intern(key))
+            self.group_is_list.append(is_list)
+            self.values.extend(intern(i) for i in (ids if is_list else [ids]))
+            self.group_offsets.append(len(self.values))
+        self.answer_offsets.append(len(self.group_key))
+
+    def arrays(self, rank, prefix):
+        return {
+            f'{prefix}_answer_offsets': np.frombuffer(self.answer_offsets, dtype=np.int64),
+            f'{prefix}_group_key': rank[np.frombuffer(self.group_key, dtype=np.int64)],
+            f'{prefix}_group_is_list': np.frombuffer(self.group_is_list, dtype=np.int8).astype(bool),
+            f'{prefix}_group_offsets': np.frombuffer(self.group_offsets, dtype=np.int64),
+            f'{prefix}_values': rank[np.frombuffer(self.values, dtype=np.int64)],
+        }
+
+
+def _items(message_file, prefix):
+    with open_decoded(message_file) as f:
+        yield from ijson.items(f, prefix, use_float=True)
+
+
+def _message_prefix(message_file):
+    '''ijson prefix of the message in a validated file: '' or that of its WRAPPER.'''
+    with open_decoded(message_file) as f:
+        for prefix, event, value in ijson.parse(f):
+            if prefix == '' and event == 'map_key' and (value == WRAPPER or value in MESSAGE_KEYS):
+                return f'{WRAPPER}.' if value == WRAPPER else ''
+    return ''
+
+
+def write_columnar(message_file, directory):
+    '''
+    Convert a stored (already validated) message file, in any content
+    coding, into the layout.
+
+    Each section is read in its own streaming pass, so only one KG node,
+    edge or answer is held in memory at a time. Keys other than
+    question_graph, knowledge_graph.nodes/edges and answers are not
+    copied; the JSON stays the canonical form of the message.
+    '''
+    num_answers, num_strings = write_dir_atomically(directory, lambda tmp: _convert(message_file, tmp))
+    logger.info(f'Converted message to columnar layout: {num_answers} answers, {num_strings} strings')
+
+
+def _convert(message_file, tmp):
+    '''Write the layout of message_file into tmp; returns the number of answers and strings.'''
+    strings = {}
+
+    def intern(value):
+        index = strings.get(value)
+        if index is None:
+            index = strings[value] = len(strings)
+        return index
+
+    kg_node_strings = array('q')
+    kg_edge_strings = array('q')
+    scores = array('d')
+    bindings = {b: _Bindings() for b in BINDINGS}
+    blobs = {
+        name: _Blob(os.path.join(tmp, f'{name}.bin'))
+        for name in ('kg_nodes', 'kg_edges', 'answer_extra')
+    }
+
+    prefix = _message_prefix(message_file)
+    question_graph = next(_items(message_file, f'{prefix}question_graph'))
+    for node in _items(message_file, f'{prefix}knowledge_graph.nodes.item'):
+        kg_node_strings.append(intern(node['id']))
+        blobs['kg_nodes'].append(_dumps(node))
+    for edge in _items(message_file, f'{prefix}knowledge_graph.edges.item'):
+        kg_edge_strings.append(intern(edge['id']))
+        blobs['kg_edges'].append(_dumps(edge))
+    for answer in _items(message_file, f'{prefix}answers.item'):
+        bindings['node'].add(answer.pop('node_bindings'), intern)
+        bindings['edge'].add(answer.pop('edge_bindings'), intern)
+        score = answer.get('score')
+        if isinstance(score, (int, float)) and not isinstance(score, bool):
+            scores.append(score)
+            del answer['score']
+        else:
+            scores.append(math.nan)
+        blobs['answer_extra'].append(_dumps(answer) if answer else b'')
+
+    encoded = utf8_array(strings)
+    order = np.argsort(encoded, kind='stable')
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+
+    arrays = {'strings': encoded[order]}
+    for name, kg_strings in (('string_kg_node', kg_node_strings), ('string_kg_edge', kg_edge_strings)):
+        positions = np.full(len(order), -1, dtype=np.int64)
+        # later duplicates overwrite earlier ones
+        positions[rank[np.frombuffer(kg_strings, dtype=np.int64)]] = np.arange(len(kg_strings))
+        arrays[name] = positions
+    arrays['kg_node_offsets'] = blobs['kg_nodes'].close()
+    arrays['kg_edge_offsets'] = blobs['kg_edges'].close()
+    arrays['answer_extra_offsets'] = blobs['answer_extra'].close()
+    arrays['answer_score'] = np.frombuffer(scores, dtype=np.float64)
+    for b in BINDINGS:
+        arrays.update(bindings[b].arrays(rank, b))
+
+    with open(os.path.join(tmp, 'question_graph.json'), 'w') as f:
+        json.dump(question_graph, f)
+    save_arrays(tmp, arrays, COLUMNAR_VERSION)
+    return len(scores), len(strings)
+
+
+def _memmap(path):
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=np.uint8)
+    return np.memmap(path, dtype=np.uint8, mode='r')
+
+
+class ColumnarMessage():
+    '''
+    Lazy reader for the columnar layout.
+
+    What view_store.open_message returns for a stored message. Nothing
+    is parsed until it is asked for.
+    '''
+
+    def __init__(self, directory):
+        def load(name):
+            return np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r')
+
+        self.directory = directory
+        self.strings = load('strings')
+        self.string_kg_node = load('string_kg_node')
+        self.string_kg_edge = load('string_kg_edge')
+        self.blobs = {
+            name: (_memmap(os.path.join(directory, f'{name}.bin')), load(offsets))
+            for name, offsets in (
+                ('kg_nodes', 'kg_node_offsets'),
+                ('kg_edges', 'kg_edge_offsets'),
+                ('answer_extra', 'answer_extra_offsets'))
+        }
+        self.answer_score = load('answer_score')
+        self.bindings = {
+            b: tuple(load(f'{b}_{name}') for name in ('answer_offsets', 'group_key', 'group_is_list', 'group_offsets', 'values'))
+            for b in BINDINGS
+        }
+        self._question_graph = None
+
+    @property
+    def question_graph(self):
+        if self._question_graph is None:
+            with open(os.path.join(self.directory, 'question_graph.json')) as f:
+                self._question_graph = json.load(f)
+        return self._question_graph
+
+    @property
+    def num_answers(self):
+        return len(self.answer_score)
+
+    @property
+    def num_kg_nodes(self):
+        return len(self.blobs['kg_nodes'][1]) - 1
+
+    @property
+    def num_kg_edges(self):
+        return len(self.blobs['kg_edges'][1]) - 1
+
+    def _string(self, i):
+        return self.strings[i].decode('utf-8')
+
+    def _record(self, name, k):
+        blob, offsets = self.blobs[name]
+        data = bytes(blob[offsets[k]:offsets[k + 1]])
+        return json.loads(data) if data else None
+
+    def _bindings(self, b, a):
+        answer_offsets, group_key, group_is_list, group_offsets, values = self.bindings[b]
+        out = {}
+        for g in range(answer_offsets[a], answer_offsets[a + 1]):
+            ids = [self._string(v) for v in values[group_offsets[g]:group_offsets[g + 1]]]
+            out[self._string(group_key[g])] = ids if group_is_list[g] else ids[0]
+        return out
+
+    def answer(self, a):
+        answer = {
+            'node_bindings': self._bindings('node', a),
+            'edge_bindings': self._bindings('edge', a),
+        }
+        score = float(self.answer_score[a])
+        if not math.isnan(score):
+            answer['score'] = score
+        answer.update(self._record('answer_extra', a) or {})
+        return answer
+
+    def answers(self, indices):
+        return [self.answer(a) for a in indices]
+
+    def _positions(self, ids, string_positions):
+        if not ids:
+            return []
+        keys = np.array([i.encode('utf-8') for i in ids], dtype=np.bytes_)
+        found = np.searchsorted(self.strings, keys)
+        found = np.minimum(found, max(len(self.strings) - 1, 0))
+        positions = []
+        for key, i in zip(keys, found.tolist()):
+            hit = len(self.strings) and self.strings[i] == key
+            positions.append(int(string_positions[i]) if hit else -1)
+        return positions
+
+    def kg_nodes_at(self, positions):
+        return [self._record('kg_nodes', k) for k in positions]
+
+    def kg_edges_at(self, positions):
+        return [self._record('kg_edges', k) for k in positions]
+
+    def kg_nodes(self, ids):
+        '''KG nodes with the given ids, None for unknown ids.'''
+        return [self._record('kg_nodes', k) if k >= 0 else None for k in self._positions(ids, self.string_kg_node)]
+
+    def kg_edges(self, ids):
+        '''KG edges with the given ids, None for unknown ids.'''
+        return [self._record('kg_edges', k) if k >= 0 else None for k in self._positions(ids, self.string_kg_edge)]
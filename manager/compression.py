@@ -0,0 +1,87 @@
+'''
+Content codings for stored view messages
+
+Messages are kept on disk in one HTTP content coding (gzip by default, zstd
+if the zstandard package is installed) so they can be served as stored to
+clients that accept that coding. The file suffix names the coding; files
+without one are plain JSON (identity).
+'''
+
+import gzip
+import logging
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# file suffix of each content coding
+SUFFIXES = {
+    'zstd': '.zst',
+    'gzip': '.gz',
+    'identity': '',
+}
+
+
+def available(encoding):
+    '''Whether encoding can be written and read here.'''
+    return encoding in SUFFIXES and (encoding != 'zstd' or zstandard is not None)
+
+
+def encoding_of(path):
+    '''Content coding of a stored file, from its suffix.'''
+    for encoding, suffix in SUFFIXES.items():
+        if suffix and path.endswith(suffix):
+            return encoding
+    return 'identity'
+
+
+class _Plain():
+    '''Writer for identity coding; close leaves the file open like the compressors do.'''
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+
+    def write(self, data):
+        return self.fileobj.write(data)
+
+    def close(self):
+        self.fileobj.flush()
+
+
+def encoder(fileobj, encoding, level=None):
+    '''
+    File-like writer that encodes into fileobj. Call close() to write the
+    trailer; fileobj itself stays open.
+    '''
+    if encoding == 'gzip':
+        # no file name and mtime=0, so the same message always encodes to
+        # the same bytes whatever temporary file it is written to
+        return gzip.GzipFile(
+            filename='', fileobj=fileobj, mode='wb', compresslevel=6 if level is None else level, mtime=0)
+    if encoding == 'zstd':
+        compressor = zstandard.ZstdCompressor(level=3 if level is None else level)
+        return compressor.stream_writer(fileobj, closefd=False)
+    return _Plain(fileobj)
+
+
+def open_decoded(path):
+    '''Open a stored file for reading its decoded bytes.'''
+    encoding = encoding_of(path)
+    if encoding == 'gzip':
+        return gzip.open(path, 'rb')
+    if encoding == 'zstd':
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    return open(path, 'rb')
+
+
+def decoded_chunks(path, chunk_size=64 * 1024):
+    '''Yield the decoded bytes of a stored file chunk by chunk.'''
+    with open_decoded(path) as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            yield data
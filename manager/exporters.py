@@ -0,0 +1,204 @@
+'''
+Streaming exports of stored messages
+
+Each exporter is a generator of text chunks, so a download can be sent as a
+chunked response while answers are read a batch at a time. Answers come out
+best score first, at most max_results of them. With max_connectivity set,
+KG nodes with more edges than that are dropped, together with their edges
+and every answer that binds them. Nodes bound to a qnode with a curie are
+kept whatever their degree: they are what the question asks about, and
+every answer binds them.
+'''
+
+import io
+import csv
+import json
+import logging
+
+import numpy as np
+
+from manager.answer_table import _as_list
+
+logger = logging.getLogger(__name__)
+
+# answers read from the store per step
+BATCH_SIZE = 256
+
+# (mimetype, file extension) of every output format
+FORMATS = {
+    'DENSE': ('application/json', 'json'),
+    'MESSAGE': ('application/json', 'json'),
+    'CSV': ('text/csv', 'csv'),
+    'ANSWERS': ('application/json', 'json'),
+}
+
+
+def _dumps(obj):
+    return json.dumps(obj, separators=(',', ':'))
+
+
+def pinned_qnodes(question_graph, index):
+    '''Indices of the qnodes with a curie.'''
+    return [index.qnode_ids.index(n['id']) for n in question_graph['nodes'] if n.get('curie')]
+
+
+def dropped_nodes(index, max_connectivity, pinned=()):
+    '''
+    Boolean mask of the KG nodes whose degree is above max_connectivity,
+    leaving out those bound to the qnode indices in pinned.
+    '''
+    if max_connectivity is None:
+        return np.zeros(index.num_kg_nodes, dtype=bool)
+    dropped = np.asarray(index.node_degree) > max_connectivity
+    if len(pinned) and dropped.any():
+        kg_inds = np.repeat(np.arange(index.num_kg_nodes), np.diff(index.node_offsets))
+        dropped[kg_inds[np.isin(index.node_qnodes, pinned)]] = False
+    return dropped
+
+
+def selected_answers(index, max_results=None, max_connectivity=None, pinned=()):
+    '''Indices of the answers to export, best score first.'''
+    dropped = dropped_nodes(index, max_connectivity, pinned)
+    order = np.asarray(index.answer_order)
+    if dropped.any():
+        excluded = np.zeros(index.num_answers, dtype=bool)
+        kg_inds = np.repeat(np.arange(index.num_kg_nodes), np.diff(index.node_offsets))
+        excluded[np.asarray(index.node_answers)[dropped[kg_inds]]] = True
+        order = order[~excluded[order]]
+    if max_results is not None:
+        order = order[:max_results]
+    return order
+
+
+def _batches(message, answer_inds):
+    for start in range(0, len(answer_inds), BATCH_SIZE):
+        batch = answer_inds[start:start + BATCH_SIZE].tolist()
+        yield batch, message.answers(batch)
+
+
+def _json_array(items):
+    yield '['
+    first = True
+    for item in items:
+        yield (_dumps(item) if first else ',' + _dumps(item))
+        first = False
+    yield ']'
+
+
+def export_answers(message, index, answer_inds):
+    '''ANSWERS: the answers themselves, as a JSON array.'''
+    def answers():
+        for _, batch in _batches(message, answer_inds):
+            yield from batch
+    return _json_array(answers())
+
+
+def _dense(message, answers):
+    node_ids = sorted({i for a in answers for ids in a['node_bindings'].values() for i in _as_list(ids)})
+    edge_ids = sorted({i for a in answers for ids in a['edge_bindings'].values() for i in _as_list(ids)})
+    nodes = dict(zip(node_ids, message.kg_nodes(node_ids)))
+    edges = dict(zip(edge_ids, message.kg_edges(edge_ids)))
+    for answer in answers:
+        dense = {k: v for k, v in answer.items() if k not in ('node_bindings', 'edge_bindings')}
+        dense['nodes'] = {
+            qnode_id: [nodes[i] for i in ids if nodes[i] is not None] if isinstance(ids, list) else nodes[ids]
+            for qnode_id, ids in answer['node_bindings'].items()
+        }
+        dense['edges'] = {
+            qedge_id: [edges[i] for i in _as_list(ids) if edges[i] is not None]
+            for qedge_id, ids in answer['edge_bindings'].items()
+        }
+        yield dense
+
+
+def export_dense(message, index, answer_inds):
+    '''DENSE: answers with their bindings replaced by the bound KG nodes and edges.'''
+    def answers():
+        for _, batch in _batches(message, answer_inds):
+            yield from _dense(message, batch)
+    return _json_array(answers())
+
+
+def export_csv(message, index, answer_inds):
+    '''CSV: one row per answer with the score and, per qnode, the bound ids and names.'''
+    qnode_ids = [n['id'] for n in message.question_graph['nodes']]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        text = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return text
+
+    writer.writerow(['score'] + [c for q in qnode_ids for c in (q, f'{q}_name')])
+    yield flush()
+    for _, batch in _batches(message, answer_inds):
+        node_ids = sorted({i for a in batch for ids in a['node_bindings'].values() for i in _as_list(ids)})
+        names = {
+            node_id: (node or {}).get('name', '')
+            for node_id, node in zip(node_ids, message.kg_nodes(node_ids))
+        }
+        for answer in batch:
+            row = [answer.get('score')]
+            for qnode_id in qnode_ids:
+                ids = _as_list(answer['node_bindings'].get(qnode_id, []))
+                row.append('|'.join(str(i) for i in ids))
+                row.append('|'.join('' if names[i] is None else str(names[i]) for i in ids))
+            writer.writerow(row)
+        yield flush()
+
+
+def export_message(message, index, answer_inds, max_connectivity=None):
+    '''
+    MESSAGE: a complete message with the selected answers and the KG nodes
+    and edges they bind (plus the end nodes of those edges).
+    '''
+    dropped = dropped_nodes(index, max_connectivity, pinned_qnodes(message.question_graph, index))
+    selected = np.zeros(index.num_answers, dtype=bool)
+    selected[answer_inds] = True
+
+    node_answers = np.asarray(index.node_answers)
+    kg_node_inds = np.repeat(np.arange(index.num_kg_nodes), np.diff(index.node_offsets))
+    edge_answers = np.asarray(index.edge_answers)
+    kg_edge_inds = np.repeat(np.arange(index.num_kg_edges), np.diff(index.edge_offsets))
+
+    edge_source = np.asarray(index.edge_source)
+    edge_target = np.asarray(index.edge_target)
+    keep_edges = np.zeros(index.num_kg_edges, dtype=bool)
+    keep_edges[kg_edge_inds[selected[edge_answers]]] = True
+    keep_edges &= (edge_source < 0) | ~dropped[edge_source]
+    keep_edges &= (edge_target < 0) | ~dropped[edge_target]
+
+    keep_nodes = np.zeros(index.num_kg_nodes, dtype=bool)
+    keep_nodes[kg_node_inds[selected[node_answers]]] = True
+    ends = np.concatenate([edge_source[keep_edges], edge_target[keep_edges]])
+    keep_nodes[ends[ends >= 0]] = True
+    keep_nodes &= ~dropped
+
+    def chunks(items_at, positions):
+        for start in range(0, len(positions), BATCH_SIZE):
+            yield from items_at(positions[start:start + BATCH_SIZE].tolist())
+
+    yield '{"question_graph":' + _dumps(message.question_graph)
+    yield ',"knowledge_graph":{"nodes":'
+    yield from _json_array(chunks(message.kg_nodes_at, np.flatnonzero(keep_nodes)))
+    yield ',"edges":'
+    yield from _json_array(chunks(message.kg_edges_at, np.flatnonzero(keep_edges)))
+    yield '},"answers":'
+    yield from export_answers(message, index, answer_inds)
+    yield '}'
+
+
+def export(output_format, message, index, max_results=None, max_connectivity=None):
+    '''Chunks of message in output_format (one of FORMATS).'''
+    pinned = pinned_qnodes(message.question_graph, index)
+    answer_inds = selected_answers(index, max_results, max_connectivity, pinned)
+    logger.debug(f'Exporting {len(answer_inds)} answers as {output_format}')
+    if output_format == 'MESSAGE':
+        return export_message(message, index, answer_inds, max_connectivity)
+    if output_format == 'DENSE':
+        return export_dense(message, index, answer_inds)
+    if output_format == 'CSV':
+        return export_csv(message, index, answer_inds)
+    return export_answers(message, index, answer_inds)
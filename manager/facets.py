@@ -0,0 +1,174 @@
+'''
+Precomputed facet tables for filtering the answers of a stored message
+
+For every question node and facet (the id, name and type of the KG nodes
+bound to it), the distinct values and, for each, the answers that bind a
+node with that value. A filter selects values per question node and facet;
+answers must match one selected value of every facet given. Filtering and
+recounting are then array operations over the postings, with no per-answer
+Python work.
+
+Written next to the message as a directory of .npy arrays, per facet:
+
+    <facet>_values          distinct values (utf-8), sorted
+    <facet>_keys            qnode index * len(values) + value index, sorted
+    <facet>_offsets         answers of key k are [offsets[k], offsets[k+1])
+    <facet>_answers         answer indices, sorted within each key
+    <facet>_answer_offsets  keys of answer a are [answer_offsets[a], answer_offsets[a+1])
+    <facet>_answer_keys     positions in <facet>_keys, by answer
+
+plus VERSION. Filtering reads the postings of the selected values and
+recounting the postings of the matching answers, never the whole table.
+Matches are kept as a boolean mask over answers while filtering rather
+than stored as one bitset per value: id facets have about one value per
+answer, so stored bitsets would grow as values x answers.
+'''
+
+import os
+import logging
+
+import numpy as np
+
+from manager.array_store import write_dir_atomically, save_arrays, utf8_array
+
+logger = logging.getLogger(__name__)
+
+FACETS_VERSION = 2
+
+FACETS = ['id', 'name', 'type']
+
+# KG nodes read from the message at a time while writing
+NODE_BATCH = 4096
+
+
+def _node_values(node):
+    '''{facet: [values]} of one type-annotated KG node.'''
+    node_type = node.get('type')
+    types = node_type if isinstance(node_type, list) else [node_type]
+    return {
+        'id': [str(node['id'])],
+        'name': [str(node['name'])] if node.get('name') is not None else [],
+        'type': [str(t) for t in types if t is not None],
+    }
+
+
+def write_facets(message, index, directory):
+    '''
+    Write the facet tables of a stored message and its AnswerIndex into
+    directory. KG nodes are read NODE_BATCH at a time and only their facet
+    values are kept.
+    '''
+    answers, qnodes, kg_inds = index.binding_postings()
+    qnode_list = message.question_graph['nodes']
+    node_values = []
+    for start in range(0, index.num_kg_nodes, NODE_BATCH):
+        positions = range(start, min(start + NODE_BATCH, index.num_kg_nodes))
+        kg_nodes = index.annotated_nodes(message.kg_nodes_at(positions), positions, qnode_list)
+        node_values.extend(_node_values(node) for node in kg_nodes)
+
+    arrays = {}
+    for facet in FACETS:
+        values = sorted({v for node in node_values for v in node[facet]})
+        codes = {v: i for i, v in enumerate(values)}
+        # the value codes of every KG node, as CSR
+        node_codes = [[codes[v] for v in node[facet]] for node in node_values]
+        node_offsets = np.zeros(len(node_codes) + 1, dtype=np.int64)
+        np.cumsum([len(c) for c in node_codes], out=node_offsets[1:])
+        flat_codes = np.array([c for node in node_codes for c in node], dtype=np.int64)
+
+        # one (key, answer) pair per posting and value of its KG node
+        repeats = np.diff(node_offsets)[kg_inds]
+        starts = np.repeat(node_offsets[kg_inds], repeats)
+        within = np.arange(len(starts)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+        keys = np.repeat(qnodes, repeats) * max(len(values), 1) + flat_codes[starts + within]
+        pairs = np.unique(np.stack([keys, np.repeat(answers, repeats)], axis=1), axis=0) \
+            if len(keys) else np.zeros((0, 2), dtype=np.int64)
+        unique_keys, first = np.unique(pairs[:, 0], return_index=True)
+
+        arrays[f'{facet}_values'] = utf8_array(values)
+        arrays[f'{facet}_keys'] = unique_keys
+        arrays[f'{facet}_offsets'] = np.append(first, len(pairs)).astype(np.int64)
+        arrays[f'{facet}_answers'] = pairs[:, 1].astype(np.int32 if index.num_answers < 2**31 else np.int64)
+        by_answer = np.argsort(pairs[:, 1], kind='stable')
+        key_positions = np.repeat(np.arange(len(unique_keys), dtype=np.int64), np.diff(arrays[f'{facet}_offsets']))
+        arrays[f'{facet}_answer_offsets'] = np.zeros(index.num_answers + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pairs[:, 1], minlength=index.num_answers), out=arrays[f'{facet}_answer_offsets'][1:])
+        arrays[f'{facet}_answer_keys'] = key_positions[by_answer].astype(np.int32 if len(unique_keys) < 2**31 else np.int64)
+
+    write_dir_atomically(directory, lambda tmp: save_arrays(tmp, arrays, FACETS_VERSION))
+    logger.info(f'Wrote facets of {index.num_answers} answers: '
+                + ', '.join(f"{len(arrays[f'{f}_values'])} {f}s" for f in FACETS))
+
+
+class FacetIndex():
+    '''Read-only, memory-mapped view of a facets directory.'''
+
+    def __init__(self, directory, qnode_ids, num_answers):
+        def load(name):
+            return np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r')
+
+        self.qnode_ids = qnode_ids
+        self.qnode_index = {q: i for i, q in enumerate(qnode_ids)}
+        self.num_answers = num_answers
+        self.tables = {
+            facet: {part: load(f'{facet}_{part}') for part in ['values', 'keys', 'offsets', 'answers', 'answer_offsets', 'answer_keys']}
+            for facet in FACETS}
+
+    def _key(self, facet, q, value):
+        table = self.tables[facet]
+        values = table['values']
+        encoded = np.bytes_(str(value).encode('utf-8'))
+        v = int(np.searchsorted(values, encoded))
+        if v == len(values) or values[v] != encoded:
+            return None
+        key = q * max(len(values), 1) + v
+        k = int(np.searchsorted(table['keys'], key))
+        if k == len(table['keys']) or table['keys'][k] != key:
+            return None
+        return k
+
+    def match(self, selection):
+        '''
+        Boolean mask of the answers matching selection, a dict of
+        {qnode id: {facet: [values]}}. Raises ValueError for unknown
+        question nodes or facets.
+        '''
+        mask = np.ones(self.num_answers, dtype=bool)
+        for qnode_id, facets in selection.items():
+            if qnode_id not in self.qnode_index:
+                raise ValueError(f'No question node {qnode_id}')
+            for facet, values in facets.items():
+                if facet not in self.tables:
+                    raise ValueError(f"Facets are {', '.join(FACETS)}, not {facet}")
+                table = self.tables[facet]
+                matching = np.zeros(self.num_answers, dtype=bool)
+                for value in values:
+                    k = self._key(facet, self.qnode_index[qnode_id], value)
+                    if k is not None:
+                        matching[table['answers'][table['offsets'][k]:table['offsets'][k + 1]]] = True
+                mask &= matching
+        return mask
+
+    def counts(self, mask):
+        '''{qnode id: {facet: {value: number of answers in mask}}}, leaving out zeros.'''
+        result = {qnode_id: {} for qnode_id in self.qnode_ids}
+        selected = np.flatnonzero(mask)
+        everything = len(selected) == self.num_answers
+        for facet, table in self.tables.items():
+            for qnode_id in self.qnode_ids:
+                result[qnode_id][facet] = {}
+            if everything:
+                key_positions = table['answer_keys']
+            else:
+                # the answer-major postings of the selected answers
+                starts = table['answer_offsets'][selected]
+                lengths = table['answer_offsets'][selected + 1] - starts
+                ends = np.cumsum(lengths)
+                key_positions = table['answer_keys'][np.repeat(starts - ends + lengths, lengths) + np.arange(ends[-1] if len(ends) else 0)]
+            hits = np.bincount(key_positions, minlength=len(table['keys']))
+            nonzero = np.flatnonzero(hits)
+            num_values = max(len(table['values']), 1)
+            keys = np.asarray(table['keys'])[nonzero]
+            for q, v, count in zip((keys // num_values).tolist(), (keys % num_values).tolist(), hits[nonzero].tolist()):
+                result[self.qnode_ids[q]][facet][table['values'][v].decode('utf-8')] = count
+        return result
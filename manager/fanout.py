@@ -0,0 +1,61 @@
+'''
+Concurrent fan-out of blocking calls with a deadline
+
+Endpoints that need several upstream lookups hand them to fan_out, which
+runs them on a shared, bounded thread pool and returns whatever finished
+before the deadline. Calls still running at the deadline are abandoned;
+their upstream timeouts bound how long they keep a pool thread.
+'''
+
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+FANOUT_WORKERS = int(os.environ.get('FANOUT_WORKERS', 16))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class DeadlineExceeded(TimeoutError):
+    '''Error recorded for calls that had not finished by the deadline.'''
+
+
+def executor():
+    '''The shared thread pool, started on first use (so after any fork).'''
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix='fanout')
+    return _executor
+
+
+def fan_out(calls, deadline):
+    '''
+    Run calls, a dict of key -> zero-argument callable, concurrently.
+
+    Waits at most deadline seconds and returns (results, errors): dicts
+    keyed like calls, in the same order, holding each return value or the
+    exception raised (DeadlineExceeded for calls that did not finish).
+    '''
+    start = time.perf_counter()
+    futures = {key: executor().submit(call) for key, call in calls.items()}
+    wait(futures.values(), timeout=deadline)
+
+    results = {}
+    errors = {}
+    for key, future in futures.items():
+        if not future.done():
+            future.cancel()
+            errors[key] = DeadlineExceeded(f'{key} did not finish within {deadline} s')
+        elif future.exception() is not None:
+            errors[key] = future.exception()
+        else:
+            results[key] = future.result()
+    logger.debug(f'Fan-out of {len(calls)} calls took {time.perf_counter() - start:.3f} s, {len(errors)} failed')
+    return results, errors
@@ -0,0 +1,137 @@
+'''
+Structure checks for uploaded messages
+'''
+
+class MessageFormatError(ValueError):
+    """The uploaded document is not a well-formed message."""
+    pass
+
+
+# Expected shape of the parts of a message the viewer relies on, keyed by
+# path from the message root. ITEM stands for any array element and ANY
+# for any key of a binding map. Anything not listed is left unchecked.
+# Only the question graph is required: a message without a knowledge_graph
+# or answers is stored as one with no KG nodes, edges or answers.
+ITEM = '[]'
+ANY = '*'
+# A document may also hold the message under this key, as API responses
+# do; the viewer unwraps it the same way.
+WRAPPER = 'return value'
+MESSAGE_KEYS = {'question_graph', 'knowledge_graph', 'answers'}
+# kinds for values that are observed but not checked
+ANY_KIND = ('map', 'array', 'string', 'number', 'integer', 'double', 'boolean', 'null')
+MESSAGE_SCHEMA = {
+    (): ('map', {'question_graph'}),
+    ('question_graph',): ('map', {'nodes', 'edges'}),
+    ('question_graph', 'nodes'): ('array', None),
+    ('question_graph', 'nodes', ITEM): ('map', {'id'}),
+    ('question_graph', 'nodes', ITEM, 'id'): ('string', None),
+    ('question_graph', 'edges'): ('array', None),
+    ('question_graph', 'edges', ITEM): ('map', {'source_id', 'target_id'}),
+    ('knowledge_graph',): ('map', {'nodes', 'edges'}),
+    ('knowledge_graph', 'nodes'): ('array', None),
+    ('knowledge_graph', 'nodes', ITEM): ('map', {'id'}),
+    ('knowledge_graph', 'nodes', ITEM, 'id'): ('string', None),
+    ('knowledge_graph', 'nodes', ITEM, 'type'): (ANY_KIND, None),
+    ('knowledge_graph', 'nodes', ITEM, 'labels'): (ANY_KIND, None),
+    ('knowledge_graph', 'edges'): ('array', None),
+    ('knowledge_graph', 'edges', ITEM): ('map', {'id', 'source_id', 'target_id'}),
+    ('knowledge_graph', 'edges', ITEM, 'id'): ('string', None),
+    ('knowledge_graph', 'edges', ITEM, 'source_id'): ('string', None),
+    ('knowledge_graph', 'edges', ITEM, 'target_id'): ('string', None),
+    ('answers',): ('array', None),
+    ('answers', ITEM): ('map', {'node_bindings', 'edge_bindings'}),
+    ('answers', ITEM, 'score'): (('number', 'integer', 'double', 'null'), None),
+    ('answers', ITEM, 'node_bindings'): ('map', None),
+    ('answers', ITEM, 'node_bindings', ANY): (('string', 'array'), None),
+    ('answers', ITEM, 'node_bindings', ANY, ITEM): ('string', None),
+    ('answers', ITEM, 'edge_bindings'): ('map', None),
+    ('answers', ITEM, 'edge_bindings', ANY): (('string', 'array'), None),
+    ('answers', ITEM, 'edge_bindings', ANY, ITEM): ('string', None),
+}
+
+
+def _schema_key(path):
+    if path[:1] == (WRAPPER,):
+        path = path[1:]
+    if len(path) > 3 and path[0] == 'answers' and path[2] in ('node_bindings', 'edge_bindings'):
+        return path[:3] + (ANY,) + path[4:]
+    return path
+
+
+def _event_kind(event):
+    if event == 'start_map':
+        return 'map'
+    if event == 'start_array':
+        return 'array'
+    return event
+
+
+def validate_events(events, observer=None):
+    '''
+    Check a stream of ijson.basic_parse (event, value) pairs against MESSAGE_SCHEMA.
+
+    Only the current path is kept, so memory does not grow with the message.
+    observer(schema_key, path, value) is called for every value on a schema
+    path, with None as the value of maps and arrays. Schema keys are the
+    same for a message wrapped in WRAPPER.
+    Raises MessageFormatError on the first violation.
+    '''
+    # one frame per open container inside the schema: [path, is_map, current key, keys seen, required keys]
+    stack = []
+    # depth of nested containers below a path the schema does not cover
+    skip_depth = 0
+    started = False
+    for event, value in events:
+        if skip_depth:
+            if event in ('start_map', 'start_array'):
+                skip_depth += 1
+            elif event in ('end_map', 'end_array'):
+                skip_depth -= 1
+            continue
+
+        if event == 'map_key':
+            frame = stack[-1]
+            frame[2] = value
+            if frame[4] is not None:
+                frame[3].add(value)
+            continue
+        if event in ('end_map', 'end_array'):
+            path, _, _, seen, required = stack.pop()
+            if not path and WRAPPER in seen:
+                if seen & MESSAGE_KEYS:
+                    raise MessageFormatError(f"message has both {WRAPPER} and {', '.join(sorted(seen & MESSAGE_KEYS))}")
+                required = None
+            if required is not None and not required <= seen:
+                missing = ', '.join(sorted(required - seen))
+                raise MessageFormatError(f"{'.'.join(path) or 'message'} is missing {missing}")
+            continue
+
+        if stack:
+            parent = stack[-1]
+            path = parent[0] + ((parent[2],) if parent[1] else (ITEM,))
+        elif started:
+            raise MessageFormatError('Unexpected data after the message')
+        else:
+            path = ()
+            started = True
+        key = _schema_key(path)
+        rule = MESSAGE_SCHEMA.get(key)
+        kind = _event_kind(event)
+        if rule is None:
+            if kind in ('map', 'array'):
+                skip_depth = 1
+            continue
+        expected, required = rule
+        if isinstance(expected, str):
+            expected = (expected,)
+        if kind not in expected:
+            expected = ' or '.join(expected)
+            raise MessageFormatError(f"{'.'.join(path) or 'message'} should be {expected}, not {kind}")
+        if kind in ('map', 'array'):
+            stack.append([path, kind == 'map', None, set(), required])
+            value = None
+        if observer is not None:
+            observer(key, path, value)
+    if not started:
+        raise MessageFormatError('Empty message')
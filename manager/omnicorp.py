@@ -0,0 +1,74 @@
+'''
+Omnicorp publications for every pair of a set of curies
+
+The edge panel needs the publications shared by each pair of nodes in an
+answer, which is O(k²) pairs for k nodes. The ranker only answers one pair
+per request, so the pairs are looked up concurrently on the fan-out pool
+(over the ranker's keep-alive pool, with identical requests coalesced),
+and each result is kept in a pair cache. Omnicorp pairs are unordered, so
+the cache is keyed by the curies in sorted order.
+'''
+
+import os
+import logging
+from itertools import combinations
+
+from manager import cache, upstream
+from manager.fanout import fan_out
+
+logger = logging.getLogger(__name__)
+
+pair_cache = cache.TTLCache(
+    'omnicorp',
+    maxsize=int(os.environ.get('OMNICORP_CACHE_SIZE', 100000)),
+    ttl=float(os.environ.get('OMNICORP_CACHE_TTL', 86400)),
+    stale=float(os.environ.get('OMNICORP_CACHE_STALE', 86400)))
+
+
+def pair_key(id1, id2):
+    return (id1, id2) if id1 <= id2 else (id2, id1)
+
+
+def pair_publications(id1, id2):
+    '''Publications mentioning both curies, through the pair cache.'''
+    key = pair_key(id1, id2)
+
+    def fetch():
+        r = upstream.client('ranker').get(f'/api/omnicorp/{key[0]}/{key[1]}')
+        r.raise_for_status()
+        return r.json()
+    return pair_cache.get(key, fetch)
+
+
+def answer_curies(message, answer_index):
+    '''Distinct KG node ids bound in one answer of a stored message, in binding order.'''
+    answer = message.answers([answer_index])[0]
+    curies = []
+    for kg_ids in answer['node_bindings'].values():
+        curies.extend(kg_ids if isinstance(kg_ids, list) else [kg_ids])
+    return list(dict.fromkeys(curies))
+
+
+def all_pairs(curies, deadline):
+    '''
+    Publications of every pair of distinct curies.
+
+    Returns (results, errors): dicts keyed by sorted curie pair holding the
+    publication list or the exception of each pair. Cached pairs are
+    answered directly; the rest run concurrently for at most deadline
+    seconds.
+    '''
+    results = {}
+    calls = {}
+    for pair in dict.fromkeys(pair_key(a, b) for a, b in combinations(dict.fromkeys(curies), 2)):
+        publications = pair_cache.peek(pair)
+        if publications is not None:
+            results[pair] = publications
+        else:
+            calls[pair] = lambda pair=pair: pair_publications(*pair)
+    logger.debug(f'{len(results)} omnicorp pairs cached, {len(calls)} to look up')
+    if not calls:
+        return results, {}
+    fetched, errors = fan_out(calls, deadline)
+    results.update(fetched)
+    return results, errors
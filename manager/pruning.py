@@ -0,0 +1,167 @@
+'''
+Knowledge graph pruning for the answerset viewer
+
+Server-side version of messageAnswersetStore.annotatedPrunedKnowledgeGraph:
+every KG node gets a score vector with one entry per question node, the sum
+of the scores of the answers that bind it there. The best round(N/Q) nodes
+are kept for each question node and the remaining budget is filled with the
+best of the rest.
+'''
+
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def score_matrix(postings, scores, num_kg_nodes, num_qnodes):
+    '''(KG nodes x qnodes) matrix of summed answer scores.'''
+    answer_inds, qnode_inds, kg_inds = postings
+    flat = np.bincount(
+        kg_inds * num_qnodes + qnode_inds,
+        weights=scores[answer_inds],
+        minlength=num_kg_nodes * num_qnodes)
+    return flat.reshape(num_kg_nodes, num_qnodes)
+
+
+def _descending(candidates, agg_scores):
+    # lodash sortBy is a stable ascending sort and the store reverses it,
+    # so ties come out in reverse KG order. Keep that order here.
+    return candidates[np.argsort(agg_scores[candidates], kind='stable')[::-1]]
+
+
+class RankedNodes():
+    '''
+    The rankings select_nodes works from, computed once for a score matrix
+    so that any max_nodes is answered from prefixes of them.
+
+    ranked[q] holds the nodes scored for qnode q by descending aggregate
+    score. Nodes past the per-qnode cutoff compete for the rest of the
+    budget: by_score lists every ranked node by descending aggregate score,
+    with its rank for every qnode (-1 where it is not ranked), and only the
+    few around the end of the budget need their ties settled.
+    '''
+
+    def __init__(self, scores):
+        num_qnodes = scores.shape[1]
+        self.scores = scores
+        # summed qnode by qnode, like the store; numpy is slow at reducing short rows
+        self.agg_scores = agg_scores = np.zeros(scores.shape[0])
+        for q in range(num_qnodes):
+            agg_scores += scores[:, q]
+        # one sort serves every qnode: each ranked[q] is a subsequence of by_score
+        positive = scores > 0
+        rows = np.flatnonzero(positive.ravel()) // max(num_qnodes, 1)
+        rows = rows[np.flatnonzero(np.diff(rows, prepend=-1))]
+        self.by_score = _descending(rows, agg_scores)
+        listed = positive[self.by_score]
+        self.by_score_ranks = np.where(listed, np.cumsum(listed, axis=0) - 1, -1)
+        self.by_score_max_rank = self.by_score_ranks.max(axis=1, initial=-1)
+        self.ranked = [self.by_score[listed[:, q]] for q in range(num_qnodes)]
+
+    def select(self, max_nodes):
+        '''
+        Pick the KG node indices to keep, in display order.
+
+        Mirrors the store: round(N/Q) best nodes per question node by aggregate
+        score, then the best not yet selected nodes up to max_nodes.
+        '''
+        per_qnode = int(np.floor(max_nodes / max(len(self.ranked), 1) + 0.5))
+        selected = [ranked[:per_qnode] for ranked in self.ranked]
+        selected = np.concatenate(selected) if selected else np.zeros(0, dtype=np.int64)
+
+        # The budget counts a node once per question node it was selected for.
+        num_extra = max_nodes - len(selected)
+        if num_extra > 0:
+            past_cutoff = self.by_score_max_rank >= per_qnode
+            candidates = self.by_score[past_cutoff]
+            if len(candidates):
+                # everything scoring at least as high as the last one that fits
+                negated = -self.agg_scores[candidates]
+                end = int(np.searchsorted(negated, negated[min(num_extra, len(candidates)) - 1], side='right'))
+                candidates = candidates[:end]
+                # select_nodes lists the nodes past the cutoff qnode by qnode and
+                # breaks ties in reverse, so the later a node first appears the earlier it comes
+                ranks = self.by_score_ranks[past_cutoff][:end]
+                first_qnode = np.argmax(ranks >= per_qnode, axis=1)
+                first_rank = ranks[np.arange(end), first_qnode]
+                order = np.lexsort((-first_rank, -first_qnode, negated[:end]))
+                selected = np.concatenate([selected, candidates[order[:num_extra]]])
+
+        _, first = np.unique(selected, return_index=True)
+        return selected[np.sort(first)]
+
+
+def select_nodes(scores, max_nodes):
+    '''Pick the KG node indices to keep, in display order (see RankedNodes.select).'''
+    return RankedNodes(scores).select(max_nodes)
+
+
+def _scored_nodes(kg_nodes, keep, scores):
+    nodes = []
+    for k, kg_node in zip(keep.tolist(), kg_nodes):
+        node = dict(kg_node)
+        node['scoreVector'] = scores[k].tolist()
+        node['aggScore'] = float(scores[k].sum())
+        nodes.append(node)
+    return nodes
+
+
+# Above this fraction of the answers, a subset is scored by masking the full postings.
+SUBSET_FRACTION = 0.25
+
+
+def rank_stored_nodes(index, answers=None):
+    '''
+    RankedNodes of a stored message's AnswerIndex, scored over all answers
+    or only the given answer indices. Small subsets are rescored from their
+    own postings, so the cost follows the size of the subset.
+    '''
+    answer_scores = np.asarray(index.answer_scores)
+    if answers is None:
+        postings = index.binding_postings()
+    elif len(answers) <= SUBSET_FRACTION * index.num_answers:
+        postings = index.answer_postings(answers)
+    else:
+        postings = index.binding_postings()
+        kept = np.zeros_like(answer_scores)
+        kept[answers] = answer_scores[answers]
+        answer_scores = kept
+    scores = score_matrix(postings, answer_scores, index.num_kg_nodes, len(index.qnode_ids))
+    return RankedNodes(scores)
+
+
+def prune_stored_message(message, index, max_nodes=None, ranking=None):
+    '''
+    The pruned, type-annotated knowledge graph of a stored message (see
+    view_store.open_message). Nodes carry the same scoreVector and aggScore
+    fields the store adds. With max_nodes None every scored node is kept.
+
+    Scores come from the AnswerIndex and edges are picked from its endpoint
+    arrays, so only the kept KG nodes and edges are read from the message.
+    ranking is the message's RankedNodes (see rank_stored_nodes), possibly
+    over a subset of the answers; it is computed if not given.
+    '''
+    qnodes = message.question_graph['nodes']
+    num_kg_nodes = index.num_kg_nodes
+    if max_nodes is None:
+        max_nodes = num_kg_nodes
+    if ranking is None:
+        ranking = rank_stored_nodes(index)
+
+    scores = ranking.scores
+    keep = ranking.select(max_nodes)
+    # types were assigned when the message was indexed
+    kg_nodes = index.annotated_nodes(message.kg_nodes_at(keep.tolist()), keep, qnodes)
+    nodes = _scored_nodes(kg_nodes, keep, scores)
+
+    # Edge endpoints point at the last KG node with each id; unknown
+    # endpoints (-1) land on the spare last slot, which is never kept.
+    kept = np.zeros(num_kg_nodes + 1, dtype=bool)
+    kept[[index.kg_node_index(n['id']) for n in nodes]] = True
+    edge_source = np.asarray(index.edge_source)
+    edge_target = np.asarray(index.edge_target)
+    edges = message.kg_edges_at(np.flatnonzero(kept[edge_source] & kept[edge_target]).tolist())
+    logger.debug(f'Pruned knowledge graph from {num_kg_nodes} to {len(nodes)} nodes')
+    return {'nodes': nodes, 'edges': edges}
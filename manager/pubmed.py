@@ -0,0 +1,231 @@
+'''
+Pubmed publication lookups through the shared redis cache
+
+Publications are cached in redis under robokop_pubmed_cache_<pmid> by the
+fetch_pubmed_info celery task. All requests in a process share one redis
+connection pool. Nothing here waits on a fetch unless asked to: a miss
+starts a job and the caller polls for it. Concurrent misses for the same
+PMID share one job, claimed with SET NX on robokop_pubmed_job_<pmid>.
+The claim is released when the job is seen to finish, unless it has
+expired and been claimed by another job in the meantime.
+
+redis and celery are imported on first use, so the rest of the manager
+does not need them.
+'''
+
+import os
+import json
+import time
+import logging
+import threading
+from uuid import uuid4
+
+logger = logging.getLogger(__name__)
+
+# PMIDs read per MGET
+MGET_CHUNK = 500
+
+# Seconds a job claim lives; a fetch still running after this may be started again.
+JOB_TTL = int(os.environ.get('PUBMED_JOB_TTL', 300))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# delete KEYS[1] if it still holds ARGV[1]
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class PubmedError(RuntimeError):
+    '''The cache or the workers failed to produce a publication.'''
+
+
+def cache_key(pmid):
+    return f'robokop_pubmed_cache_{pmid}'
+
+
+def job_key(pmid):
+    return f'robokop_pubmed_job_{pmid}'
+
+
+def normalize_pmid(pmid):
+    '''"PMID:123" and 123 -> "123"'''
+    pmid = str(pmid)
+    return pmid[pmid.index(':') + 1:] if ':' in pmid else pmid
+
+
+def redis_client():
+    '''Redis client on the process-wide connection pool.'''
+    global _pool
+    import redis
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = redis.ConnectionPool(
+                    host=os.environ['PUBMED_CACHE_HOST'],
+                    port=os.environ['PUBMED_CACHE_PORT'],
+                    db=os.environ['PUBMED_CACHE_DB'],
+                    password=os.environ['PUBMED_CACHE_PASSWORD'],
+                    max_connections=int(os.environ.get('PUBMED_CACHE_POOL_SIZE', 20)))
+    return redis.Redis(connection_pool=_pool)
+
+
+def fetch_task():
+    '''The celery task that fetches a publication into the cache.'''
+    from manager.tasks import fetch_pubmed_info
+    return fetch_pubmed_info
+
+
+def dispatch(pmids, task_ids):
+    '''Send one fetch per pmid to the workers as a single group, under the given task ids.'''
+    from celery import group
+    task = fetch_task()
+    group(task.s(pmid, cache_key(pmid)).set(task_id=task_id) for pmid, task_id in zip(pmids, task_ids)).apply_async()
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def claim(client, pmids):
+    '''
+    Claim a fetch job for each pmid.
+
+    Returns (started, task_ids): the pmids this call claimed, which the
+    caller must dispatch, and the task id of every pmid, claimed here or
+    by an earlier request.
+    '''
+    started = []
+    task_ids = {}
+    for pmid in pmids:
+        for _ in range(3):
+            task_id = str(uuid4())
+            if client.set(job_key(pmid), task_id, nx=True, ex=JOB_TTL):
+                started.append(pmid)
+                break
+            task_id = _decode(client.get(job_key(pmid)))
+            if task_id is not None:
+                break
+            # the other claim expired in between; try again
+        task_ids[pmid] = task_id
+    return started, task_ids
+
+
+def release(client, pmid, task_id):
+    '''Drop the job claim on pmid if it is still task_id's. Returns whether it was.'''
+    return bool(client.eval(_RELEASE_SCRIPT, 1, job_key(pmid), task_id))
+
+
+def cached(pmid):
+    '''Publication info of pmid from the cache, or None.'''
+    pm_string = redis_client().get(cache_key(pmid))
+    return json.loads(pm_string) if pm_string is not None else None
+
+
+def start_fetch(pmid):
+    '''Make sure a fetch of pmid is running; returns its task id.'''
+    client = redis_client()
+    started, task_ids = claim(client, [pmid])
+    if started:
+        fetch_task().apply_async(args=[pmid, cache_key(pmid)], task_id=task_ids[pmid])
+        logger.debug(f'Started fetching pubmed info for {pmid}')
+    return task_ids[pmid]
+
+
+def _task_state(client, pmid, task_id):
+    '''(state, info, error) of a pmid whose fetch runs as task_id.'''
+    result = fetch_task().AsyncResult(task_id)
+    try:
+        if not result.ready():
+            return 'pending', None, None
+        status = result.get(propagate=False)
+    except _redis_errors() as err:
+        raise PubmedError('Celery results is bad: ' + str(err))
+    # let the next request try again
+    release(client, pmid, task_id)
+    if status != 'cached':
+        return 'failed', None, str(status)
+    pm_string = client.get(cache_key(pmid))
+    if pm_string is None:
+        return 'failed', None, 'Pubmed info could not be found'
+    return 'done', json.loads(pm_string), None
+
+
+def job_status(pmid, wait=0, poll_interval=0.1):
+    '''
+    ('done', info, None), ('pending', task_id, None), ('failed', None, error)
+    or ('missing', None, None) for a pmid nobody is fetching. Waits up to
+    wait seconds for a pending fetch to finish.
+    '''
+    client = redis_client()
+    deadline = time.monotonic() + wait
+    while True:
+        pm_string = client.get(cache_key(pmid))
+        if pm_string is not None:
+            return 'done', json.loads(pm_string), None
+        task_id = _decode(client.get(job_key(pmid)))
+        if task_id is None:
+            return 'missing', None, None
+        state, info, error = _task_state(client, pmid, task_id)
+        if state != 'pending':
+            return state, info, error
+        if time.monotonic() >= deadline:
+            return 'pending', task_id, None
+        time.sleep(poll_interval)
+
+
+def _redis_errors():
+    import redis
+    return (redis.exceptions.InvalidResponse, redis.exceptions.ConnectionError)
+
+
+def _mget(client, pmids):
+    values = []
+    for start in range(0, len(pmids), MGET_CHUNK):
+        values.extend(client.mget([cache_key(p) for p in pmids[start:start + MGET_CHUNK]]))
+    return values
+
+
+def lookup_batch(pmids, timeout=30, poll_interval=0.05):
+    '''
+    Yield (pmid, info, error) for every pmid as it becomes available.
+
+    Cached publications come first, from one MGET per MGET_CHUNK. Misses
+    not already being fetched go to the workers as one group; all misses
+    are yielded as their tasks finish. Anything not done after timeout
+    seconds is yielded with an error.
+    '''
+    client = redis_client()
+    pmids = list(dict.fromkeys(pmids))
+    missing = []
+    for pmid, pm_string in zip(pmids, _mget(client, pmids)):
+        if pm_string is None:
+            missing.append(pmid)
+        else:
+            yield pmid, json.loads(pm_string), None
+    if not missing:
+        return
+
+    started, task_ids = claim(client, missing)
+    if started:
+        dispatch(started, [task_ids[pmid] for pmid in started])
+    logger.debug(f'Fetching {len(started)} of {len(pmids)} publications, {len(missing) - len(started)} already running')
+
+    pending = dict(task_ids)
+    deadline = time.monotonic() + timeout
+    while pending and time.monotonic() < deadline:
+        finished = False
+        for pmid, task_id in list(pending.items()):
+            state, info, error = _task_state(client, pmid, task_id)
+            if state != 'pending':
+                del pending[pmid]
+                finished = True
+                yield pmid, info, error
+        if not finished:
+            time.sleep(poll_interval)
+    for pmid in pending:
+        yield pmid, None, f'Timed out after {timeout} s'
@@ -6,7 +6,7 @@ import os
 
 from flask import render_template
 
-from manager.setup import app
+from manager.setup import app, api_blueprint
 
 import manager.logging_config
 
@@ -14,6 +14,8 @@ import manager.logging_config
 import manager.api.misc_api
 import manager.api.simple_api
 
+app.register_blueprint(api_blueprint)
+
 @app.route('/simple/view/')
 def viewer_blank():
     """Answerset Browser with upload capablitiy."""
@@ -74,5 +74,6 @@ def handle_error(ex):
     return "Internal server error. See the logs for details.", 500
 app.register_error_handler(500, handle_error)
 app.config['PROPAGATE_EXCEPTIONS'] = True
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', 'false').lower() == 'true'
 app.url_map.strict_slashes = False
 CORS(app, resources=r'/api/*')
@@ -2,8 +2,27 @@ import os
 import json
 # import requests
 from uuid import uuid4
+from itertools import islice
+from sqlalchemy import func, and_
+from sqlalchemy.orm import joinedload, selectinload, lazyload
 from manager.setup_db import session_scope
-from manager.tables import Answerset, Question
+from manager.tables import Answer, Answerset, Question
+
+# answers per INSERT executemany in add_answerset(bulk=True)
+BULK_BATCH_SIZE = int(os.environ.get('ANSWERSET_BULK_BATCH_SIZE', 5000))
+
+LOADERS = {
+    'joined': joinedload,
+    'selectin': selectinload,
+    'lazy': lazyload,
+}
+
+
+def relationship_loads(load, *relationships):
+    """Loader options that load each relationship with the named strategy."""
+    if load not in LOADERS:
+        raise ValueError(f"load should be one of {', '.join(LOADERS)}, not {load!r}")
+    return [LOADERS[load](r) for r in relationships]
 
 # def get_questions_list():
 #     """Get list of questions."""
@@ -55,12 +74,20 @@ from manager.tables import Answerset, Question
 #     return question
 
 
-def get_question_by_id(qid):
-    '''Note this only returns JSON because the Question SQLAlchemy object dies with the session, and we need to close the session'''
+def get_question_by_id(qid, load='joined'):
+    """
+    Note this only returns JSON because the Question SQLAlchemy object dies with the session, and we need to close the session
+
+    load is how the owner and question graph are loaded: 'joined' (in the
+    same query), 'selectin' (one more query each) or 'lazy'.
+    """
     with session_scope() as session:
-        question = session.query(Question).filter(Question.id == qid).first().dump()
-    if not question:
-        raise KeyError("No such question.")
+        question = session.query(Question)\
+            .options(*relationship_loads(load, Question.owner, Question.question_graph))\
+            .filter(Question.id == qid).first()
+        if not question:
+            raise KeyError("No such question.")
+        question = question.dump()
     return question
 
 def delete_question_by_id(qid):
@@ -85,12 +112,36 @@ def get_qgraph_id_by_question_id(qid):
         raise KeyError("No such question.")
     return qgraph_id
 
-def get_answerset_by_id(aid):
+def get_answerset_by_id(aid, answers='bodies'):
+    """
+    Get answerset.
+
+    answers is what to load:
+        'bodies'   the list of answer bodies, read as one column (2 queries)
+        'objects'  the same, through Answer objects loaded with selectin (2 queries)
+        'summary'  no answers; id, qgraph_id, timestamp and num_answers (1 query)
+    """
     with session_scope() as session:
-        answerset = session.query(Answerset).filter(Answerset.id == aid).first().dump()
-    if not answerset:
-        raise KeyError("No such question.")
-    return answerset
+        if answers == 'summary':
+            row = session.query(Answerset.id, Answerset.qgraph_id, Answerset.timestamp, func.count(Answer.id))\
+                .outerjoin(Answer, and_(Answer.answerset_id == Answerset.id, Answer.qgraph_id == Answerset.qgraph_id))\
+                .filter(Answerset.id == aid)\
+                .group_by(Answerset.id, Answerset.qgraph_id, Answerset.timestamp).first()
+            if not row:
+                raise KeyError("No such answerset.")
+            return {'id': row[0], 'qgraph_id': row[1], 'timestamp': row[2], 'num_answers': row[3]}
+        if answers == 'objects':
+            answerset = session.query(Answerset)\
+                .options(selectinload(Answerset.answers))\
+                .filter(Answerset.id == aid).first()
+            if not answerset:
+                raise KeyError("No such answerset.")
+            return answerset.dump()
+        if answers != 'bodies':
+            raise ValueError(f"answers should be 'bodies', 'objects' or 'summary', not {answers!r}")
+        if not session.query(Answerset.id).filter(Answerset.id == aid).first():
+            raise KeyError("No such answerset.")
+        return [body for body, in session.query(Answer.body).filter(Answer.answerset_id == aid).order_by(Answer.id)]
 
 def add_question(q_json, qid=None, **kwargs):
     """Add question."""
@@ -103,12 +154,35 @@ def add_question(q_json, qid=None, **kwargs):
     return qid
 
 
-def add_answerset(m_json, mid=None, **kwargs):
-    """Add answerset."""
+def add_answerset(m_json, mid=None, bulk=True, **kwargs):
+    """
+    Add answerset.
+
+    With bulk, the answers are inserted with one executemany per
+    BULK_BATCH_SIZE answers instead of as Answer objects, which skips the
+    unit of work and identity map. m_json may then be any iterable of
+    answers.
+    """
     if mid is None:
         mid = str(uuid4())
 
+    if not bulk:
+        with session_scope() as session:
+            aset = Answerset(m_json, id=mid, **kwargs)
+            session.add(aset)
+        return mid
+
     with session_scope() as session:
-        aset = Answerset(m_json, id=mid, **kwargs)
+        aset = Answerset([], id=mid, **kwargs)
         session.add(aset)
-    return mid
\ No newline at end of file
+        session.flush()
+        insert = Answer.__table__.insert()
+        answers = iter(m_json)
+        while True:
+            batch = [
+                {'answerset_id': mid, 'qgraph_id': aset.qgraph_id, 'body': answer}
+                for answer in islice(answers, BULK_BATCH_SIZE)]
+            if not batch:
+                break
+            session.execute(insert, batch)
+    return mid
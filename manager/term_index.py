@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+
+'''
+On-disk prefix index of biomedical names for /api/search
+
+The index answers "names starting with this prefix" in-process so
+autocomplete does not need a bionames call per keystroke. Every word start
+of every label is a key, so "fev" finds "Ebola hemorrhagic fever". Arrays
+are memory-mapped from <directory>/index:
+
+    keys.npy        normalized label suffixes starting at a word, sorted (utf-8, KEY_LENGTH bytes)
+    key_record.npy  record of each key
+    key_start.npy   offset of each key in its label
+    record_type.npy biolink type (index into types.json) of each record
+    records.bin     compact JSON of each record ({id, label, ...}), back to back
+    record_offsets.npy
+    types.json      biolink type names
+
+Records come from bulk name dumps (JSON lines with id, label and type) and
+from journal.jsonl, to which Search appends every bionames result it gets.
+A build starts from the records of the current index, so the journal is
+emptied once a build has folded it in. Rebuild to take in new journal
+entries:
+
+    python -m manager.term_index <directory> [dump.jsonl ...]
+'''
+
+import os
+import re
+import sys
+import glob
+import json
+import logging
+import threading
+from array import array
+from uuid import uuid4
+
+import numpy as np
+
+from manager.array_store import write_dir_atomically, save_arrays
+
+logger = logging.getLogger(__name__)
+
+# Longer keys are cut; longer prefixes are checked against the label instead.
+KEY_LENGTH = 48
+
+# Keys looked at per lookup, which bounds the cost of one-letter prefixes.
+MAX_SCAN = 20000
+
+
+def normalize(text):
+    return re.sub(r'\s+', ' ', text.lower()).strip()
+
+
+def _word_starts(label):
+    return [0] + [m.end() for m in re.finditer(r'[\s\-_/,(]+', label) if m.end() < len(label)]
+
+
+def _iter_records(paths):
+    '''(type, record) pairs from dump and journal files.'''
+    for path in paths:
+        if not os.path.isfile(path):
+            continue
+        with open(path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    logger.warning(f'Skipping bad line in {path}')
+                    continue
+                if not isinstance(entry, dict):
+                    logger.warning(f'Skipping bad line in {path}')
+                elif 'results' in entry:
+                    # journal entry: every result of one bionames lookup
+                    for record in entry['results']:
+                        yield entry.get('type'), record
+                else:
+                    record = dict(entry)
+                    yield record.pop('type', None), record
+
+
+def build(directory, dumps=()):
+    '''
+    Build <directory>/index from the current index, the given dumps and
+    <directory>/journal.jsonl, then empty the journal.
+    '''
+    # results journaled while this runs go to a new journal
+    journal = os.path.join(directory, 'journal.jsonl')
+    if os.path.isfile(journal):
+        os.rename(journal, os.path.join(directory, f'journal.{uuid4().hex}.folding'))
+    # including those of earlier builds that failed
+    folding = sorted(glob.glob(os.path.join(directory, 'journal.*.folding')), key=os.path.getmtime)
+
+    sources = [_iter_records(dumps), _iter_records(folding)]
+    index = os.path.join(directory, 'index')
+    if os.path.isdir(index):
+        sources.insert(0, TermIndex(index).items())
+    types = {}
+    seen = {}
+    records = []
+    for source in sources:
+        for type_name, record in source:
+            if type_name is None or not isinstance(record, dict) or not record.get('id') or not record.get('label'):
+                logger.warning(f'Skipping record without an id, label or type: {record}')
+                continue
+            # the newest record of an id and type wins
+            key = (record['id'], type_name)
+            if key in seen:
+                records[seen[key]] = None
+            seen[key] = len(records)
+            records.append((types.setdefault(type_name, len(types)), record))
+
+    num_names, num_keys = write_dir_atomically(index, lambda tmp: _write_index(tmp, records, types))
+    for path in folding:
+        os.remove(path)
+    logger.info(f'Built term index of {num_names} names under {num_keys} keys')
+
+
+def _write_index(tmp, records, types):
+    '''Write the arrays of records into tmp; returns the number of names and keys.'''
+    keys = []
+    key_record = array('q')
+    key_start = array('q')
+    record_type = array('q')
+    offsets = array('q', [0])
+    with open(os.path.join(tmp, 'records.bin'), 'wb') as blob:
+        for type_index, record in filter(None, records):
+            label = normalize(record['label'])
+            r = len(record_type)
+            for start in _word_starts(label):
+                keys.append(label[start:].encode('utf-8')[:KEY_LENGTH])
+                key_record.append(r)
+                key_start.append(start)
+            record_type.append(type_index)
+            data = json.dumps(record, separators=(',', ':')).encode('utf-8')
+            blob.write(data)
+            offsets.append(offsets[-1] + len(data))
+
+    keys = np.array(keys, dtype=f'S{KEY_LENGTH}')
+    order = np.argsort(keys, kind='stable')
+    save_arrays(tmp, {
+        'keys': keys[order],
+        'key_record': np.frombuffer(key_record, dtype=np.int64)[order],
+        'key_start': np.frombuffer(key_start, dtype=np.int64)[order],
+        'record_type': np.frombuffer(record_type, dtype=np.int64),
+        'record_offsets': np.frombuffer(offsets, dtype=np.int64),
+    })
+    with open(os.path.join(tmp, 'types.json'), 'w') as f:
+        json.dump(sorted(types, key=types.get), f)
+    return len(record_type), len(keys)
+
+
+class TermIndex():
+    '''Memory-mapped reader of a built index.'''
+
+    def __init__(self, index):
+        def load(name):
+            return np.load(os.path.join(index, f'{name}.npy'), mmap_mode='r')
+
+        self.keys = load('keys')
+        self.key_record = load('key_record')
+        self.key_start = load('key_start')
+        self.record_type = load('record_type')
+        self.record_offsets = load('record_offsets')
+        path = os.path.join(index, 'records.bin')
+        self.records = np.memmap(path, dtype=np.uint8, mode='r') if os.path.getsize(path) else np.zeros(0, np.uint8)
+        with open(os.path.join(index, 'types.json')) as f:
+            self.types = {name: i for i, name in enumerate(json.load(f))}
+
+    def _record(self, r):
+        return json.loads(bytes(self.records[self.record_offsets[r]:self.record_offsets[r + 1]]))
+
+    def items(self):
+        '''(type, record) of every record, in the order they were built.'''
+        type_names = sorted(self.types, key=self.types.get)
+        for r in range(len(self.record_type)):
+            yield type_names[self.record_type[r]], self._record(r)
+
+    def lookup(self, prefix, types, limit=50):
+        '''
+        Records of the given biolink types with a word starting with prefix,
+        closest match first, at most limit of them.
+        '''
+        prefix = normalize(prefix)
+        type_inds = [self.types[t] for t in types if t in self.types]
+        if not prefix or not type_inds:
+            return []
+        key = prefix.encode('utf-8')[:KEY_LENGTH]
+        lo = np.searchsorted(self.keys, key, side='left')
+        hi = np.searchsorted(self.keys, key + b'\xff', side='left')
+        hi = min(hi, lo + MAX_SCAN)
+        record_inds = np.asarray(self.key_record[lo:hi])
+        matching = np.isin(self.record_type[record_inds], type_inds)
+        lengths = np.char.str_len(np.asarray(self.keys[lo:hi])[matching])
+        starts = np.asarray(self.key_start[lo:hi])[matching]
+        # shortest (closest) keys first, those at the start of the label
+        # before those later in it, then each record once
+        record_inds = record_inds[matching][np.lexsort((starts, lengths))]
+        _, first = np.unique(record_inds, return_index=True)
+
+        results = []
+        for r in record_inds[np.sort(first)].tolist():
+            record = self._record(r)
+            if len(key) == KEY_LENGTH and prefix not in normalize(record['label']):
+                continue
+            results.append(record)
+            if len(results) == limit:
+                break
+        return results
+
+
+class TermIndexStore():
+    '''
+    Opens <directory>/index when it is (re)built and appends results to
+    the journal. Safe to share between threads.
+    '''
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.index = None
+        self.index_id = None
+        self.lock = threading.Lock()
+
+    def current(self):
+        '''The current TermIndex, or None if none has been built.'''
+        try:
+            stat = os.stat(os.path.join(self.directory, 'index'))
+        except FileNotFoundError:
+            return None
+        if (stat.st_ino, stat.st_mtime_ns) != self.index_id:
+            with self.lock:
+                self.index = TermIndex(os.path.join(self.directory, 'index'))
+                self.index_id = (stat.st_ino, stat.st_mtime_ns)
+        return self.index
+
+    def lookup(self, prefix, types, limit=50):
+        index = self.current()
+        return index.lookup(prefix, types, limit) if index is not None else []
+
+    def journal(self, type_name, results):
+        '''Remember the bionames results for type_name for the next build.'''
+        line = json.dumps({'type': type_name, 'results': results}, separators=(',', ':')) + '\n'
+        with open(os.path.join(self.directory, 'journal.jsonl'), 'a') as f:
+            f.write(line)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    build(sys.argv[1], sys.argv[2:])
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+
+import os
+import json
+
+import pytest
+
+from manager.answer_index import build_index
+from manager.columnar import ColumnarMessage, write_columnar
+
+
+@pytest.fixture(scope='session')
+def message_file():
+    '''Path of the answerset.json example message.'''
+    return os.path.join(os.path.dirname(__file__), '..', '..', 'answerset.json')
+
+
+def _store(message_file, directory):
+    index = build_index(message_file, os.path.join(directory, 'index'))
+    write_columnar(message_file, os.path.join(directory, 'columns'))
+    return index, ColumnarMessage(os.path.join(directory, 'columns'))
+
+
+@pytest.fixture(scope='session')
+def answerset(message_file, tmp_path_factory):
+    '''
+    (message, AnswerIndex, ColumnarMessage) of answerset.json. The message
+    dict is shared by every test; copy it before changing it.
+    '''
+    with open(message_file) as f:
+        message = json.load(f)
+    return (message,) + _store(message_file, str(tmp_path_factory.mktemp('answerset')))
+
+
+@pytest.fixture
+def store_dict(tmp_path):
+    '''Function writing a message dict into tmp_path, returning its (AnswerIndex, ColumnarMessage).'''
+    def store(message):
+        with open(tmp_path / 'message.json', 'w') as f:
+            json.dump(message, f)
+        return _store(str(tmp_path / 'message.json'), str(tmp_path))
+    return store
@@ -0,0 +1,59 @@
+'''
+Reference pruning of a message dict, straight from the JSON, that the
+stored-message path (pruning.prune_stored_message) is checked against.
+'''
+
+import numpy as np
+
+from manager.pruning import score_matrix, select_nodes, _scored_nodes
+
+
+def binding_postings(message):
+    '''
+    (answer index, qnode index, KG node index) arrays, one entry per
+    distinct binding. Bindings to question nodes or KG nodes that are not
+    in the message are dropped.
+    '''
+    qnode_index = {n['id']: i for i, n in enumerate(message['question_graph']['nodes'])}
+    kg_index = {n['id']: i for i, n in enumerate(message['knowledge_graph']['nodes'])}
+    rows = set()
+    for a, answer in enumerate(message['answers']):
+        for qnode_id, kg_ids in answer['node_bindings'].items():
+            for kg_id in kg_ids if isinstance(kg_ids, list) else [kg_ids]:
+                if qnode_id in qnode_index and kg_id in kg_index:
+                    rows.add((a, qnode_index[qnode_id], kg_index[kg_id]))
+    rows = np.array(sorted(rows), dtype=np.int64).reshape(-1, 3)
+    return rows[:, 0], rows[:, 1], rows[:, 2]
+
+
+def needs_type(node):
+    '''KG nodes without a single type get the type of the qnode they are bound to most.'''
+    return isinstance(node.get('type'), list) or ('type' not in node and 'labels' in node)
+
+
+def prune_knowledge_graph(message, max_nodes=None):
+    '''The pruned, type-annotated knowledge graph of a message dict.'''
+    qnodes = message['question_graph']['nodes']
+    kg_nodes = message['knowledge_graph']['nodes']
+    num_qnodes = len(qnodes)
+    num_kg_nodes = len(kg_nodes)
+    if max_nodes is None:
+        max_nodes = num_kg_nodes
+
+    postings = binding_postings(message)
+    answer_scores = np.array([a.get('score') or 0 for a in message['answers']], dtype=np.float64)
+    scores = score_matrix(postings, answer_scores, num_kg_nodes, num_qnodes)
+    keep = select_nodes(scores, max_nodes)
+    counts = np.bincount(postings[2] * num_qnodes + postings[1], minlength=num_kg_nodes * num_qnodes)
+    counts = counts.reshape(num_kg_nodes, num_qnodes)
+    nodes = _scored_nodes([kg_nodes[k] for k in keep.tolist()], keep, scores)
+    for k, node in zip(keep.tolist(), nodes):
+        if qnodes and needs_type(node):
+            node['type'] = qnodes[int(np.argmax(counts[k]))]['type']
+
+    node_ids = {n['id'] for n in nodes}
+    edges = [
+        e for e in message['knowledge_graph']['edges']
+        if e['source_id'] in node_ids and e['target_id'] in node_ids
+    ]
+    return {'nodes': nodes, 'edges': edges}
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+import sys
+import json
+import types
+import datetime
+
+import pytest
+from sqlalchemy import create_engine, Column, String
+from sqlalchemy.orm import declarative_base, scoped_session, sessionmaker
+from sqlalchemy.schema import CreateTable
+
+import manager.setup
+
+
+@pytest.fixture(scope='module')
+def answer():
+    '''manager.answer over an in-memory SQLite database, with the db layer it expects stood in.'''
+    Base = declarative_base()
+    session = scoped_session(sessionmaker())
+    Base.query = session.query_property()
+
+    class Question(Base):
+        __tablename__ = 'question'
+        id = Column(String, primary_key=True)
+
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(manager.setup, 'db', types.SimpleNamespace(Model=Base, session=session), raising=False)
+        patch.setattr(manager.setup, 'Base', Base, raising=False)
+        patch.setitem(sys.modules, 'manager.question', types.SimpleNamespace(Question=Question))
+        patch.delitem(sys.modules, 'manager.answer', raising=False)
+        import manager.answer as module
+        patch.delitem(sys.modules, 'manager.answer')
+
+        engine = create_engine('sqlite://')
+        with engine.begin() as connection:
+            # CreateTable skips the Postgres-only after_create DDL
+            for table in Base.metadata.sorted_tables:
+                connection.execute(CreateTable(table))
+        session.configure(bind=engine)
+        yield module
+        session.remove()
+        engine.dispose()
+
+
+def answer_json(i):
+    nodes = [
+        {'id': 'MONDO:1', 'name': 'ebola', 'type': 'disease'},
+        {'id': f'HGNC:{i}', 'name': f'gene {i}', 'type': 'gene'},
+    ]
+    edges = [{
+        'source_id': 'MONDO:1', 'target_id': f'HGNC:{i}', 'type': 'causes',
+        'weight': 0.5, 'edge_source': 'test', 'publications': ['PMID:1'] * i,
+    }]
+    return {'score': i / 10, 'nodes': nodes, 'edges': edges}
+
+
+def test_iter_standard_matches_to_standard(answer):
+    answerset = answer.Answerset({'answers': [answer_json(i) for i in range(5)]})
+    answerset.timestamp = datetime.datetime(2019, 1, 1)
+    answerset.misc_info = {'natural_question': 'what?'}
+
+    for data in (True, False):
+        streamed = ''.join(answerset.iter_standard(data))
+        assert streamed == json.dumps(answerset.toStandard(data))
+    with manager.setup.app.test_request_context():
+        response = answerset.standard_response()
+        assert response.mimetype == 'application/json'
+        assert response.get_data(as_text=True) == json.dumps(answerset.toStandard())
+
+    assert answer.Answerset({}).toStandard()['response_code'] == 'EMPTY'
+    assert json.loads(''.join(answer.Answerset({}).iter_standard())) == answer.Answerset({}).toStandard()
+
+
+def test_iter_standard_streams_from_database(answer):
+    session = answer.db.session
+    session.add(answer.Answerset({'answers': [answer_json(i) for i in range(7)]}))
+    session.commit()
+    session.expunge_all()
+
+    answerset = session.query(answer.Answerset).one()
+    streamed = json.loads(''.join(answerset.iter_standard()))
+    assert 'answers' not in answerset.__dict__
+    assert streamed['message'] == '7 potential answers found.'
+    assert [a['confidence'] for a in streamed['result_list']] == [i / 10 for i in reversed(range(7))]
+    assert streamed == answerset.toStandard()
+
+
+def test_standard_header_counts_in_database(answer):
+    session = answer.db.session
+    answerset = answer.Answerset({'answers': [answer_json(i) for i in range(3)]})
+    answerset.timestamp = datetime.datetime(2019, 1, 1)
+    session.add(answerset)
+    session.commit()
+    answerset_id = answerset.id
+    session.expunge_all()
+
+    answerset = session.get(answer.Answerset, answerset_id)
+    assert answerset.standard_header() == {
+        'context': 'context',
+        'datetime': '2019-01-01T00:00:00',
+        'id': answerset_id,
+        'message': '3 potential answers found.',
+        'original_question_text': None,
+        'response_code': 'OK',
+    }
+    assert 'answers' not in answerset.__dict__
+    assert json.loads(''.join(answerset.iter_standard(False))) == dict(answerset.standard_header(), result_list=None)
+
+
+def test_standard_header_question_text(answer):
+    question = 'What genetic conditions might provide protection against Ebola?'
+    answerset = answer.Answerset({'answers': [answer_json(i) for i in range(2)], 'misc_info': {'natural_question': question}})
+    answerset.timestamp = datetime.datetime(2019, 1, 1)
+    assert answerset.standard_header()['original_question_text'] == question
+    assert json.loads(''.join(answerset.iter_standard()))['original_question_text'] == question
+    assert answerset.toStandard(False)['original_question_text'] == question
+    assert answer.Answerset({}).standard_header()['original_question_text'] is None
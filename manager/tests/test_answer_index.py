@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+import copy
+
+from pruning_reference import binding_postings
+
+
+def test_index_matches_message(answerset):
+    message, index, _ = answerset
+
+    assert index.num_answers == len(message['answers'])
+    assert [tuple(p) for p in index.binding_postings()] == [tuple(p) for p in _sorted(binding_postings(message))]
+
+    answers, qnodes = index.node_postings('HGNC:7897')
+    expected = [
+        (a, 'n1') for a, answer in enumerate(message['answers'])
+        if answer['node_bindings']['n1'] == 'HGNC:7897'
+    ]
+    assert [(a, index.qnode_ids[q]) for a, q in zip(answers, qnodes)] == expected
+
+    edge_id = message['answers'][3]['edge_bindings']['b'][0]
+    assert 3 in index.edge_postings(edge_id).tolist()
+
+
+def _sorted(postings):
+    answers, qnodes, kg = postings
+    rows = sorted(zip(kg.tolist(), answers.tolist(), qnodes.tolist()))
+    return [r[1] for r in rows], [r[2] for r in rows], [r[0] for r in rows]
+
+
+def _annotated_knowledge_graph(message):
+    '''messageAnswersetStore.annotatedKnowledgeGraph, answer by answer.'''
+    qnodes = message['question_graph']['nodes']
+    qnode_ids = [q['id'] for q in qnodes]
+    nodes = []
+    for node in message['knowledge_graph']['nodes']:
+        if isinstance(node.get('type'), list) or ('type' not in node and 'labels' in node):
+            counts = [0] * len(qnodes)
+            for answer in message['answers']:
+                for key, ids in answer['node_bindings'].items():
+                    if (node['id'] in ids if isinstance(ids, list) else ids == node['id']) and key in qnode_ids:
+                        counts[qnode_ids.index(key)] += 1
+            node = dict(node, type=qnodes[counts.index(max(counts))]['type'])
+        nodes.append(node)
+    return nodes
+
+
+def test_index_annotates_types(answerset, store_dict):
+    message = copy.deepcopy(answerset[0])
+    kg_nodes = message['knowledge_graph']['nodes']
+    # a labeled node without a type, one bound by no answer, and a typed one
+    del kg_nodes[0]['type']
+    kg_nodes[0]['labels'] = ['named_thing']
+    kg_nodes.append({'id': 'X:1', 'type': ['gene', 'named_thing']})
+    kg_nodes.append({'id': 'X:2', 'type': 'gene', 'labels': ['gene']})
+    index, _ = store_dict(message)
+
+    positions = range(len(kg_nodes))
+    annotated = index.annotated_nodes(kg_nodes, positions, message['question_graph']['nodes'])
+    assert annotated == _annotated_knowledge_graph(message)
+    assert [a['type'] for a in annotated[-2:]] == [message['question_graph']['nodes'][0]['type'], 'gene']
+    assert all(isinstance(a['type'], str) for a in annotated)
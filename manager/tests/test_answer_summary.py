@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+import random
+
+from manager import answer_summary
+from manager.answer_summary import generate_summary
+from manager.benchmarks.bench_summary import path_answer, template_answers
+
+
+def baseline_summary(nodes, edges):
+    '''generate_summary before set nodes and branches, for simple paths.'''
+    summary = nodes[0]['name']
+    latest_node_id = nodes[0]['id']
+    node_ids = [n['id'] for n in nodes]
+    edges = [e for e in edges if not e['type'] == 'literature_co-occurrence']
+    edge_starts = [e['source_id'] for e in edges]
+    edge_ends = [e['target_id'] for e in edges]
+    edge_predicates = [e['type'] for e in edges]
+    while True:
+        if latest_node_id in edge_starts:
+            idx = edge_starts.index(latest_node_id)
+            edge_starts.pop(idx)
+            latest_node_id = edge_ends.pop(idx)
+            latest_node = nodes[node_ids.index(latest_node_id)]
+            summary += f" -{edge_predicates.pop(idx)}-> {latest_node['name']}"
+        elif latest_node_id in edge_ends:
+            idx = edge_ends.index(latest_node_id)
+            edge_ends.pop(idx)
+            latest_node_id = edge_starts.pop(idx)
+            latest_node = nodes[node_ids.index(latest_node_id)]
+            summary += f" <-{edge_predicates.pop(idx)}- {latest_node['name']}"
+        else:
+            break
+    return summary
+
+
+def node(node_id, name, node_type='disease'):
+    return {'id': node_id, 'name': name, 'type': node_type}
+
+
+def edge(source, target, predicate):
+    return {'source_id': source, 'target_id': target, 'type': predicate}
+
+
+def test_paths_match_list_walker():
+    for answer in template_answers():
+        assert generate_summary(*answer) == baseline_summary(*answer)
+        assert answer_summary._walk_summary(*answer) == baseline_summary(*answer)
+    for seed in range(20):
+        answer = path_answer(random.Random(seed).randint(1, 50), seed)
+        assert generate_summary(*answer) == baseline_summary(*answer)
+        assert answer_summary._walk_summary(*answer) == baseline_summary(*answer)
+
+
+def test_small_answers_match_adjacency_walk():
+    rng = random.Random(0)
+    for _ in range(2000):
+        nodes = [node(f'N:{i}', f'node {i}', rng.choice(['gene', 'disease'])) for i in range(rng.randint(2, 6))]
+        predicates = ['treats', 'causes', 'targets', 'related_to']
+        edges = [edge(rng.choice(nodes)['id'], rng.choice(nodes)['id'], rng.choice(predicates))
+                 for _ in range(rng.randint(1, answer_summary.PATH_EDGES))]
+        rng.shuffle(nodes)
+        assert generate_summary(nodes, edges) == answer_summary._walk_summary(nodes, edges)
+
+
+def test_path():
+    nodes = [node('D', 'ebola'), node('G', 'NPC1', 'gene'), node('C', 'aspirin', 'chemical')]
+    edges = [edge('C', 'G', 'targets'), edge('D', 'C', 'literature_co-occurrence'), edge('D', 'G', 'causes')]
+    assert generate_summary(nodes, edges) == 'ebola -causes-> NPC1 <-targets- aspirin'
+
+
+def test_set_nodes_and_branches():
+    nodes = [
+        node('C', 'aspirin', 'chemical'), node('F', 'fever'), node('H', 'headache'),
+        node('G', 'PTGS2', 'gene'), node('P', 'pain', 'phenotype')]
+    edges = [
+        edge('C', 'F', 'treats'), edge('C', 'H', 'treats'),
+        edge('F', 'G', 'associated'), edge('H', 'G', 'associated'),
+        edge('C', 'P', 'treats')]
+    assert generate_summary(nodes, edges) == \
+        'aspirin -treats-> {fever, headache} -associated-> PTGS2; aspirin -treats-> pain'
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+import threading
+
+from manager.cache import TTLCache
+
+
+class Clock():
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_stale_and_eviction():
+    clock = Clock()
+    refreshes = []
+    cache = TTLCache('test', maxsize=2, ttl=10, stale=100, clock=clock, background=refreshes.append)
+    values = iter(range(100))
+    fetch = lambda: next(values)
+
+    assert cache.get('a', fetch) == 0
+    assert cache.get('a', fetch) == 0
+    clock.now = 50
+    # stale: old value now, one refresh in the background
+    assert cache.get('a', fetch) == 0
+    assert cache.get('a', fetch) == 0
+    assert len(refreshes) == 1
+    refreshes[0]()
+    assert cache.get('a', fetch) == 1
+
+    cache.get('b', fetch)
+    cache.get('c', fetch)
+    assert 'a' not in cache.entries
+    clock.now = 500
+    assert cache.get('b', fetch) == 4
+    cache.invalidate()
+    assert cache.get('b', fetch) == 5
+    assert cache.stats()['evictions'] == 1
+
+
+def test_concurrent_misses_fetch_once():
+    cache = TTLCache('test_concurrent')
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        started.set()
+        release.wait()
+        return 'value'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get('k', fetch))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    started.wait()
+    release.set()
+    for t in threads:
+        t.join()
+    assert results == ['value'] * 8
+    assert len(calls) == 1
+    assert cache.stats()['misses'] == 1
+    assert cache.key_locks == {}
+
+
+def test_key_locks_are_released():
+    cache = TTLCache('test_key_locks', maxsize=2)
+    for key in range(1000):
+        cache.get(key, lambda: key)
+    try:
+        cache.get('bad', lambda: 1 / 0)
+    except ZeroDivisionError:
+        pass
+    assert len(cache.entries) == 2
+    assert len(cache.key_locks) == 0
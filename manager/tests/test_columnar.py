@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+from manager.answer_table import answer_graph
+from manager.pruning import prune_stored_message, rank_stored_nodes
+
+from pruning_reference import prune_knowledge_graph
+
+
+def test_columnar_round_trip(answerset):
+    message, _, columns = answerset
+    assert columns.question_graph == message['question_graph']
+    assert columns.num_answers == len(message['answers'])
+    assert columns.answers(range(columns.num_answers)) == message['answers']
+    kg_nodes = message['knowledge_graph']['nodes']
+    kg_edges = message['knowledge_graph']['edges']
+    assert columns.kg_nodes_at(range(len(kg_nodes))) == kg_nodes
+    assert columns.kg_edges([e['id'] for e in kg_edges[::-1]] + ['nope']) == kg_edges[::-1] + [None]
+    assert columns.kg_nodes(['nope', kg_nodes[5]['id']]) == [None, kg_nodes[5]]
+
+
+def test_stored_pruning_matches(answerset):
+    message, index, columns = answerset
+    for max_nodes in (1, 10, 35, None):
+        assert prune_stored_message(columns, index, max_nodes) == prune_knowledge_graph(message, max_nodes)
+
+    # rankings over a subset of the answers score as if the rest were not there
+    for answers in ([3], list(range(0, len(message['answers']), 7)), list(range(1, len(message['answers'])))):
+        subset = dict(message, answers=[message['answers'][a] for a in answers])
+        ranking = rank_stored_nodes(index, answers)
+        for max_nodes in (1, 10, 35, None):
+            graph = prune_stored_message(columns, index, max_nodes, ranking)
+            expected = prune_knowledge_graph(subset, max_nodes)
+            assert [(n['id'], n['scoreVector']) for n in graph['nodes']] == \
+                [(n['id'], n['scoreVector']) for n in expected['nodes']]
+            assert graph['edges'] == expected['edges']
+
+
+def test_answer_graph(answerset):
+    message, _, columns = answerset
+    graph = answer_graph(columns, 0)
+
+    answer = message['answers'][0]
+    assert [(n['binding'], n['id']) for n in graph['node_list']] == list(answer['node_bindings'].items())
+    assert [n['type'] for n in graph['node_list']] == [n['type'] for n in message['question_graph']['nodes']]
+    bound_edges = [(i, key) for key, ids in answer['edge_bindings'].items() for i in (ids if isinstance(ids, list) else [ids])]
+    assert [(e['id'], e['binding']) for e in graph['edge_list']] == bound_edges
+    # support edges are not in the question graph
+    assert {'s3', 's154', 's155'} <= {e['binding'] for e in graph['edge_list']}
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+import io
+import csv
+import json
+from collections import Counter
+
+import pytest
+
+from manager.exporters import export
+
+LIMITS = [(None, None), (10, None), (None, 5), (10, 5), (1000, 3)]
+
+
+def as_list(ids):
+    return ids if isinstance(ids, list) else [ids]
+
+
+def bound_nodes(answer):
+    return {i for ids in answer['node_bindings'].values() for i in as_list(ids)}
+
+
+def bound_edges(answer):
+    return {i for ids in answer['edge_bindings'].values() for i in as_list(ids)}
+
+
+def dropped_ids(raw, max_connectivity):
+    if max_connectivity is None:
+        return set()
+    degree = Counter()
+    for edge in raw['knowledge_graph']['edges']:
+        degree[edge['source_id']] += 1
+        degree[edge['target_id']] += 1
+    pinned = {n['id'] for n in raw['question_graph']['nodes'] if n.get('curie')}
+    kept = {i for a in raw['answers'] for q, ids in a['node_bindings'].items() if q in pinned for i in as_list(ids)}
+    return {i for i, d in degree.items() if d > max_connectivity} - kept
+
+
+def expected_answers(raw, max_results, max_connectivity):
+    dropped = dropped_ids(raw, max_connectivity)
+    answers = sorted(raw['answers'], key=lambda a: -a['score'])
+    answers = [a for a in answers if not bound_nodes(a) & dropped]
+    return answers if max_results is None else answers[:max_results]
+
+
+def exported(output_format, answerset, max_results, max_connectivity):
+    _, index, message = answerset
+    return ''.join(export(output_format, message, index, max_results, max_connectivity))
+
+
+@pytest.mark.parametrize('max_results,max_connectivity', LIMITS)
+def test_export_answers(answerset, max_results, max_connectivity):
+    expected = expected_answers(answerset[0], max_results, max_connectivity)
+    assert json.loads(exported('ANSWERS', answerset, max_results, max_connectivity)) == expected
+
+
+def test_pinned_nodes_are_kept(answerset):
+    # the disease asked about has more edges than 5, and every answer binds it
+    answers = json.loads(exported('ANSWERS', answerset, None, 5))
+    assert 0 < len(answers) < len(answerset[0]['answers'])
+    assert len(json.loads(exported('ANSWERS', answerset, None, 0))) == 0
+
+
+@pytest.mark.parametrize('max_results,max_connectivity', LIMITS)
+def test_export_dense(answerset, max_results, max_connectivity):
+    raw = answerset[0]
+    kg_nodes = {n['id']: n for n in raw['knowledge_graph']['nodes']}
+    kg_edges = {e['id']: e for e in raw['knowledge_graph']['edges']}
+    dense = json.loads(exported('DENSE', answerset, max_results, max_connectivity))
+    expected = expected_answers(raw, max_results, max_connectivity)
+    assert [a['score'] for a in dense] == [a['score'] for a in expected]
+    for answer, original in zip(dense, expected):
+        for qnode_id, ids in original['node_bindings'].items():
+            nodes = [kg_nodes[i] for i in ids] if isinstance(ids, list) else kg_nodes[ids]
+            assert answer['nodes'][qnode_id] == nodes
+        for qedge_id, ids in original['edge_bindings'].items():
+            assert answer['edges'][qedge_id] == [kg_edges[i] for i in as_list(ids) if i in kg_edges]
+
+
+@pytest.mark.parametrize('max_results,max_connectivity', LIMITS)
+def test_export_csv(answerset, max_results, max_connectivity):
+    raw = answerset[0]
+    names = {n['id']: n.get('name', '') for n in raw['knowledge_graph']['nodes']}
+    qnode_ids = [n['id'] for n in raw['question_graph']['nodes']]
+    rows = list(csv.reader(io.StringIO(exported('CSV', answerset, max_results, max_connectivity))))
+    assert rows[0] == ['score'] + [c for q in qnode_ids for c in (q, f'{q}_name')]
+    expected = []
+    for answer in expected_answers(raw, max_results, max_connectivity):
+        row = [str(answer['score'])]
+        for qnode_id in qnode_ids:
+            ids = as_list(answer['node_bindings'].get(qnode_id, []))
+            row += ['|'.join(ids), '|'.join(names[i] for i in ids)]
+        expected.append(row)
+    assert rows[1:] == expected
+
+
+def test_export_csv_names(answerset, store_dict):
+    raw = json.loads(json.dumps(answerset[0]))
+    answer = raw['answers'][len(raw['answers']) // 2]
+    node_ids = sorted(bound_nodes(answer))
+    for node in raw['knowledge_graph']['nodes']:
+        if node['id'] == node_ids[0]:
+            node['name'] = 12345
+        elif node['id'] == node_ids[1]:
+            node['name'] = None
+    index, message = store_dict(raw)
+
+    text = ''.join(export('CSV', message, index))
+    assert len(list(csv.reader(io.StringIO(text)))) == len(raw['answers']) + 1
+    assert '12345' in text
+
+
+@pytest.mark.parametrize('max_results,max_connectivity', LIMITS)
+def test_export_message(answerset, max_results, max_connectivity):
+    raw = answerset[0]
+    exported_message = json.loads(exported('MESSAGE', answerset, max_results, max_connectivity))
+    answers = expected_answers(raw, max_results, max_connectivity)
+    dropped = dropped_ids(raw, max_connectivity)
+    edge_ids = {i for a in answers for i in bound_edges(a)}
+    edges = [
+        e for e in raw['knowledge_graph']['edges']
+        if e['id'] in edge_ids and not {e['source_id'], e['target_id']} & dropped]
+    node_ids = {i for a in answers for i in bound_nodes(a)}
+    node_ids |= {i for e in edges for i in (e['source_id'], e['target_id'])}
+    nodes = [n for n in raw['knowledge_graph']['nodes'] if n['id'] in node_ids and n['id'] not in dropped]
+
+    assert exported_message['question_graph'] == raw['question_graph']
+    assert exported_message['answers'] == answers
+    assert exported_message['knowledge_graph'] == {'nodes': nodes, 'edges': edges}
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from manager import facets as facets_module
+from manager.facets import FacetIndex, write_facets
+
+
+def facet_index(answerset, directory):
+    _, index, columns = answerset
+    write_facets(columns, index, directory)
+    return FacetIndex(directory, index.qnode_ids, index.num_answers)
+
+
+@pytest.fixture(scope='module')
+def facets(answerset, tmp_path_factory):
+    return facet_index(answerset, str(tmp_path_factory.mktemp('facets') / 'facets'))
+
+
+def bound_ids(answer, qnode_id):
+    ids = answer['node_bindings'].get(qnode_id, [])
+    return set(ids if isinstance(ids, list) else [ids])
+
+
+def test_filter_matches_answers(answerset, facets):
+    message = answerset[0]
+    kg_nodes = {n['id']: n for n in message['knowledge_graph']['nodes']}
+    qnode_id = message['question_graph']['nodes'][-1]['id']
+    counts = Counter(i for a in message['answers'] for i in bound_ids(a, qnode_id))
+    wanted = [counts.most_common()[0][0], counts.most_common()[-1][0]]
+
+    mask = facets.match({qnode_id: {'id': wanted + ['nope']}})
+    expected = [bool(bound_ids(a, qnode_id) & set(wanted)) for a in message['answers']]
+    assert mask.tolist() == expected
+
+    name = kg_nodes[wanted[0]]['name']
+    mask = facets.match({qnode_id: {'id': wanted, 'name': [name]}})
+    expected = [any(kg_nodes[i]['name'] == name for i in bound_ids(a, qnode_id) & set(wanted))
+                for a in message['answers']]
+    assert mask.tolist() == expected
+
+    # counts over everything are the number of answers binding each node
+    assert facets.counts(np.ones(facets.num_answers, dtype=bool))[qnode_id]['id'] == dict(counts)
+    assert facets.counts(facets.match({qnode_id: {'id': wanted[:1]}}))[qnode_id]['id'][wanted[0]] == counts[wanted[0]]
+
+
+def test_filter_errors(facets):
+    with pytest.raises(ValueError):
+        facets.match({'nope': {'id': []}})
+    with pytest.raises(ValueError):
+        facets.match({facets.qnode_ids[0]: {'color': ['red']}})
+    assert not facets.match({facets.qnode_ids[0]: {'type': ['nope']}}).any()
+
+
+def test_nodes_are_read_in_batches(answerset, facets, tmp_path, monkeypatch):
+    monkeypatch.setattr(facets_module, 'NODE_BATCH', 7)
+    batched = facet_index(answerset, str(tmp_path / 'facets'))
+    everything = np.ones(facets.num_answers, dtype=bool)
+    assert batched.counts(everything) == facets.counts(everything)
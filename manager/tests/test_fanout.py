@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+
+import time
+
+from manager.fanout import fan_out, DeadlineExceeded
+
+
+def test_fan_out_runs_concurrently_and_keeps_partial_results():
+    def sleep(seconds, value):
+        def call():
+            time.sleep(seconds)
+            return value
+        return call
+
+    def fail():
+        raise ValueError('nope')
+
+    start = time.perf_counter()
+    results, errors = fan_out({
+        'a': sleep(0.2, 'A'),
+        'b': sleep(0.2, 'B'),
+        'slow': sleep(2, 'S'),
+        'bad': fail,
+    }, deadline=0.5)
+    assert time.perf_counter() - start < 1
+    assert results == {'a': 'A', 'b': 'B'}
+    assert isinstance(errors['slow'], DeadlineExceeded)
+    assert isinstance(errors['bad'], ValueError)
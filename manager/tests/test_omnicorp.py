@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+import threading
+
+import requests
+
+from manager import omnicorp, upstream
+
+
+class FakeRanker():
+    def __init__(self, fail=()):
+        self.paths = []
+        self.fail = fail
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        with self.lock:
+            self.paths.append(path)
+        response = requests.Response()
+        _, _, _, id1, id2 = path.split('/')
+        response.status_code = 503 if id1 in self.fail or id2 in self.fail else 200
+        response._content = f'["{id1}+{id2}"]'.encode()
+        return response
+
+
+def test_all_pairs(monkeypatch):
+    omnicorp.pair_cache.invalidate()
+    ranker = FakeRanker(fail={'D:4'})
+    monkeypatch.setattr(upstream, 'client', lambda name: ranker)
+
+    results, errors = omnicorp.all_pairs(['B:2', 'A:1', 'C:3', 'A:1'], deadline=5)
+    assert results == {('A:1', 'B:2'): ['A:1+B:2'], ('B:2', 'C:3'): ['B:2+C:3'], ('A:1', 'C:3'): ['A:1+C:3']}
+    assert not errors
+    assert len(ranker.paths) == 3
+
+    # pairs are unordered: C-A is the cached A-C
+    results, errors = omnicorp.all_pairs(['C:3', 'A:1', 'D:4'], deadline=5)
+    assert results == {('A:1', 'C:3'): ['A:1+C:3']}
+    assert set(errors) == {('C:3', 'D:4'), ('A:1', 'D:4')}
+    assert len(ranker.paths) == 5
+
+
+class FakeMessage():
+    def answers(self, indices):
+        return [{'node_bindings': {'n0': 'A:1', 'n1': ['B:2', 'C:3'], 'n2': 'A:1'}} for _ in indices]
+
+
+def test_answer_curies():
+    assert omnicorp.answer_curies(FakeMessage(), 0) == ['A:1', 'B:2', 'C:3']
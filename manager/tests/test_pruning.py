@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+from manager.pruning import prune_stored_message, RankedNodes, _descending
+
+
+def baseline_select(scores, max_nodes):
+    '''select_nodes before RankedNodes, sorting each qnode's nodes on every call.'''
+    num_qnodes = scores.shape[1]
+    agg_scores = scores.sum(axis=1)
+    per_qnode = int(np.floor(max_nodes / max(num_qnodes, 1) + 0.5))
+
+    selected = []
+    unselected = []
+    for q in range(num_qnodes):
+        ranked = _descending(np.flatnonzero(scores[:, q] > 0), agg_scores)
+        if len(ranked) >= per_qnode:
+            unselected.append(ranked[per_qnode:])
+            ranked = ranked[:per_qnode]
+        selected.append(ranked)
+    selected = np.concatenate(selected) if selected else np.zeros(0, dtype=np.int64)
+
+    num_extra = max_nodes - len(selected)
+    if num_extra > 0 and unselected:
+        unselected = np.concatenate(unselected)
+        _, first = np.unique(unselected, return_index=True)
+        unselected = unselected[np.sort(first)]
+        selected = np.concatenate([selected, _descending(unselected, agg_scores)[:num_extra]])
+
+    _, first = np.unique(selected, return_index=True)
+    return selected[np.sort(first)]
+
+
+message = {
+    'question_graph': {
+        'nodes': [{'id': 'n0', 'type': 'disease'}, {'id': 'n1', 'type': 'gene'}],
+        'edges': [{'id': 'e0', 'source_id': 'n0', 'target_id': 'n1'}],
+    },
+    'knowledge_graph': {
+        'nodes': [
+            {'id': 'D', 'type': ['disease']},
+            {'id': 'G1', 'type': ['gene', 'protein']},
+            {'id': 'G2', 'labels': ['gene']},
+            {'id': 'G3', 'type': 'gene'},
+        ],
+        'edges': [
+            {'id': 'x', 'source_id': 'D', 'target_id': 'G1'},
+            {'id': 'y', 'source_id': 'D', 'target_id': 'G2'},
+            {'id': 'z', 'source_id': 'D', 'target_id': 'G3'},
+        ],
+    },
+    'answers': [
+        {'node_bindings': {'n0': 'D', 'n1': 'G1'}, 'edge_bindings': {'e0': ['x']}, 'score': 0.5},
+        {'node_bindings': {'n0': 'D', 'n1': ['G2', 'G3']}, 'edge_bindings': {'e0': ['y', 'z']}, 'score': 0.25},
+        {'node_bindings': {'n0': 'D', 'n1': 'G2'}, 'edge_bindings': {'e0': 'y'}, 'score': 0.5},
+    ],
+}
+
+
+def prune(store_dict, max_nodes):
+    index, columns = store_dict(message)
+    return prune_stored_message(columns, index, max_nodes)
+
+
+def test_prune_keeps_best_per_qnode(store_dict):
+    graph = prune(store_dict, 2)
+    assert [n['id'] for n in graph['nodes']] == ['D', 'G2']
+    assert [e['id'] for e in graph['edges']] == ['y']
+    assert graph['nodes'][1]['scoreVector'] == [0, 0.75]
+    assert graph['nodes'][1]['aggScore'] == 0.75
+
+
+def test_prune_fills_extra_nodes(store_dict):
+    graph = prune(store_dict, 3)
+    assert [n['id'] for n in graph['nodes']] == ['D', 'G2', 'G1']
+
+
+def test_prune_annotates_types(store_dict):
+    graph = prune(store_dict, None)
+    assert {n['id']: n['type'] for n in graph['nodes']} == {
+        'D': 'disease', 'G1': 'gene', 'G2': 'gene', 'G3': 'gene'}
+
+
+def test_ranked_selection_matches_sorting():
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        # few distinct scores, so there are plenty of ties
+        scores = rng.integers(0, 4, (rng.integers(1, 40), rng.integers(0, 4))).astype(float)
+        scores[rng.random(scores.shape) < 0.3] = 0
+        ranking = RankedNodes(scores)
+        for max_nodes in range(1, 50):
+            assert ranking.select(max_nodes).tolist() == baseline_select(scores, max_nodes).tolist()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+import json
+import threading
+
+from manager import pubmed
+
+
+class FakeRedis():
+    '''The redis commands pubmed uses, on a dict.'''
+
+    def __init__(self, data):
+        self.data = data
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def mget(self, keys):
+        return [self.data.get(k) for k in keys]
+
+    def set(self, key, value, nx=False, ex=None):
+        with self.lock:
+            if nx and key in self.data:
+                return None
+            self.data[key] = value
+            return True
+
+    def eval(self, script, numkeys, key, value):
+        # pubmed's only script, compare-and-delete
+        with self.lock:
+            if self.data.get(key) != value:
+                return 0
+            del self.data[key]
+            return 1
+
+
+class FakeBroker():
+    '''Runs fetch_pubmed_info "tasks" when told to, like a worker would.'''
+
+    def __init__(self, data):
+        self.data = data
+        self.sent = []
+        self.results = {}
+        # pmid -> status of fetches that finish as soon as they are sent
+        self.outcomes = {}
+
+    def apply_async(self, args, task_id):
+        self.sent.append((args[0], task_id))
+
+    def dispatch(self, pmids, task_ids):
+        self.sent.extend(zip(pmids, task_ids))
+        for pmid in pmids:
+            if pmid in self.outcomes:
+                self.run(pmid, self.outcomes[pmid])
+
+    def run(self, pmid, status='cached'):
+        task_id = next(t for p, t in self.sent if p == pmid)
+        if status == 'cached':
+            self.data[pubmed.cache_key(pmid)] = json.dumps({'uid': pmid})
+        self.results[task_id] = status
+
+    def AsyncResult(self, task_id):
+        broker = self
+
+        class Result():
+            def ready(self):
+                return task_id in broker.results
+
+            def get(self, propagate=True):
+                return broker.results[task_id]
+        return Result()
+
+
+def fakes(monkeypatch, data):
+    broker = FakeBroker(data)
+    monkeypatch.setattr(pubmed, 'redis_client', lambda: FakeRedis(data))
+    monkeypatch.setattr(pubmed, 'fetch_task', lambda: broker)
+    monkeypatch.setattr(pubmed, 'dispatch', broker.dispatch)
+    return broker
+
+
+def test_misses_share_one_job(monkeypatch):
+    data = {}
+    broker = fakes(monkeypatch, data)
+    job = pubmed.start_fetch('7')
+    assert pubmed.start_fetch('7') == job
+    assert broker.sent == [('7', job)]
+    assert pubmed.job_status('7') == ('pending', job, None)
+
+    broker.run('7')
+    assert pubmed.job_status('7') == ('done', {'uid': '7'}, None)
+
+    failed = pubmed.start_fetch('8')
+    broker.run('8', status='PMID not found')
+    assert pubmed.job_status('8') == ('failed', None, 'PMID not found')
+    # a failed job can be started again
+    assert pubmed.job_status('8') == ('missing', None, None)
+    assert pubmed.start_fetch('8') != failed
+    assert len(broker.sent) == 3
+
+
+def test_finished_job_keeps_newer_claim(monkeypatch):
+    data = {}
+    broker = fakes(monkeypatch, data)
+    old = pubmed.start_fetch('9')
+    broker.run('9', status='PMID not found')
+    # the old claim expired and another request claimed the pmid
+    data[pubmed.job_key('9')] = 'newer'
+
+    assert pubmed._task_state(pubmed.redis_client(), '9', old) == ('failed', None, 'PMID not found')
+    assert data[pubmed.job_key('9')] == 'newer'
+    assert pubmed.job_status('9') == ('pending', 'newer', None)
+
+
+def test_lookup_batch(monkeypatch):
+    data = {pubmed.cache_key(p): json.dumps({'uid': p}) for p in ['1', '2']}
+    broker = fakes(monkeypatch, data)
+    pubmed.start_fetch('4')
+    broker.run('4')
+    broker.outcomes = {'5': 'PMID not found'}
+
+    batch = pubmed.lookup_batch(['1', '3', '2', '4', '5', '6', '1'], timeout=0.2, poll_interval=0.001)
+    assert list(batch) == [
+        ('1', {'uid': '1'}, None), ('2', {'uid': '2'}, None),
+        ('4', {'uid': '4'}, None), ('5', None, 'PMID not found'),
+        ('3', None, 'Timed out after 0.2 s'), ('6', None, 'Timed out after 0.2 s')]
+    # '4' was already being fetched and was not sent again
+    assert [p for p, _ in broker.sent] == ['4', '3', '5', '6']
+
+
+def test_normalize_pmid():
+    assert pubmed.normalize_pmid('PMID:10924274') == '10924274'
+    assert pubmed.normalize_pmid(10924274) == '10924274'
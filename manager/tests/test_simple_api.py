@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+import io
+import os
+import json
+import tempfile
+
+import pytest
+
+os.environ.setdefault('ROBOKOP_HOME', tempfile.mkdtemp())
+
+from manager import view_store, compression
+from manager.setup import app, api_blueprint
+import manager.api.simple_api
+
+if 'api' not in app.blueprints:
+    app.register_blueprint(api_blueprint)
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(view_store, 'view_storage_dir', str(tmp_path))
+    monkeypatch.setattr(view_store, 'object_storage_dir', str(tmp_path / 'objects'))
+    return app.test_client()
+
+
+@pytest.fixture
+def raw(message_file):
+    with open(message_file, 'rb') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('encoding', ['identity', 'gzip', 'zstd'])
+def test_view_data(client, raw, encoding, monkeypatch):
+    if not compression.available(encoding):
+        pytest.skip(f'{encoding} is not available')
+    monkeypatch.setattr(view_store, 'STORE_ENCODING', encoding)
+    uid = view_store.store_message(io.BytesIO(raw))
+    with open(view_store.view_file(uid), 'rb') as f:
+        stored = f.read()
+    headers = {'Accept-Encoding': encoding}
+
+    response = client.get(f'/api/simple/view/{uid}', headers=headers)
+    assert response.status_code == 200
+    assert response.headers.get('Content-Encoding', 'identity') == encoding
+    assert response.get_data() == stored
+    assert 'Accept-Encoding' in response.vary
+
+    etag = response.headers['ETag']
+    response = client.get(f'/api/simple/view/{uid}', headers=dict(headers, **{'If-None-Match': etag}))
+    assert response.status_code == 304
+    assert response.get_data() == b''
+
+    response = client.get(f'/api/simple/view/{uid}', headers=dict(headers, Range='bytes=0-9'))
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes 0-9/{len(stored)}'
+    assert response.get_data() == stored[:10]
+
+
+@pytest.mark.parametrize('uid', ['0123456789abcdef0123456789abcdef', 'not-a-uid', '..', '.alias'])
+def test_view_data_unknown(client, uid):
+    response = client.get(f'/api/simple/view/{uid}', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 404
+
+
+@pytest.mark.parametrize('encoding', ['gzip', 'zstd'])
+def test_view_data_decoded(client, raw, encoding, monkeypatch):
+    if not compression.available(encoding):
+        pytest.skip(f'{encoding} is not available')
+    monkeypatch.setattr(view_store, 'STORE_ENCODING', encoding)
+    uid = view_store.store_message(io.BytesIO(raw))
+    headers = {'Accept-Encoding': 'identity'}
+
+    response = client.get(f'/api/simple/view/{uid}', headers=headers)
+    assert response.status_code == 200
+    assert 'Content-Encoding' not in response.headers
+    assert response.headers['Accept-Ranges'] == 'none'
+    assert response.get_data() == raw
+    etag = response.headers['ETag']
+
+    # the decoded message is not served in ranges
+    response = client.get(f'/api/simple/view/{uid}', headers=dict(headers, Range='bytes=0-9'))
+    assert response.status_code == 416
+    response = client.get(f'/api/simple/view/{uid}', headers=dict(headers, Range='bytes=0-9', **{'If-Range': etag}))
+    assert response.status_code == 416
+    # but whole, if it changed since If-Range
+    response = client.get(f'/api/simple/view/{uid}', headers=dict(headers, Range='bytes=0-9', **{'If-Range': '"old"'}))
+    assert (response.status_code, response.get_data()) == (200, raw)
+    response = client.get(f'/api/simple/view/{uid}', headers=dict(headers, Range='bytes=0-9', **{'If-None-Match': etag}))
+    assert response.status_code == 304
+
+
+def test_filter_body(client, raw):
+    uid = view_store.store_message(io.BytesIO(raw))
+    qnode_id = view_store.load_index(uid).qnode_ids[-1]
+
+    response = client.post(f'/api/simple/view/{uid}/filter')
+    assert (response.status_code, response.get_json()['total']) == (200, 83)
+    response = client.post(f'/api/simple/view/{uid}/filter', json={'filters': {qnode_id: {'type': ['nope']}}})
+    assert (response.status_code, response.get_json()['total']) == (200, 0)
+
+    for url in [f'/api/simple/view/{uid}/filter', f'/api/simple/view/{uid}/pruned']:
+        response = client.post(url, data='notjson')
+        assert response.status_code == 400
+        response = client.post(url, data='notjson', content_type='application/json')
+        assert response.status_code == 400
+        response = client.post(url, json={'filters': {qnode_id: {'type': 'gene'}}})
+        assert response.status_code == 400
+
+
+def test_node_types(client, raw):
+    message = json.loads(raw)
+    # a labeled node without a type, and one with a list of types like many others
+    del message['knowledge_graph']['nodes'][0]['type']
+    message['knowledge_graph']['nodes'][0]['labels'] = ['named_thing']
+    message['knowledge_graph']['nodes'][1]['type'] = ['gene', 'named_thing']
+    uid = view_store.store_message(io.BytesIO(json.dumps(message).encode('utf-8')))
+
+    response = client.get(f'/api/simple/view/{uid}/node_types')
+    assert response.status_code == 200
+    annotated = client.get(f'/api/simple/view/{uid}/knowledge_graph').get_json()['nodes']
+    expected = {
+        node['id']: typed['type']
+        for node, typed in zip(message['knowledge_graph']['nodes'], annotated) if node.get('type') != typed['type']}
+    assert response.get_json() == expected
+    assert {n['id'] for n in message['knowledge_graph']['nodes'][:2]} <= set(expected)
+    assert client.get('/api/simple/view/not-a-uid/node_types').status_code == 404
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+import os
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+# the tables need the database setup, which not every checkout has
+pytest.importorskip('manager.setup_db')
+
+from manager import tables_accessors
+from manager.tables import QGraph, Question, Answerset, Answer
+
+
+@pytest.fixture
+def engine(tmpdir, monkeypatch):
+    engine = create_engine(f"sqlite:///{os.path.join(str(tmpdir), 'main.db')}")
+
+    @event.listens_for(engine, 'connect')
+    def attach(connection, _):
+        for schema in ['public', 'private']:
+            connection.execute(f"ATTACH DATABASE '{os.path.join(str(tmpdir), schema)}.db' AS {schema}")
+
+    Question.owner.property.mapper.local_table.create(engine, checkfirst=True)
+    for table in [QGraph, Answerset, Answer, Question]:
+        table.__table__.create(engine, checkfirst=True)
+    Session = sessionmaker(bind=engine)
+
+    @contextmanager
+    def session_scope():
+        session = Session()
+        try:
+            yield session
+            session.commit()
+        except:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+    monkeypatch.setattr(tables_accessors, 'session_scope', session_scope)
+    yield engine
+    engine.dispose()
+
+
+def count_queries(engine, call):
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(engine, 'before_cursor_execute', listener)
+    try:
+        result = call()
+    finally:
+        event.remove(engine, 'before_cursor_execute', listener)
+    return result, len(statements)
+
+
+@pytest.mark.parametrize('num_answers', [1, 50])
+def test_answerset_query_count(engine, num_answers):
+    answers = [{'score': i} for i in range(num_answers)]
+    aid = tables_accessors.add_answerset(answers, qgraph_id=1)
+
+    bodies, queries = count_queries(engine, lambda: tables_accessors.get_answerset_by_id(aid))
+    assert (bodies, queries) == (answers, 2)
+    bodies, queries = count_queries(engine, lambda: tables_accessors.get_answerset_by_id(aid, answers='objects'))
+    assert sorted(b['score'] for b in bodies) == list(range(num_answers)) and queries == 2
+    summary, queries = count_queries(engine, lambda: tables_accessors.get_answerset_by_id(aid, answers='summary'))
+    assert (summary['num_answers'], queries) == (num_answers, 1)
+
+    with pytest.raises(KeyError):
+        tables_accessors.get_answerset_by_id('nope', answers='summary')
+
+
+def test_question_query_count(engine):
+    qid = tables_accessors.add_question({'natural_question': 'what?', 'question_graph': {'nodes': [], 'edges': []}})
+    question, queries = count_queries(engine, lambda: tables_accessors.get_question_by_id(qid))
+    assert question['question_graph'] == {'nodes': [], 'edges': []}
+    assert queries == 1
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+
+import json
+
+from manager.term_index import build, TermIndexStore
+
+
+def test_prefix_lookup(tmp_path):
+    dump = tmp_path / 'names.jsonl'
+    dump.write_text('\n'.join(json.dumps(r) for r in [
+        {'id': 'MONDO:0005737', 'label': 'Ebola hemorrhagic fever', 'type': 'disease'},
+        {'id': 'MONDO:0005090', 'label': 'Fever', 'type': 'disease'},
+        {'id': 'HP:0001945', 'label': 'Fever', 'type': 'phenotypic_feature'},
+        {'id': 'HGNC:7897', 'label': 'NPC1', 'type': 'gene'},
+    ]))
+    store = TermIndexStore(str(tmp_path / 'search'))
+    assert store.lookup('fev', ['disease']) == []
+
+    store.journal('gene', [{'id': 'HGNC:7897', 'label': 'NPC intracellular cholesterol transporter 1'}])
+    build(str(tmp_path / 'search'), [str(dump)])
+
+    assert [r['id'] for r in store.lookup('FEV', ['disease'])] == ['MONDO:0005090', 'MONDO:0005737']
+    assert [r['id'] for r in store.lookup('fever', ['phenotypic_feature', 'gene'])] == ['HP:0001945']
+    assert [r['id'] for r in store.lookup('ebola hem', ['disease'])] == ['MONDO:0005737']
+    # the journal entry is newer than the dump
+    assert store.lookup('cholesterol', ['gene']) == [
+        {'id': 'HGNC:7897', 'label': 'NPC intracellular cholesterol transporter 1'}]
+    assert store.lookup('npc1', ['gene']) == []
+
+
+def test_rebuild_folds_in_journal(tmp_path):
+    dump = tmp_path / 'names.jsonl'
+    dump.write_text('\n'.join([
+        json.dumps({'id': 'MONDO:0005090', 'label': 'Fever', 'type': 'disease'}),
+        json.dumps({'id': 'MONDO:0005737', 'label': 'Ebola hemorrhagic fever'}),
+        json.dumps(['not', 'a', 'record']),
+        '{"id": "truncated',
+        json.dumps({'type': 'disease', 'results': [{'id': 'MONDO:0004979'}, 'asthma']}),
+    ]))
+    directory = tmp_path / 'search'
+    store = TermIndexStore(str(directory))
+    store.journal('gene', [{'id': 'HGNC:7897', 'label': 'NPC1'}])
+    build(str(directory), [str(dump)])
+
+    assert [r['id'] for r in store.lookup('fe', ['disease'])] == ['MONDO:0005090']
+    assert store.lookup('npc1', ['gene']) == [{'id': 'HGNC:7897', 'label': 'NPC1'}]
+    assert sorted(p.name for p in directory.iterdir()) == ['index']
+
+    # without the dump or the journal, the next build keeps what was folded in
+    store.journal('disease', [{'id': 'MONDO:0004979', 'label': 'Asthma'}])
+    build(str(directory))
+    assert [r['id'] for r in store.lookup('fe', ['disease'])] == ['MONDO:0005090']
+    assert [r['id'] for r in store.lookup('a', ['disease'])] == ['MONDO:0004979']
+    assert store.lookup('npc1', ['gene']) == [{'id': 'HGNC:7897', 'label': 'NPC1'}]
+    assert sorted(p.name for p in directory.iterdir()) == ['index']
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from manager.upstream import Upstream, CircuitOpenError, SharedFlight
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    statuses = []
+    connections = set()
+    paths = []
+    delay = 0
+
+    def do_GET(self):
+        Handler.connections.add(self.client_address)
+        Handler.paths.append(self.path)
+        time.sleep(Handler.delay)
+        status = Handler.statuses.pop(0) if Handler.statuses else 200
+        body = b'{}'
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    Handler.statuses = []
+    Handler.connections = set()
+    Handler.paths = []
+    Handler.delay = 0
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{httpd.server_port}'
+    httpd.shutdown()
+
+
+def test_keep_alive_and_retries(server, monkeypatch):
+    monkeypatch.setenv('UPSTREAM_BACKOFF', '0')
+    client = Upstream('test', server)
+    for _ in range(5):
+        assert client.get('/').status_code == 200
+    assert len(Handler.connections) == 1
+
+    Handler.statuses = [503, 503]
+    assert client.get('/').status_code == 200
+    assert client.stats()['latency']['count'] == 6
+
+
+def test_circuit_breaker(server, monkeypatch):
+    monkeypatch.setenv('UPSTREAM_RETRIES', '0')
+    monkeypatch.setenv('UPSTREAM_BREAKER_FAILURES', '2')
+    client = Upstream('test', server)
+    now = [0]
+    client.breaker.clock = lambda: now[0]
+
+    Handler.statuses = [500, 500]
+    assert client.get('/').status_code == 500
+    assert client.get('/').status_code == 500
+    with pytest.raises(CircuitOpenError):
+        client.get('/')
+    assert client.stats()['circuit'] == 'open'
+
+    now[0] = 1000
+    assert client.get('/').status_code == 200
+    assert client.stats()['circuit'] == 'closed'
+    assert client.stats()['rejected'] == 1
+
+
+def in_threads(n, fn):
+    results = [None] * n
+
+    def run(i):
+        results[i] = fn(i)
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_coalescing(server):
+    client = Upstream('test', server)
+    Handler.delay = 0.2
+    responses = in_threads(8, lambda i: client.get('/same', params={'b': 1, 'a': 2}))
+    assert [r.json() for r in responses] == [{}] * 8
+    assert Handler.paths == ['/same?b=1&a=2']
+    assert client.stats()['coalescing'] == {'calls': 8, 'coalesced': 7, 'ratio': 7 / 8}
+
+    Handler.delay = 0
+    client.get('/same', params={'b': 1, 'a': 2})
+    assert len(Handler.paths) == 2
+
+
+class FakeRedis():
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, nx=False, px=None):
+        with self.lock:
+            if nx and key in self.data:
+                return None
+            self.data[key] = value
+            return True
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+def test_shared_flight(server):
+    redis = FakeRedis()
+    # two "processes", each with its own client
+    clients = [Upstream('test', server) for _ in range(2)]
+    for client in clients:
+        client.shared_flight = SharedFlight(lambda: redis, ttl=2, wait=5, poll_interval=0.01)
+    Handler.delay = 0.2
+    responses = in_threads(2, lambda i: clients[i].get('/shared'))
+    assert Handler.paths == ['/shared']
+    assert [r.status_code for r in responses] == [200, 200]
+    assert [r.json() for r in responses] == [{}, {}]
+    stats = [c.stats()['shared_coalescing'] for c in clients]
+    assert sorted(s['coalesced'] for s in stats) == [0, 1]
+    assert not any(k.startswith('robokop_flight_') and not k.startswith('robokop_flight_result_') for k in redis.data)
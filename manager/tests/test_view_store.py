@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+import io
+import os
+import json
+import tempfile
+
+import pytest
+
+os.environ.setdefault('ROBOKOP_HOME', tempfile.mkdtemp())
+
+from manager import view_store, compression
+from manager.view_store import store_message, view_file
+from manager.message_schema import MessageFormatError
+
+
+@pytest.fixture
+def empty_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(view_store, 'view_storage_dir', str(tmp_path))
+    monkeypatch.setattr(view_store, 'object_storage_dir', str(tmp_path / 'objects'))
+
+
+@pytest.mark.parametrize('encoding', ['identity', 'gzip', 'zstd'])
+def test_store_message_keeps_bytes(encoding, monkeypatch, empty_store, message_file):
+    if not compression.available(encoding):
+        pytest.skip(f'{encoding} is not available')
+    monkeypatch.setattr(view_store, 'STORE_ENCODING', encoding)
+    with open(message_file, 'rb') as f:
+        raw = f.read()
+    uid = store_message(io.BytesIO(raw))
+    assert compression.encoding_of(view_file(uid)) == encoding
+    assert b''.join(compression.decoded_chunks(view_file(uid))) == raw
+    assert view_store.open_message(uid).num_answers == 83
+    assert not [f for f in os.listdir(view_store.view_storage_dir) if f.endswith('.part')]
+    if encoding == 'gzip':
+        # no FNAME field naming the temporary file
+        with open(view_file(uid), 'rb') as f:
+            assert not f.read(4)[3] & 0x08
+
+
+@pytest.mark.parametrize('body', [
+    b'',
+    b'[]',
+    b'{"knowledge_graph": {"nodes": [], "edges": []}, "answers": []}',
+    b'{"return value": {"knowledge_graph": {"nodes": [], "edges": []}}}',
+    b'{"return value": [], "status": "OK"}',
+    b'{"return value": {"question_graph": {"nodes": [], "edges": []}}, "question_graph": {"nodes": [], "edges": []}}',
+    b'{"question_graph": {"nodes": [], "edges": []}, "knowledge_graph": {"nodes": [{"name": "x"}], "edges": []}, "answers": []}',
+    b'{"question_graph": {"nodes": [], "edges": []}, "knowledge_graph": {"nodes": [], "edges": []}, "answers": [{"node_bindings": {"n0": 1}, "edge_bindings": {}}]}',
+    b'{"question_graph": {"nodes": [], "edges": []}, "knowledge_graph": {"nodes": [], "edges": []}, "answers": []} []',
+])
+def test_store_message_rejects(body):
+    before = set(os.listdir(view_store.view_storage_dir))
+    with pytest.raises(MessageFormatError):
+        store_message(io.BytesIO(body))
+    assert set(os.listdir(view_store.view_storage_dir)) == before
+
+
+def test_store_message_unwraps(empty_store, message_file):
+    with open(message_file) as f:
+        raw = json.load(f)
+    uid = store_message(io.BytesIO(json.dumps({'status': 'OK', 'return value': raw}).encode('utf-8')))
+    message = view_store.open_message(uid)
+    assert message.question_graph == raw['question_graph']
+    assert message.answers(range(83)) == raw['answers']
+    assert view_store.load_index(uid).num_answers == 83
+
+
+def test_store_message_without_answers(empty_store):
+    uid = store_message(io.BytesIO(b'{"question_graph": {"nodes": [{"id": "n0"}], "edges": []}}'))
+    assert view_store.open_message(uid).num_answers == 0
+    assert view_store.load_index(uid).qnode_ids == ['n0']
+    assert view_store.load_index(uid).num_kg_nodes == 0
+
+
+def test_view_file_rejects_bad_uid():
+    assert view_file('../../etc/passwd') is None
+
+
+def test_duplicate_uploads_share_content(empty_store, message_file):
+    with open(message_file, 'rb') as f:
+        raw = f.read()
+    first = store_message(io.BytesIO(raw))
+    second = store_message(io.BytesIO(raw))
+    other = store_message(io.BytesIO(raw + b'\n'))
+
+    assert len({first, second, other}) == 3
+    assert view_file(first) == view_file(second) != view_file(other)
+    assert view_store.load_index(first) is view_store.load_index(second)
+    assert len([f for f in os.listdir(view_store.object_storage_dir) if '.json' in f]) == 2
+    assert view_store.open_message(second).num_answers == 83
+
+
+def test_legacy_uploads_are_read(empty_store, message_file):
+    uid = '6f1c1d4e-8a4b-4a7e-9a53-2f0c3d4b5e6f'
+    with open(message_file, 'rb') as f, open(os.path.join(view_store.view_storage_dir, f'{uid}.json'), 'wb') as out:
+        out.write(f.read())
+    assert view_file(uid) == os.path.join(view_store.view_storage_dir, f'{uid}.json')
+    assert view_store.load_index(uid).num_answers == 83
+    assert os.path.isdir(os.path.join(view_store.view_storage_dir, f'{uid}.index'))
+    assert view_store.open_message(uid).num_answers == 83
+    assert os.path.isdir(os.path.join(view_store.view_storage_dir, f'{uid}.columns'))
+
+
+def test_columnar_copy_is_built_on_first_read(monkeypatch, empty_store, message_file):
+    monkeypatch.setattr(view_store, 'STORE_COLUMNAR', False)
+    with open(message_file) as f:
+        raw = json.load(f)
+    uid = store_message(io.BytesIO(json.dumps(raw).encode('utf-8')))
+    assert not os.path.isdir(view_store.columnar_dir(uid))
+    assert not os.path.isdir(view_store.facets_dir(uid))
+
+    message = view_store.open_message(uid)
+    assert os.path.isdir(view_store.columnar_dir(uid))
+    assert message.question_graph == raw['question_graph']
+    assert message.answers([0, 82]) == [raw['answers'][0], raw['answers'][82]]
+    assert view_store.load_facets(uid).match({}).sum() == 83
+    assert os.path.isdir(view_store.facets_dir(uid))
@@ -0,0 +1,406 @@
+'''
+Shared HTTP client for upstream services
+
+Each upstream (builder, ranker, bionames) gets one requests Session with
+its own keep-alive connection pool, default timeouts, a bounded number of
+retries with exponential backoff, and a circuit breaker that fails fast
+while the service is down. Request latencies are kept in a histogram per
+upstream.
+
+Identical GETs that are in flight at the same time are coalesced: within a
+process the callers wait on one request and share its response. With
+SHARED_FLIGHT set, processes coalesce too, through the shared redis: the
+first process to claim a URL fetches it and leaves the response there for
+SHARED_TTL seconds, and the others wait for it instead of calling the
+upstream themselves.
+
+Settings come from the environment, per upstream first and then for all:
+<NAME>_CONNECT_TIMEOUT or UPSTREAM_CONNECT_TIMEOUT, and likewise
+READ_TIMEOUT, RETRIES, BACKOFF, POOL_SIZE, BREAKER_FAILURES,
+BREAKER_RESET, COALESCE, SHARED_FLIGHT and SHARED_TTL.
+'''
+
+import os
+import json
+import time
+import bisect
+import hashlib
+import logging
+import threading
+from urllib.parse import urlencode
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'CONNECT_TIMEOUT': 3.05,
+    'READ_TIMEOUT': 30.0,
+    'RETRIES': 2,
+    'BACKOFF': 0.2,
+    'POOL_SIZE': 10,
+    'BREAKER_FAILURES': 5,
+    'BREAKER_RESET': 30.0,
+    'COALESCE': 1,
+    'SHARED_FLIGHT': 0,
+    'SHARED_TTL': 2.0,
+}
+
+# upper bounds of the latency histogram buckets, in milliseconds
+LATENCY_BUCKETS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, float('inf')]
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    '''Raised instead of calling an upstream whose circuit breaker is open.'''
+
+
+def _setting(name, key):
+    value = os.environ.get(f'{name.upper()}_{key}', os.environ.get(f'UPSTREAM_{key}'))
+    return type(DEFAULTS[key])(value) if value is not None else DEFAULTS[key]
+
+
+class LatencyHistogram():
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.total_ms = 0.0
+
+    def observe(self, ms):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+
+    def stats(self):
+        return {
+            'buckets_ms': {str(b): c for b, c in zip(LATENCY_BUCKETS, self.counts)},
+            'count': self.count,
+            'mean_ms': self.total_ms / self.count if self.count else None,
+        }
+
+
+class CircuitBreaker():
+    '''
+    Opens after failures consecutive failures. While open, calls fail
+    immediately; after reset_after seconds a single trial call is let
+    through, and its outcome closes or re-opens the breaker.
+    '''
+
+    def __init__(self, failures, reset_after, clock=time.monotonic):
+        self.max_failures = failures
+        self.reset_after = reset_after
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if self.clock() - self.opened_at < self.reset_after:
+            return 'open'
+        return 'half-open'
+
+    def allow(self):
+        with self.lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def record(self, ok):
+        with self.lock:
+            self.trial_running = False
+            if ok:
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if self.failures >= self.max_failures or self.opened_at is not None:
+                self.opened_at = self.clock()
+
+
+class SingleFlight():
+    '''
+    Runs one call per key at a time; callers arriving while it runs wait
+    for it and get the same result (or exception).
+    '''
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = {'done': threading.Event()}
+                self.leaders += 1
+            else:
+                self.followers += 1
+        if not leader:
+            call['done'].wait()
+            if 'error' in call:
+                raise call['error']
+            return call['result']
+        try:
+            call['result'] = fn()
+            return call['result']
+        except Exception as err:
+            call['error'] = err
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call['done'].set()
+
+    def stats(self):
+        with self.lock:
+            calls = self.leaders + self.followers
+            return {
+                'calls': calls,
+                'coalesced': self.followers,
+                'ratio': self.followers / calls if calls else None,
+            }
+
+
+def _dump_response(response):
+    meta = {
+        'status': response.status_code,
+        'url': response.url,
+        'encoding': response.encoding,
+        'content_type': response.headers.get('Content-Type'),
+    }
+    return json.dumps(meta).encode() + b'\n' + response.content
+
+
+def _load_response(data):
+    meta, content = data.split(b'\n', 1)
+    meta = json.loads(meta)
+    response = requests.Response()
+    response.status_code = meta['status']
+    response.url = meta['url']
+    response.encoding = meta['encoding']
+    response.headers = CaseInsensitiveDict()
+    if meta['content_type'] is not None:
+        response.headers['Content-Type'] = meta['content_type']
+    response._content = content
+    return response
+
+
+class SharedFlight():
+    '''
+    Coalesces identical calls across processes through redis. The first
+    process claims robokop_flight_<digest> and stores the response under
+    robokop_flight_result_<digest> for ttl seconds; the others poll for it
+    for up to wait seconds and fall back to calling fn themselves. Server
+    errors are not shared. Any redis failure falls back to fn too.
+    '''
+
+    def __init__(self, redis_client, ttl, wait, poll_interval=0.02):
+        self.redis_client = redis_client
+        self.ttl = ttl
+        self.wait = wait
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+        self.fallbacks = 0
+
+    def _count(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _release(self, client, claim_key):
+        try:
+            client.delete(claim_key)
+        except Exception as err:
+            logger.warning(f'Could not release {claim_key}: {err}')
+
+    def do(self, key, fn):
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        claim_key = f'robokop_flight_{digest}'
+        result_key = f'robokop_flight_result_{digest}'
+        try:
+            client = self.redis_client()
+            data = client.get(result_key)
+            leader = data is None and client.set(claim_key, 1, nx=True, px=int(self.wait * 1000))
+        except Exception as err:
+            logger.warning(f'Shared flight of {key} failed: {err}')
+            client, data, leader = None, None, False
+        if leader:
+            self._count('leaders')
+            try:
+                response = fn()
+            except:
+                self._release(client, claim_key)
+                raise
+            try:
+                if response.status_code < 500:
+                    client.set(result_key, _dump_response(response), px=int(self.ttl * 1000))
+            except Exception as err:
+                logger.warning(f'Shared flight of {key} failed: {err}')
+            self._release(client, claim_key)
+            return response
+
+        try:
+            deadline = time.monotonic() + self.wait
+            while client is not None and data is None and time.monotonic() < deadline:
+                time.sleep(self.poll_interval)
+                # the result is stored before the claim is released
+                claimed = client.get(claim_key) is not None
+                data = client.get(result_key)
+                if not claimed:
+                    break
+        except Exception as err:
+            logger.warning(f'Shared flight of {key} failed: {err}')
+        if data is None:
+            self._count('fallbacks')
+            return fn()
+        self._count('followers')
+        return _load_response(data)
+
+    def stats(self):
+        with self.lock:
+            calls = self.leaders + self.followers
+            return {
+                'calls': calls,
+                'coalesced': self.followers,
+                'ratio': self.followers / calls if calls else None,
+                'fallbacks': self.fallbacks,
+            }
+
+
+def shared_redis():
+    '''The redis every manager process shares (the pubmed cache).'''
+    from manager.pubmed import redis_client
+    return redis_client()
+
+
+class Upstream():
+    '''Pooled, retrying, circuit-broken client for one upstream service.'''
+
+    def __init__(self, name, base_url):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (_setting(name, 'CONNECT_TIMEOUT'), _setting(name, 'READ_TIMEOUT'))
+        retry = Retry(
+            total=_setting(name, 'RETRIES'),
+            backoff_factor=_setting(name, 'BACKOFF'),
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            raise_on_status=False)
+        pool_size = _setting(name, 'POOL_SIZE')
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.breaker = CircuitBreaker(_setting(name, 'BREAKER_FAILURES'), _setting(name, 'BREAKER_RESET'))
+        self.latency = LatencyHistogram()
+        self.coalesce = _setting(name, 'COALESCE')
+        self.flight = SingleFlight()
+        self.shared_flight = None
+        if _setting(name, 'SHARED_FLIGHT'):
+            self.shared_flight = SharedFlight(shared_redis, _setting(name, 'SHARED_TTL'), self.timeout[1])
+        self.errors = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def request(self, method, path, **kwargs):
+        '''
+        Send a request to base_url + path. Raises CircuitOpenError while the
+        breaker is open and requests.RequestException on connection errors
+        and timeouts; HTTP error statuses are returned as usual.
+        '''
+        if not self.breaker.allow():
+            with self.lock:
+                self.rejected += 1
+            raise CircuitOpenError(f'{self.name} is unavailable (circuit open)')
+        kwargs.setdefault('timeout', self.timeout)
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, f'{self.base_url}{path}', **kwargs)
+        except requests.RequestException as err:
+            self.breaker.record(False)
+            with self.lock:
+                self.errors += 1
+                self.latency.observe((time.perf_counter() - start) * 1000)
+            logger.warning(f'{method} {self.name}{path} failed: {err}')
+            raise
+        self.breaker.record(response.status_code < 500)
+        with self.lock:
+            self.latency.observe((time.perf_counter() - start) * 1000)
+        return response
+
+    def get(self, path, **kwargs):
+        '''
+        GET base_url + path. Concurrent GETs of the same path and params
+        share one request unless coalescing is off or other request
+        options are given.
+        '''
+        if not self.coalesce or set(kwargs) - {'params'}:
+            return self.request('GET', path, **kwargs)
+        params = kwargs.get('params')
+        key = f'{self.base_url}{path}?{urlencode(sorted(params.items()) if params else [])}'
+
+        def fetch():
+            response = self.request('GET', path, **kwargs)
+            # read the body once, before it is shared between threads
+            response.content
+            return response
+
+        if self.shared_flight is not None:
+            return self.flight.do(key, lambda: self.shared_flight.do(key, fetch))
+        return self.flight.do(key, fetch)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'base_url': self.base_url,
+                'circuit': self.breaker.state,
+                'errors': self.errors,
+                'rejected': self.rejected,
+                'latency': self.latency.stats(),
+                'coalescing': self.flight.stats(),
+                'shared_coalescing': self.shared_flight.stats() if self.shared_flight is not None else None,
+            }
+
+
+# base URL of each upstream, read from the environment on first use
+BASE_URLS = {
+    'builder': lambda: f"http://{os.environ['BUILDER_HOST']}:{os.environ['BUILDER_PORT']}",
+    'ranker': lambda: f"http://{os.environ['RANKER_HOST']}:{os.environ['RANKER_PORT']}",
+    'bionames': lambda: os.environ.get('BIONAMES_URL', 'https://bionames.renci.org'),
+}
+
+upstreams = {}
+_upstreams_lock = threading.Lock()
+
+
+def client(name):
+    '''The shared client for an upstream, created on first use.'''
+    client = upstreams.get(name)
+    if client is None:
+        with _upstreams_lock:
+            client = upstreams.get(name)
+            if client is None:
+                client = upstreams[name] = Upstream(name, BASE_URLS[name]())
+    return client
+
+
+def stats():
+    '''Circuit state, error counts and latency histogram of every upstream used so far.'''
+    return {name: client.stats() for name, client in upstreams.items()}
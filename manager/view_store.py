@@ -0,0 +1,314 @@
+'''
+Storage for messages uploaded to the simple viewer
+
+Messages are stored once per content, under the sha256 of the uploaded
+bytes, in objects/: the message itself and everything derived from it
+(answer index, columnar copy, facet tables). Every upload gets a fresh uid
+that aliases its content through a small <uid>.alias file holding the
+digest, so uploading the same message again only adds an alias. Messages
+stored before that live directly under their uid and are read as before.
+
+Deduplication saves disk and the work derived from a message (index,
+columnar copy, facets), not ingestion: the digest is only known once the
+whole upload has been read, so a repeated message is still encoded to a
+temporary file and validated as it streams in.
+'''
+
+import os
+import json
+import hashlib
+import tempfile
+import logging
+from functools import lru_cache
+from uuid import uuid4, UUID
+
+import ijson
+import numpy as np
+
+from manager import compression
+from manager.answer_index import IndexBuilder, AnswerIndex, INDEX_VERSION
+from manager.array_store import read_version
+from manager.columnar import ColumnarMessage, COLUMNAR_VERSION, write_columnar
+from manager.facets import FacetIndex, FACETS_VERSION, write_facets
+from manager.pruning import rank_stored_nodes
+from manager.message_schema import validate_events, MessageFormatError
+
+logger = logging.getLogger(__name__)
+
+view_storage_dir = f"{os.environ['ROBOKOP_HOME']}/uploads/"
+if not os.path.exists(view_storage_dir):
+    os.mkdir(view_storage_dir)
+object_storage_dir = os.path.join(view_storage_dir, 'objects')
+if not os.path.exists(object_storage_dir):
+    os.mkdir(object_storage_dir)
+
+# Bytes pulled from the request per read; this bounds ingestion memory.
+CHUNK_SIZE = 64 * 1024
+
+# Convert uploads to the columnar layout as they are stored, not on first read.
+STORE_COLUMNAR = os.environ.get('VIEW_STORE_COLUMNAR', 'true').lower() == 'true'
+
+# Content coding new uploads are stored in (gzip, zstd or identity), and its level.
+STORE_ENCODING = os.environ.get('VIEW_STORE_ENCODING', 'gzip').lower()
+if not compression.available(STORE_ENCODING):
+    logger.warning(f'Cannot store views as {STORE_ENCODING}, using gzip')
+    STORE_ENCODING = 'gzip'
+STORE_LEVEL = int(os.environ['VIEW_STORE_LEVEL']) if os.environ.get('VIEW_STORE_LEVEL') else None
+
+
+@lru_cache(maxsize=4096)
+def _alias(uid):
+    # aliases never change, so only lookups that found one are cached
+    with open(os.path.join(view_storage_dir, f'{uid}.alias')) as f:
+        return f.read().strip()
+
+
+def _stem(uid):
+    """
+    Path prefix of everything stored for uid: its content in objects/, or
+    the uid itself for messages stored before aliases. Raises ValueError
+    if uid is malformed.
+    """
+    uid = str(UUID(uid))
+    try:
+        return os.path.join(object_storage_dir, _alias(uid))
+    except OSError:
+        return os.path.join(view_storage_dir, uid)
+
+
+def _content_file(stem):
+    for suffix in compression.SUFFIXES.values():
+        this_file = f'{stem}.json{suffix}'
+        if os.path.isfile(this_file):
+            return this_file
+    return None
+
+
+def view_file(uid):
+    """
+    Return the path of the stored message for uid, in whichever content
+    coding it was stored, or None if there is none or uid is malformed.
+    """
+    try:
+        return _content_file(_stem(uid))
+    except ValueError:
+        return None
+
+
+def index_dir(uid):
+    """Directory holding the answer index of a stored message."""
+    return f'{_stem(uid)}.index'
+
+
+def columnar_dir(uid):
+    """Directory holding the columnar copy of a stored message."""
+    return f'{_stem(uid)}.columns'
+
+
+def facets_dir(uid):
+    """Directory holding the facet tables of a stored message."""
+    return f'{_stem(uid)}.facets'
+
+
+def _stored_file(uid):
+    this_file = view_file(uid)
+    if this_file is None:
+        raise KeyError('No such answerset.')
+    return this_file
+
+
+def open_message(uid):
+    """
+    Open the columnar copy of a stored message, converting it first for
+    messages stored without one or by an older version of the layout.
+    Raises KeyError if there is no message for uid.
+    """
+    this_file = _stored_file(uid)
+    directory = columnar_dir(uid)
+    if read_version(directory) != COLUMNAR_VERSION:
+        logger.info(f'Converting {uid} to the columnar layout')
+        try:
+            write_columnar(this_file, directory)
+        except OSError:
+            # another worker got there first
+            if read_version(directory) != COLUMNAR_VERSION:
+                raise
+    return _open_columnar(directory, COLUMNAR_VERSION)
+
+
+@lru_cache(maxsize=64)
+def _open_columnar(directory, version):
+    return ColumnarMessage(directory)
+
+
+def load_index(uid):
+    '''
+    Open the answer index of a stored message, building it first for
+    messages stored before indexes existed or by an older version of the
+    index. Raises KeyError if there is no message for uid.
+    '''
+    this_file = _stored_file(uid)
+    directory = index_dir(uid)
+    if read_version(directory) != INDEX_VERSION:
+        logger.info(f'Building answer index for {uid}')
+        try:
+            with compression.open_decoded(this_file) as stream:
+                _walk_message(stream).write(directory)
+        except OSError:
+            # another worker got there first
+            if read_version(directory) != INDEX_VERSION:
+                raise
+    return _open_index(directory, INDEX_VERSION)
+
+
+@lru_cache(maxsize=64)
+def _open_index(directory, version):
+    return AnswerIndex(directory)
+
+
+def load_facets(uid):
+    '''
+    Open the facet tables of a stored message, building them first from
+    its index and columnar copy if they are missing or out of date. Raises
+    KeyError if there is no message for uid.
+    '''
+    index = load_index(uid)
+    directory = facets_dir(uid)
+    if read_version(directory) != FACETS_VERSION:
+        logger.info(f'Building facets for {uid}')
+        try:
+            write_facets(open_message(uid), index, directory)
+        except OSError:
+            # another worker got there first
+            if read_version(directory) != FACETS_VERSION:
+                raise
+    return _open_facets(directory, FACETS_VERSION, tuple(index.qnode_ids), index.num_answers)
+
+
+@lru_cache(maxsize=64)
+def _open_facets(directory, version, qnode_ids, num_answers):
+    return FacetIndex(directory, list(qnode_ids), num_answers)
+
+
+def load_ranking(uid, filters=None):
+    '''
+    RankedNodes for pruning the knowledge graph of a stored message, over
+    all answers or those matching filters (see FacetIndex.match). Rankings
+    are kept per view and filter, so a new max_nodes is answered from the
+    cached ones. Raises KeyError if there is no message for uid and
+    ValueError for bad filters.
+    '''
+    index = load_index(uid)
+    facets = load_facets(uid) if filters else None
+    return _ranking(index, facets, json.dumps(filters or {}, sort_keys=True))
+
+
+@lru_cache(maxsize=32)
+def _ranking(index, facets, filters):
+    # keyed by the shared index and facets, so aliases share rankings
+    answers = np.flatnonzero(facets.match(json.loads(filters))) if facets is not None else None
+    return rank_stored_nodes(index, answers)
+
+
+class _TeeReader():
+    '''File-like wrapper that copies everything read from stream into sink.'''
+
+    def __init__(self, stream, sink):
+        self.stream = stream
+        self.sink = sink
+        self.bytes_read = 0
+        self.digest = hashlib.sha256()
+
+    def read(self, size=-1):
+        if size == 0:
+            # ijson probes the stream type with read(0)
+            return b''
+        data = self.stream.read(size if size is not None and size > 0 else CHUNK_SIZE)
+        if data:
+            self.sink.write(data)
+            self.digest.update(data)
+            self.bytes_read += len(data)
+        return data
+
+
+def _walk_message(stream):
+    '''Validate the message read from stream and return its IndexBuilder.'''
+    builder = IndexBuilder()
+    try:
+        validate_events(ijson.basic_parse(stream, buf_size=CHUNK_SIZE), builder.observe)
+    except ijson.JSONError as err:
+        raise MessageFormatError(f'Invalid JSON: {str(err).splitlines()[0]}')
+    return builder
+
+
+def _write_missing(is_current, write):
+    '''Run write unless is_current(), tolerating a concurrent writer of the same content.'''
+    if is_current():
+        return
+    try:
+        write()
+    except OSError:
+        if not is_current():
+            raise
+
+
+def _new_alias(digest):
+    '''Create a fresh uid aliasing the content with digest.'''
+    for _ in range(25):
+        uid = str(uuid4())
+        if _content_file(os.path.join(view_storage_dir, uid)) is None:
+            try:
+                with open(os.path.join(view_storage_dir, f'{uid}.alias'), 'x') as f:
+                    f.write(digest)
+                return uid
+            except FileExistsError:
+                pass
+        logger.info('Generated uid already in use. Retrying')
+    raise RuntimeError('Could not find a free uid for the message')
+
+
+def store_message(stream):
+    '''
+    Validate a message as it is read from stream and write it to the view store.
+
+    The raw bytes go straight to disk, encoded in STORE_ENCODING, while
+    ijson parses and hashes them, so memory use is bounded by CHUNK_SIZE
+    rather than by the size of the message. If the same bytes were stored
+    before, the copy is dropped (after being written and validated in full)
+    and the new uid aliases the stored content and everything derived from
+    it. Otherwise the answer index collected during the same walk is
+    written alongside and, if STORE_COLUMNAR is set, the columnar copy and
+    the facet tables read from it. Without STORE_COLUMNAR both are left to
+    the first request that needs them. Returns the new uid.
+    Raises MessageFormatError for malformed messages.
+    '''
+    part = tempfile.NamedTemporaryFile(dir=view_storage_dir, suffix='.part', delete=False)
+    try:
+        with part:
+            sink = compression.encoder(part, STORE_ENCODING, STORE_LEVEL)
+            reader = _TeeReader(stream, sink)
+            builder = _walk_message(reader)
+            sink.close()
+            logger.info(f'Received {reader.bytes_read} byte message, stored {part.tell()} bytes as {STORE_ENCODING}')
+
+        digest = reader.digest.hexdigest()
+        stem = os.path.join(object_storage_dir, digest)
+        os.makedirs(object_storage_dir, exist_ok=True)
+        if _content_file(stem) is None:
+            try:
+                os.link(part.name, f'{stem}.json{compression.SUFFIXES[STORE_ENCODING]}')
+            except FileExistsError:
+                # the same message was stored concurrently
+                pass
+        else:
+            logger.info(f'Message {digest} is already stored')
+        uid = _new_alias(digest)
+    finally:
+        os.unlink(part.name)
+    _write_missing(lambda: read_version(f'{stem}.index') == INDEX_VERSION,
+                   lambda: builder.write(f'{stem}.index'))
+    if STORE_COLUMNAR:
+        _write_missing(lambda: read_version(f'{stem}.columns') == COLUMNAR_VERSION,
+                       lambda: write_columnar(_content_file(stem), f'{stem}.columns'))
+        load_facets(uid)
+    return uid
@@ -18,11 +18,13 @@ class AppConfig {
     // Other URLs that are primarily used for API calls
     this.apis = {
       viewData: id => this.url(`api/simple/view/${id}`),
+      viewNodeTypes: id => this.url(`api/simple/view/${id}/node_types`),
     };
 
     this.url = this.url.bind(this);
 
     this.viewData = this.viewData.bind(this);
+    this.viewNodeTypes = this.viewNodeTypes.bind(this);
 
     this.colors = {
       bluegray: '#f5f7fa',
@@ -42,6 +44,15 @@ class AppConfig {
     );
   }
 
+  // Types the server annotates the knowledge graph nodes of an upload with, by node id
+  viewNodeTypes(uploadId, successFun, failureFun) {
+    this.getRequest(
+      this.apis.viewNodeTypes(uploadId),
+      successFun,
+      failureFun,
+    );
+  }
+
   open(url) {
     window.open(url, '_blank'); // This will not open a new tab in all browsers, but will try
   }
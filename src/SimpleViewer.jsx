@@ -38,11 +38,15 @@ class SimpleViewer extends React.Component {
     // uses the result to set this.state
 
     if (this.props.id) {
-      // request the file
-      this.appConfig.viewData(
-        this.props.id,
-        (object) => {
-          this.parseMessage(object); // This will set state
+      // request the file, and the node types the server annotated its
+      // knowledge graph with, so the store does not count bindings for them.
+      // Without the types the store annotates the graph itself.
+      Promise.all([
+        new Promise((resolve, reject) => this.appConfig.viewData(this.props.id, resolve, reject)),
+        new Promise(resolve => this.appConfig.viewNodeTypes(this.props.id, resolve, () => resolve(null))),
+      ]).then(
+        ([object, nodeTypes]) => {
+          this.parseMessage(object, nodeTypes); // This will set state
         },
         (err) => {
           console.log(err);
@@ -63,10 +67,17 @@ class SimpleViewer extends React.Component {
       });
     }
   }
-  parseMessage(object) {
+  parseMessage(object, nodeTypes = null) {
     object = object["return value"] || object
 
     const message = _.cloneDeep(object);
+    if (nodeTypes && _.isObject(message) && _.isObject(message.knowledge_graph) && Array.isArray(message.knowledge_graph.nodes)) {
+      message.knowledge_graph.nodes.forEach((node) => {
+        if (node && _.has(nodeTypes, node.id)) {
+          node.type = nodeTypes[node.id];
+        }
+      });
+    }
 
     const hasMessage = _.isObject(message);
     const hasQGraph = hasMessage && 'question_graph' in message;